@@ -0,0 +1,23 @@
+from django.contrib import admin
+from .models import Appointment, LineItem, PatientBalance, PatientSync
+
+# Register your models here.
+@admin.register(Appointment)
+class AppointmentAdmin(admin.ModelAdmin):
+    list_display = ('id', 'patient', 'scheduled_time', 'status', 'balance_total', 'stale', 'synced_at')
+    list_filter = ('stale', 'status')
+    search_fields = ('id', 'patient')
+
+@admin.register(LineItem)
+class LineItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'appointment', 'patient', 'service_date', 'code', 'balance_total')
+    search_fields = ('id', 'appointment', 'patient')
+
+@admin.register(PatientSync)
+class PatientSyncAdmin(admin.ModelAdmin):
+    list_display = ('patient', 'synced_at')
+
+@admin.register(PatientBalance)
+class PatientBalanceAdmin(admin.ModelAdmin):
+    list_display = ('patient', 'balance_total', 'appointments', 'as_of', 'updated_at')
+    search_fields = ('patient',)
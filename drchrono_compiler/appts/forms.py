@@ -0,0 +1,36 @@
+from django import forms
+
+class AppointmentFilterForm(forms.Form):
+    """
+    Filters for the historical appointment list, applied to the local mirror
+    - Start / end date are optional
+    - Status is optional, choices are the statuses seen for the patient
+    """
+
+    start = forms.DateField(
+        required=False,
+        label='From',
+        widget=forms.DateInput(attrs={
+            'type': 'date',
+            'class': 'form-control form-control-sm',
+        }),
+    )
+    end = forms.DateField(
+        required=False,
+        label='To',
+        widget=forms.DateInput(attrs={
+            'type': 'date',
+            'class': 'form-control form-control-sm',
+        }),
+    )
+    status = forms.ChoiceField(
+        required=False,
+        label='Status',
+        widget=forms.Select(attrs={
+            'class': 'form-select form-select-sm',
+        }),
+    )
+
+    def __init__(self, *args, statuses=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['status'].choices = [('', 'Any status')] + [(s, s) for s in statuses]
@@ -0,0 +1,98 @@
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.api import api_url, iter_results
+from core.standin import StandInDrChrono
+
+DEFAULT_FIXTURE = Path(settings.BASE_DIR) / 'core' / 'standin_fixtures' / 'sample_patient.json'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the old verbose appointment listing with the lean listing (appointments + clinical_notes) "
+        "against a recorded fixture served by the local DrChrono stand-in. "
+        "Use --record with a real token to capture a new fixture."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixture', default=str(DEFAULT_FIXTURE), help='Fixture JSON to serve (or write with --record)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per listing mode')
+        parser.add_argument('--latency', type=float, default=0.05, help='Simulated seconds per request')
+        parser.add_argument('--bandwidth', type=int, default=2_000_000, help='Simulated bytes per second')
+        parser.add_argument('--record', action='store_true', help='Record a fixture from DRCHRONO_API_URL instead of benchmarking')
+        parser.add_argument('--token', help='Bearer token used with --record')
+        parser.add_argument('--patient', type=int, help='Patient id to record / benchmark (default: first in fixture)')
+
+    def handle(self, *args, **options):
+        if options['record']:
+            return self.record(options)
+
+        api = StandInDrChrono(latency=options['latency'], bandwidth=options['bandwidth'])
+        api.load_fixture(options['fixture'])
+        patient_id = options['patient'] or next(iter(api.patients))
+        since = (datetime.now() - timedelta(days=settings.APPOINTMENT_LOOKBACK_DAYS)).strftime('%Y-%m-%dT%H:%M:%S')
+
+        modes = {
+            'verbose': [('appointments', {'patient': patient_id, 'since': since, 'verbose': 'true', 'page_size': 50})],
+            'lean': [
+                ('appointments', {'patient': patient_id, 'since': since, 'page_size': 250}),
+                ('clinical_notes', {'patient': patient_id, 'since': since, 'page_size': 250}),
+            ],
+        }
+
+        with api:
+            self.stdout.write(f"{'mode':<10}{'requests':>10}{'bytes':>12}{'median ms':>12}{'min ms':>10}")
+            for mode, calls in modes.items():
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    count, size = 0, 0
+                    for path, params in calls:
+                        page_count, page_bytes = self.fetch_all(f"{api.api_url}/{path}", params)
+                        count += page_count
+                        size += page_bytes
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(
+                    f"{mode:<10}{count:>10}{size:>12,}{statistics.median(timings):>12.1f}{min(timings):>10.1f}"
+                )
+
+    def fetch_all(self, url: str, params: dict) -> tuple[int, int]:
+        """
+        Follow pagination like core.api.iter_results, return (request count, body bytes).
+        """
+        count, size = 0, 0
+        while url:
+            resp = requests.get(url, params=params, headers={'Authorization': 'Bearer bench'}, timeout=30)
+            resp.raise_for_status()
+            count += 1
+            size += len(resp.content)
+            url, params = resp.json().get('next'), None
+        return count, size
+
+    def record(self, options):
+        if not options['token'] or not options['patient']:
+            raise CommandError('--record needs --token and --patient')
+
+        token, patient_id = options['token'], options['patient']
+        since = (datetime.now() - timedelta(days=settings.APPOINTMENT_LOOKBACK_DAYS)).strftime('%Y-%m-%dT%H:%M:%S')
+        headers = {'Authorization': f'Bearer {token}'}
+
+        patient = requests.get(api_url(f'patients/{patient_id}'), headers=headers, timeout=12)
+        patient.raise_for_status()
+        fixture = {
+            'patients': [patient.json()],
+            'appointments': list(iter_results('appointments', token, {'patient': patient_id, 'since': since, 'verbose': 'true'})),
+            'line_items': list(iter_results('line_items', token, {'patient': patient_id, 'since': since})),
+        }
+        with open(options['fixture'], 'w') as out:
+            json.dump(fixture, out, separators=(',', ':'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Recorded {len(fixture['appointments'])} appointments, {len(fixture['line_items'])} line items to {options['fixture']}"
+        ))
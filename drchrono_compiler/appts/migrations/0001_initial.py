@@ -0,0 +1,56 @@
+# Generated by Django 5.2.10 on 2026-10-19 02:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSync',
+            fields=[
+                ('patient', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Appointment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('patient', models.BigIntegerField()),
+                ('scheduled_time', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(blank=True, max_length=64)),
+                ('reason', models.TextField(blank=True)),
+                ('clinical_note_pdf', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('data', models.JSONField(default=dict)),
+                ('stale', models.BooleanField(default=False)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient', 'scheduled_time'], name='appts_appoi_patient_c60696_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LineItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('appointment', models.BigIntegerField()),
+                ('patient', models.BigIntegerField()),
+                ('service_date', models.DateField(blank=True, null=True)),
+                ('code', models.CharField(blank=True, max_length=32)),
+                ('balance_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('data', models.JSONField(default=dict)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['appointment'], name='appts_linei_appoint_65c99b_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-19 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='clinical_note_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-19 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appts', '0002_appointment_clinical_note_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='clinical_note_bytes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.10 on 2026-10-19 04:24
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_subtotals(apps, schema_editor):
+    # Subtotals of the rows mirrored so far, patient balances are computed on their next read
+    Appointment = apps.get_model('appts', 'Appointment')
+    LineItem = apps.get_model('appts', 'LineItem')
+    subtotals = LineItem.objects.values_list('appointment').annotate(total=Sum('balance_total'))
+    for appointment, total in subtotals:
+        Appointment.objects.filter(id=appointment).update(balance_total=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appts', '0003_appointment_clinical_note_bytes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientBalance',
+            fields=[
+                ('patient', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('balance_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('appointments', models.PositiveIntegerField(default=0)),
+                ('as_of', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='balance_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_subtotals, migrations.RunPython.noop),
+    ]
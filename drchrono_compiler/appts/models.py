@@ -0,0 +1,77 @@
+from django.db import models
+
+# Local mirror of DrChrono appointments and line items. Primary keys are the DrChrono ids,
+# `data` keeps the raw API payload so services can keep working with plain dicts.
+# Appointments are synced from the lean (non verbose) listing plus /clinical_notes; the verbose
+# payload is only fetched at compile time for the selected appointments.
+
+
+class Appointment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    patient = models.BigIntegerField()
+    scheduled_time = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=64, blank=True)
+    reason = models.TextField(blank=True)
+    clinical_note_pdf = models.TextField(blank=True)
+    clinical_note_updated_at = models.DateTimeField(null=True, blank=True)
+    # Size of the note PDF when it was last downloaded, for compile estimates (pdf.admission)
+    clinical_note_bytes = models.PositiveIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(null=True, blank=True)
+    data = models.JSONField(default=dict)
+    # Sum of its line items' balance_total, kept by services.refresh_balances()
+    balance_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Set by change notifications, row is re-fetched on next read
+    stale = models.BooleanField(default=False)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient', 'scheduled_time']),
+        ]
+
+    def __str__(self):
+        return f"Appointment {self.id} (patient {self.patient})"
+
+
+class LineItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    appointment = models.BigIntegerField()
+    patient = models.BigIntegerField()
+    service_date = models.DateField(null=True, blank=True)
+    code = models.CharField(max_length=32, blank=True)
+    balance_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(null=True, blank=True)
+    data = models.JSONField(default=dict)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['appointment']),
+        ]
+
+    def __str__(self):
+        return f"Line item {self.id} (appointment {self.appointment})"
+
+
+class PatientSync(models.Model):
+    # Incremental sync cursor per patient
+    patient = models.BigIntegerField(primary_key=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Patient {self.patient} synced {self.synced_at}"
+
+
+class PatientBalance(models.Model):
+    # Account balance of a patient (the balance report total), materialized from the appointment subtotals
+    # whenever synced line items change (services.refresh_balances) so pages show it without summing
+    patient = models.BigIntegerField(primary_key=True)
+    balance_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Historical appointments carrying a balance
+    appointments = models.PositiveIntegerField(default=0)
+    # Day the lookback window was applied: appointments enter and leave the window as days pass
+    as_of = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Patient {self.patient} balance {self.balance_total}"
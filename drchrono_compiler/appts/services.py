@@ -0,0 +1,417 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+import httpx
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core import deadline, timing
+from core.api import DrChronoAPIError, aapi_get, api_get, iter_results, response_json
+from .forms import AppointmentFilterForm
+from .models import Appointment, LineItem, PatientBalance, PatientSync
+
+# Re-read a little before the last sync so edits saved mid-sync are not missed
+SYNC_OVERLAP = timedelta(minutes=5)
+
+
+def _parse_datetime(value):
+    """
+    Parse a DrChrono timestamp (naive, ex: 2025-01-10T09:00:00) into an aware datetime.
+    """
+    if not value:
+        return None
+    dt = parse_datetime(value)
+    if dt is None:
+        return None
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+def _note_pdf(appt: dict) -> str:
+    """
+    Return the clinical note PDF url of an appointment dict, or an empty string.
+    """
+    clinical_note = appt.get('clinical_note')
+    if isinstance(clinical_note, dict):
+        pdf = clinical_note.get('pdf')
+    elif isinstance(clinical_note, str) and clinical_note.startswith('http'):
+        pdf = clinical_note
+    else:
+        pdf = None
+
+    if not pdf or pdf == 'None':
+        return ''
+    return pdf
+
+
+def store_appointment(appt: dict) -> Appointment:
+    """
+    Insert or update the mirror row for an appointment payload.
+    Lean payloads leave the clinical note columns alone, those come from store_clinical_note.
+    """
+    defaults = {
+        'patient': appt['patient'],
+        'scheduled_time': _parse_datetime(appt.get('scheduled_time')),
+        'status': appt.get('status') or '',
+        'reason': appt.get('reason') or '',
+        'updated_at': _parse_datetime(appt.get('updated_at')),
+        'data': appt,
+        'stale': False,
+    }
+
+    # Verbose payload, note is embedded
+    if 'clinical_note' in appt:
+        clinical_note = appt['clinical_note'] if isinstance(appt['clinical_note'], dict) else {}
+        defaults['clinical_note_pdf'] = _note_pdf(appt)
+        defaults['clinical_note_updated_at'] = _parse_datetime(clinical_note.get('updated_at'))
+
+    obj, _ = Appointment.objects.update_or_create(id=appt['id'], defaults=defaults)
+    return obj
+
+
+def store_clinical_note(note: dict) -> None:
+    """
+    Copy a /clinical_notes payload onto its mirrored appointment.
+    """
+    Appointment.objects.filter(id=note['appointment']).update(
+        clinical_note_pdf=_note_pdf({'clinical_note': note}),
+        clinical_note_updated_at=_parse_datetime(note.get('updated_at')),
+    )
+
+
+def store_line_item(item: dict) -> LineItem:
+    """
+    Insert or update the mirror row for a line item payload.
+    """
+    try:
+        balance = Decimal(str(item.get('balance_total') or '0'))
+    except InvalidOperation:
+        balance = Decimal('0')
+
+    obj, _ = LineItem.objects.update_or_create(
+        id=item['id'],
+        defaults={
+            'appointment': item['appointment'],
+            'patient': item['patient'],
+            'service_date': parse_date(item.get('service_date') or ''),
+            'code': item.get('code') or '',
+            'balance_total': balance,
+            'updated_at': _parse_datetime(item.get('updated_at')),
+            'data': item,
+        },
+    )
+    return obj
+
+
+def delete_appointment(appt_id: int) -> None:
+    with transaction.atomic():
+        LineItem.objects.filter(appointment=appt_id).delete()
+        patients = list(Appointment.objects.filter(id=appt_id).values_list('patient', flat=True))
+        Appointment.objects.filter(id=appt_id).delete()
+        for patient_id in patients:
+            store_balance(patient_id)
+
+
+# ── Balances ────────────────────────────────────────────────────────────────────
+def refresh_balances(appointment_ids, patient_id: int) -> PatientBalance:
+    """
+    Recompute the subtotals of the given appointments from their mirrored line items, then the patient's balance.
+    Called with the appointments whose line items a sync stored, so unchanged appointments are never summed again.
+    """
+    appointment_ids = {int(appt_id) for appt_id in appointment_ids}
+    if appointment_ids:
+        subtotals = dict(
+            LineItem.objects.filter(appointment__in=appointment_ids)
+            .values_list('appointment').annotate(total=Sum('balance_total'))
+        )
+        changed = []
+        for appt in Appointment.objects.filter(id__in=appointment_ids).only('id', 'balance_total'):
+            subtotal = subtotals.get(appt.id) or Decimal('0')
+            if appt.balance_total != subtotal:
+                appt.balance_total = subtotal
+                changed.append(appt)
+        Appointment.objects.bulk_update(changed, ['balance_total'])
+    return store_balance(patient_id)
+
+
+def store_balance(patient_id: int) -> PatientBalance:
+    """
+    Materialize the patient's balance: the subtotals of the appointments the balance report lists.
+    """
+    totals = historical_appointments(patient_id).order_by().aggregate(
+        total=Sum('balance_total'), appointments=Count('id', filter=~Q(balance_total=0)),
+    )
+    balance, _ = PatientBalance.objects.update_or_create(patient=patient_id, defaults={
+        'balance_total': totals['total'] or Decimal('0'),
+        'appointments': totals['appointments'],
+        'as_of': timezone.localdate(),
+    })
+    return balance
+
+
+def patient_balance(patient_id: int) -> PatientBalance:
+    """
+    The patient's materialized balance, recomputed from the subtotals (no line item read) when it is
+    missing or from an earlier day.
+    """
+    balance = PatientBalance.objects.filter(patient=patient_id).first()
+    if balance is None or balance.as_of != timezone.localdate():
+        balance = store_balance(patient_id)
+    return balance
+
+
+def _refresh_stale(patient_id: int, token: str) -> None:
+    """
+    Re-fetch appointments invalidated by change notifications, along with their line items.
+    """
+    for appt in Appointment.objects.filter(patient=patient_id, stale=True):
+        resp = api_get(f"appointments/{appt.id}", token, params={'verbose': 'true'})
+        if resp.status_code == 404:
+            delete_appointment(appt.id)
+            continue
+        resp.raise_for_status()
+
+        items = list(iter_results('line_items', token, {'appointment': appt.id}))
+        with transaction.atomic():
+            store_appointment(response_json(resp))
+            LineItem.objects.filter(appointment=appt.id).exclude(id__in=[i['id'] for i in items]).delete()
+            for item in items:
+                store_line_item(item)
+            refresh_balances([appt.id], patient_id)
+
+
+@timing.span('appointment_sync')
+def sync_patient(patient_id: int, token: str, force: bool = False) -> None:
+    """
+    Bring the mirror for one patient up to date.
+    First run pulls the full lookback window, later runs only ask for records updated since the last sync.
+    Appointments are listed lean (no verbose), note links come from /clinical_notes.
+    Skipped while the last sync is younger than APPOINTMENT_SYNC_INTERVAL, unless rows were invalidated.
+    The mirror is shared by every user, so the patient is read with `token` first, even when the sync is skipped:
+    a user DrChrono does not let read the patient gets an HTTPError (404) instead of a mirror.
+    The first (full window) sync is authoritative, rows of the patient it did not list are dropped.
+    Raises requests.HTTPError / requests.RequestException on API failure.
+    """
+    access = api_get(f"patients/{patient_id}", token)
+    access.raise_for_status()
+
+    state, _ = PatientSync.objects.get_or_create(patient=patient_id)
+    now = timezone.now()
+
+    if state.synced_at and not force and now - state.synced_at < timedelta(seconds=settings.APPOINTMENT_SYNC_INTERVAL):
+        _refresh_stale(patient_id, token)
+        return
+
+    full = state.synced_at is None
+    if full:
+        since = now - timedelta(days=settings.APPOINTMENT_LOOKBACK_DAYS)
+    else:
+        since = state.synced_at - SYNC_OVERLAP
+    since_str = since.strftime('%Y-%m-%dT%H:%M:%S')
+
+    appointments = list(iter_results('appointments', token, {
+        'patient': patient_id,
+        'since': since_str,
+        'page_size': 250,
+    }))
+    notes = list(iter_results('clinical_notes', token, {
+        'patient': patient_id,
+        'since': since_str,
+        'page_size': 250,
+    }))
+    line_items = list(iter_results('line_items', token, {
+        'patient': patient_id,
+        'since': since_str,
+        'page_size': 250,
+    }))
+
+    with transaction.atomic():
+        if full:
+            # Ex: rows a change notification created before the first sync, for appointments since deleted
+            listed = [appt['id'] for appt in appointments]
+            gone = Appointment.objects.filter(patient=patient_id).exclude(id__in=listed)
+            LineItem.objects.filter(appointment__in=gone.values('id')).delete()
+            gone.delete()
+        for appt in appointments:
+            store_appointment(appt)
+        for note in notes:
+            store_clinical_note(note)
+        for item in line_items:
+            store_line_item(item)
+        refresh_balances({item['appointment'] for item in line_items}, patient_id)
+        state.synced_at = now
+        state.save()
+
+    _refresh_stale(patient_id, token)
+
+
+def apply_change_notification(event: str, obj: dict) -> None:
+    """
+    Invalidate mirror rows named by a DrChrono webhook event (ex: APPOINTMENT_MODIFY, LINE_ITEM_DELETE).
+    Invalidated appointments are re-fetched on the next read; deletes are applied directly.
+    """
+    obj_id = obj.get('id')
+    if not obj_id:
+        return
+
+    if event.startswith('APPOINTMENT_'):
+        if event == 'APPOINTMENT_DELETE':
+            delete_appointment(obj_id)
+        elif obj.get('patient'):
+            Appointment.objects.update_or_create(id=obj_id, defaults={'patient': obj['patient'], 'stale': True})
+
+    elif event.startswith('LINE_ITEM_'):
+        if event == 'LINE_ITEM_DELETE':
+            for item in LineItem.objects.filter(id=obj_id):
+                item.delete()
+                refresh_balances([item.appointment], item.patient)
+        if obj.get('appointment'):
+            Appointment.objects.filter(id=obj['appointment']).update(stale=True)
+
+
+def historical_appointments(patient_id: int, start=None, end=None, status: str = ''):
+    """
+    Mirrored past appointments with a clinical note PDF, newest first.
+    Optional start / end dates and status narrow the list further.
+    """
+    now = timezone.now()
+    appts = (
+        Appointment.objects
+        .filter(
+            patient=patient_id,
+            scheduled_time__date__lte=timezone.localdate(now),
+            scheduled_time__gte=now - timedelta(days=settings.APPOINTMENT_LOOKBACK_DAYS),
+        )
+        .exclude(clinical_note_pdf='')
+        .order_by('-scheduled_time')
+    )
+    if start:
+        appts = appts.filter(scheduled_time__date__gte=start)
+    if end:
+        appts = appts.filter(scheduled_time__date__lte=end)
+    if status:
+        appts = appts.filter(status=status)
+    return appts
+
+
+def appointment_statuses(patient_id: int) -> list[str]:
+    return list(
+        historical_appointments(patient_id).exclude(status='').order_by('status').values_list('status', flat=True).distinct()
+    )
+
+
+def appointment_list_version(patient_id: int) -> tuple:
+    """
+    (newest updated_at, row count) of the patient's historical appointments, changes whenever the list would.
+    """
+    version = historical_appointments(patient_id).order_by().aggregate(newest=Max('updated_at'), total=Count('id'))
+    return version['newest'], version['total']
+
+
+def selected_appointment_ids(patient_id: int, data) -> list[str]:
+    """
+    Resolve the list page POST into appointment ids, newest first.
+    With `select_all` every appointment matching the list filters is included (across all pages),
+    minus the boxes unchecked on the page that was visible (`page_appts`).
+    """
+    selected = data.getlist('selected_appts')
+    if not data.get('select_all'):
+        return selected
+
+    form = AppointmentFilterForm(data, statuses=appointment_statuses(patient_id))
+    filters = form.cleaned_data if form.is_valid() else {}
+    unchecked = set(data.getlist('page_appts')) - set(selected)
+    return [
+        str(appt_id) for appt_id in historical_appointments(patient_id, **filters).values_list('id', flat=True)
+        if str(appt_id) not in unchecked
+    ]
+
+
+@timing.span('line_items')
+def line_items_by_appointment(appointment_ids) -> dict:
+    """
+    Return mirrored line item payloads keyed by appointment id -> { APPT_ID : [LINE_ITEM_JSON] }
+    """
+    grouped = {int(appt_id): [] for appt_id in appointment_ids}
+    for item in LineItem.objects.filter(appointment__in=grouped).order_by('id'):
+        grouped[item.appointment].append(item.data)
+    return grouped
+
+
+def fetch_appointment_details(appointment_ids, token: str) -> tuple[dict, dict]:
+    """
+    Fetch verbose appointment payloads concurrently, only for the given (selected) appointments.
+    Returns (details, failures) -> ({ APPT_ID : APPT_JSON }, { APPT_ID : error text }), both in input order.
+    Raises DrChronoAPIError when DrChrono keeps throttling / failing, a packet is never silently short,
+    and DeadlineExceeded once the request deadline is spent (fetches still queued then fail fast).
+    """
+    appointment_ids = [int(appt_id) for appt_id in appointment_ids]
+
+    def fetch(appt_id):
+        try:
+            resp = api_get(f"appointments/{appt_id}", token, params={'verbose': 'true'})
+        except (DrChronoAPIError, deadline.DeadlineExceeded):
+            raise
+        except requests.RequestException as e:
+            return appt_id, None, str(e)
+        if resp.status_code != 200:
+            return appt_id, None, f"Response status {resp.status_code} {resp.text[:200]}"
+        return appt_id, response_json(resp), None
+
+    details, failures = {}, {}
+    if not appointment_ids:
+        return details, failures
+
+    workers = min(settings.DRCHRONO_FETCH_CONCURRENCY, len(appointment_ids))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for appt_id, payload, error in pool.map(timing.bind(fetch), appointment_ids):
+            if payload is not None:
+                details[appt_id] = payload
+            else:
+                failures[appt_id] = error
+    return details, failures
+
+
+async def afetch_appointment_details(client: httpx.AsyncClient, appointment_ids, token: str) -> tuple[dict, dict]:
+    """
+    fetch_appointment_details() for async code: the verbose GETs run concurrently on `client`,
+    at most DRCHRONO_FETCH_CONCURRENCY at a time. Same return value and errors.
+    """
+    appointment_ids = [int(appt_id) for appt_id in appointment_ids]
+    limit = asyncio.Semaphore(settings.DRCHRONO_FETCH_CONCURRENCY)
+
+    async def fetch(appt_id):
+        async with limit:
+            try:
+                resp = await aapi_get(client, f"appointments/{appt_id}", token, params={'verbose': 'true'})
+            except (DrChronoAPIError, deadline.DeadlineExceeded):
+                raise
+            except httpx.HTTPError as e:
+                return appt_id, None, str(e)
+        if resp.status_code != 200:
+            return appt_id, None, f"Response status {resp.status_code} {resp.text[:200]}"
+        return appt_id, response_json(resp), None
+
+    tasks = [asyncio.ensure_future(fetch(appt_id)) for appt_id in appointment_ids]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # One fetch gave up (throttled, deadline), drop the rest instead of leaving them running
+        for task in tasks:
+            task.cancel()
+        raise
+
+    details, failures = {}, {}
+    for appt_id, payload, error in results:
+        if payload is not None:
+            details[appt_id] = payload
+        else:
+            failures[appt_id] = error
+    return details, failures
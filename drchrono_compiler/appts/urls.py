@@ -5,4 +5,5 @@ app_name = 'appts_app'
 
 urlpatterns = [
     path('patient/<int:patient_id>_<str:patient_name>/historical/', views.HistoricalAppointmentsView.as_view(), name='historical_list'),
+    path('webhook/', views.drchrono_webhook, name='webhook'),
 ]
\ No newline at end of file
@@ -1,12 +1,42 @@
-from datetime import datetime, timedelta
+import hashlib
+import hmac
+import json
+import logging
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
 from django.views.generic import ListView
 from django.contrib import messages
 from verify.services import require_auth, get_valid_access_token
 from verify.exceptions import DrChronoAuthError
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.decorators import method_decorator
+from django.utils.http import http_date
 import requests
+from core import timing
+from core.profiling import profiled
+from core.api import DrChronoAPIError
+from pdf.prefetch import start_warm_up
+from .forms import AppointmentFilterForm
+from .models import Appointment
+from .services import (
+    appointment_list_version,
+    appointment_statuses,
+    apply_change_notification,
+    historical_appointments,
+    patient_balance,
+    sync_patient,
+)
+
+logger = logging.getLogger(__name__)
+
+# Session key: patients DrChrono let this session's user read, their mirror is shown when a sync fails
+VERIFIED_PATIENTS = 'verified_patients'
 
 @method_decorator(require_auth, name='dispatch')
+@method_decorator(profiled, name='dispatch')
 class HistoricalAppointmentsView(ListView):
     template_name = 'appts/historical_list.html'
     context_object_name = 'appointments'
@@ -16,83 +46,109 @@ class HistoricalAppointmentsView(ListView):
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
     
-    def get_queryset(self):
+    def get(self, request, *args, **kwargs):
         patient_id = self.kwargs['patient_id']
-
+        synced = self.sync(patient_id)
+        with timing.span('balance'):
+            self.balance = patient_balance(patient_id) if self.token else None
+
+        # Nothing changed in the mirror since the browser's copy -> 304, no query or template render.
+        # Not with pending messages (ex: a failed compile redirects here), the cached copy would not show them
+        etag, last_modified = None, None
+        if synced and not messages.get_messages(request):
+            with timing.span('list_validators'):
+                etag, last_modified = self.list_validators(patient_id)
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                return not_modified
+
+        with timing.span('list_query'):
+            response = super().get(request, *args, **kwargs)
+            # TemplateResponse renders lazily, render here so the page query and template are timed
+            response.render()
+        if etag:
+            response.headers['ETag'] = etag
+            response.headers['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+
+        # Biller usually compiles next, warm the compile caches for the listed appointments
+        if settings.PREFETCH_ENABLED and self.token and self.object_list:
+            with timing.span('warm_up_start'):
+                start_warm_up(request.user.pk, patient_id, self.object_list, self.token)
+        return response
+
+    def sync(self, patient_id) -> bool:
+        """
+        Bring the appointment mirror up to date, return False (with an error message) when that failed.
+        The mirror is shared by every user: `self.token` is set (rows are shown) only once DrChrono let this
+        user read the patient, in this sync or earlier in the session.
+        """
+        self.token = None
+        verified = self.request.session.get(VERIFIED_PATIENTS, [])
         try:
             token = get_valid_access_token(self.request)
-            headers = {"Authorization": f"Bearer {token}"}
-
-            three_years_ago = (datetime.now() - timedelta(days=365 * 3))
-            since_str = three_years_ago.strftime('%Y-%m-%dT%H:%M:%S')
-
-            params = {
-                'patient': patient_id,
-                'since': since_str,
-                'verbose': "true",         
-                'page_size': 50,                       
-            }
-
-            url = "https://app.drchrono.com/api/appointments"
-            resp = requests.get(url, headers=headers, params=params, timeout=12)
-
-            resp.raise_for_status()
-
-            data = resp.json()
-            all_appts = data.get('results', [])
-
-
-            today_iso = datetime.now().date().isoformat()
-
-            historical = []
-
-            for appt in all_appts:
-                # Get date string safely (prefer scheduled_time, fallback to date)
-                appt_date_str = None
-                if 'scheduled_time' in appt and appt['scheduled_time']:
-                    appt_date_str = appt['scheduled_time'][:10]  # YYYY-MM-DD
-                elif 'date' in appt and appt['date']:
-                    appt_date_str = appt['date']
-
-                if not appt_date_str or len(appt_date_str) < 10:
-                    continue
-
-                if appt_date_str > today_iso:
-                    continue
-
-                clinical_note = appt.get('clinical_note')
-                if not clinical_note:
-                    continue
-                
-                pdf_url = None
-                if isinstance(clinical_note, dict):
-                    pdf_url = clinical_note.get('pdf')
-                elif isinstance(clinical_note, str) and clinical_note.startswith('http'):
-                    pdf_url = clinical_note
-
-                appt['scheduled_time'] = datetime.fromisoformat(appt['scheduled_time'])
-                
-                if pdf_url:
-                    historical.append(appt)
-
-            # Sort newest → oldest
-            historical.sort(key=lambda a: a.get('scheduled_time', '9999-99-99'), reverse=True)
-
-            return historical
-
         except DrChronoAuthError as e:
             messages.error(self.request, f"Authentication issue: {str(e)}. Please reconnect.")
-            return []
+            return False
+
+        try:
+            sync_patient(patient_id, token)
+            self.token = token
+            if patient_id not in verified:
+                self.request.session[VERIFIED_PATIENTS] = verified + [patient_id]
+            return True
+
+        # Sync failures fall through to whatever the mirror already holds
+        except DrChronoAPIError as e:
+            shown = "showing the last synced appointments" if patient_id in verified else "no appointments can be shown"
+            messages.error(self.request, f"DrChrono is rate limiting or unavailable, {shown}. {e}")
 
         except requests.HTTPError as e:
-            error_detail = e.response.text[:300] if e.response else "No detail"
-            messages.error(self.request, f"DrChrono returned {e.response.status_code}: {error_detail}")
-            print("Full API error response:", e.response.text)
-            return []
+            # An error Response is falsy, compare with None
+            if e.response is not None:
+                messages.error(self.request, f"DrChrono returned {e.response.status_code}: {e.response.text[:300] or 'No detail'}")
+                logger.warning("DrChrono error response for patient %s: %s", self.kwargs['patient_id'], e.response.text[:2000])
+                # DrChrono answered: this user may no longer read the patient
+                if patient_id in verified:
+                    self.request.session[VERIFIED_PATIENTS] = [p for p in verified if p != patient_id]
+                return False
+            messages.error(self.request, f"DrChrono request failed: {e}")
 
         except Exception as e:
             messages.error(self.request, f"Failed to load appointments: {str(e)}")
-            return []
+
+        if patient_id in verified:
+            self.token = token
+        return False
+
+    def list_validators(self, patient_id) -> tuple[str, int]:
+        """
+        ETag / Last-Modified for this page, from the newest mirrored updated_at of the patient's appointments.
+        The ETag also covers the row count (deletes), the balance (line item changes), the query string (page, filters)
+        and the session (CSRF token rotates with it).
+        """
+        newest, total = appointment_list_version(patient_id)
+        last_modified = int(newest.timestamp()) if newest else 0
+        fingerprint = '|'.join([
+            str(patient_id), str(newest), str(total), str(self.balance.balance_total), str(self.balance.appointments),
+            self.request.GET.urlencode(), str(self.request.user.pk),
+            self.request.session.session_key or '',
+        ])
+        return f'"{hashlib.sha256(fingerprint.encode()).hexdigest()[:32]}"', last_modified
+
+    def get_paginate_by(self, queryset):
+        return settings.APPOINTMENT_PAGE_SIZE
+
+    def get_queryset(self):
+        patient_id = self.kwargs['patient_id']
+        if self.token is None:
+            self.filter_form = AppointmentFilterForm()
+            return Appointment.objects.none()
+
+        # Date and status filters run against the mirror, not in the template
+        self.filter_form = AppointmentFilterForm(self.request.GET or None, statuses=appointment_statuses(patient_id))
+        filters = self.filter_form.cleaned_data if self.filter_form.is_valid() else {}
+        return historical_appointments(patient_id, **filters)
 
     def get_context_data(self, **kwargs):
             context = super().get_context_data(**kwargs)
@@ -102,5 +158,39 @@ class HistoricalAppointmentsView(ListView):
             context['patient_name'] = patient_name
             context['patient_id'] = patient_id
             context['page_title'] = f"Historical Appointments for {patient_name}"
+            context['filter_form'] = self.filter_form
+            context['balance'] = self.balance
+
+            # Filters carried into pagination links and the compile form
+            query = self.request.GET.copy()
+            query.pop('page', None)
+            context['querystring'] = query.urlencode()
             
-            return context
\ No newline at end of file
+            return context
+
+
+# Receiver for DrChrono change notifications (webhooks). Invalidates mirror rows so the next read re-fetches them.
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def drchrono_webhook(request):
+    secret = settings.DRCHRONO_WEBHOOK_SECRET
+    if not secret:
+        return HttpResponseNotFound()
+
+    # Verification handshake: echo back the HMAC of `msg`
+    if request.method == 'GET':
+        msg = request.GET.get('msg', '')
+        token = hmac.new(secret.encode(), msg.encode(), hashlib.sha256).hexdigest()
+        return JsonResponse({'secret_token': token})
+
+    expected = hmac.new(secret.encode(), request.body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, request.headers.get('X-drchrono-signature', '')):
+        return HttpResponseForbidden()
+
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    apply_change_notification(request.headers.get('X-drchrono-event', ''), payload.get('object') or {})
+    return HttpResponse(status=204)
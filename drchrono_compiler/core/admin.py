@@ -1,3 +1,57 @@
 from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 
-# Register your models here.
+from .models import RequestProfile
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'view', 'status', 'duration_ms', 'peak_memory_mb', 'user', 'downloads')
+    list_filter = ('view',)
+    readonly_fields = (
+        'created_at', 'user', 'method', 'route', 'view', 'status', 'duration_ms', 'peak_memory', 'stages', 'downloads', 'report',
+    )
+    exclude = ('pstats',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Peak MB', ordering='peak_memory')
+    def peak_memory_mb(self, obj):
+        return f"{obj.peak_memory / 1e6:.1f}"
+
+    @admin.display(description='Artifacts')
+    def downloads(self, obj):
+        return format_html(
+            '<a href="{}">report.txt</a> / <a href="{}">profile.prof</a>',
+            reverse('admin:core_requestprofile_download', args=[obj.pk, 'txt']),
+            reverse('admin:core_requestprofile_download', args=[obj.pk, 'prof']),
+        )
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:pk>/download.<str:kind>', self.admin_site.admin_view(self.download),
+                name='core_requestprofile_download',
+            ),
+        ] + super().get_urls()
+
+    def download(self, request, pk, kind):
+        """
+        The text report, or the pstats file (python -m pstats / snakeviz).
+        """
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        if not self.has_view_permission(request, profile) or kind not in ('txt', 'prof'):
+            return HttpResponse(status=404)
+        if kind == 'txt':
+            response = HttpResponse(profile.report, content_type='text/plain; charset=utf-8')
+        else:
+            response = HttpResponse(bytes(profile.pstats), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="request-profile-{profile.pk}.{kind}"'
+        return response
@@ -0,0 +1,240 @@
+import random
+import time
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from django.conf import settings
+from django.utils.http import parse_http_date_safe
+
+from . import breaker, coalesce, deadline, metrics, timing
+from .ratelimit import scheduler, user_key
+
+# Shared helpers for talking to the DrChrono REST API.
+# Calls are paced by the rate limit scheduler; 429 and 5xx answers are retried with
+# Retry-After or jittered exponential backoff before the caller sees them.
+# Waits, retries and timeouts all stay inside the request deadline (core.deadline).
+# Hosts that keep failing are skipped by their circuit breaker (core.breaker) until they recover.
+# Identical concurrent GETs with the same token share one request (core.coalesce).
+# asend / aapi_get are the same calls for async code, on a caller supplied httpx.AsyncClient.
+# Every round trip is counted, with the bytes it returned, on the current request's trace (core.timing)
+# and in the Prometheus metrics (core.metrics).
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class DrChronoAPIError(requests.HTTPError):
+    """
+    DrChrono kept answering 429 / 5xx (or was unreachable) after all retries.
+    """
+
+
+class DrChronoUnavailable(DrChronoAPIError):
+    """
+    The host's circuit breaker is open, the call was not attempted.
+    """
+
+
+def api_url(path: str) -> str:
+    """
+    Resolve an API path (ex: 'appointments') against DRCHRONO_API_URL. Absolute URLs pass through.
+    """
+    if path.startswith('http'):
+        return path
+    return f"{settings.DRCHRONO_API_URL.rstrip('/')}/{path.lstrip('/')}"
+
+
+def retry_after(resp: requests.Response) -> float | None:
+    """
+    Seconds asked for by a Retry-After header (delta seconds or HTTP date), None when absent / unreadable.
+    """
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    when = parse_http_date_safe(value)
+    if when is None:
+        return None
+    return max(0.0, when - time.time())
+
+
+def backoff(attempt: int) -> float:
+    """
+    Full jitter exponential backoff: random delay in [0, base * 2^attempt], capped.
+    """
+    return random.uniform(0, min(settings.DRCHRONO_BACKOFF_MAX, settings.DRCHRONO_BACKOFF_BASE * 2 ** attempt))
+
+
+def send(method: str, url: str, token: str | None = None, **kwargs) -> requests.Response:
+    """
+    Send a request with pacing and retries. `token` (bearer) puts the call on that user's budget,
+    calls without one (ex: note downloads from storage) are only retried.
+    Returns the final response, raises DrChronoAPIError when retries ran out on a 429 / 5xx / network error,
+    DrChronoUnavailable when the host's breaker is open and DeadlineExceeded when the request deadline comes first.
+    """
+    stage = f"{method} {urlparse(url).path}"
+    circuit = breaker.for_url(url, 'api' if token else 'notes')
+    default_timeout = kwargs.pop('timeout', 12)
+    key = user_key(token) if token else None
+    if token:
+        kwargs['headers'] = {**kwargs.get('headers', {}), 'Authorization': f'Bearer {token}'}
+
+    attempts = settings.DRCHRONO_MAX_RETRIES + 1
+    for attempt in range(attempts):
+        if token:
+            scheduler().acquire(key, sleep=lambda seconds: deadline.sleep(seconds, stage))
+        timeout = deadline.timeout(default_timeout, stage)
+        try:
+            circuit.before()
+        except breaker.CircuitOpen as e:
+            raise DrChronoUnavailable(str(e)) from e
+
+        started = time.monotonic()
+        try:
+            resp = requests.request(method, url, timeout=timeout, **kwargs)
+        except requests.RequestException as e:
+            elapsed = time.monotonic() - started
+            circuit.record(False, elapsed)
+            timing.record_call(elapsed, 0)
+            metrics.observe_call(url, None, elapsed)
+            deadline.check(stage)
+            if attempt + 1 == attempts:
+                raise DrChronoAPIError(f"DrChrono unreachable after {attempts} attempts: {e}") from e
+            deadline.sleep(backoff(attempt), stage)
+            continue
+        except BaseException:
+            # Interrupted, no outcome to record
+            circuit.abandon()
+            raise
+
+        # Throttling is not an outage, only 5xx counts against the breaker
+        elapsed = time.monotonic() - started
+        circuit.record(resp.status_code < 500, elapsed)
+        timing.record_call(elapsed, len(resp.content))
+        metrics.observe_call(url, resp.status_code, elapsed)
+        if resp.status_code not in RETRY_STATUSES:
+            return resp
+
+        delay = retry_after(resp)
+        if resp.status_code == 429 and delay is not None and token:
+            scheduler().pause(key, delay)
+        if delay is None:
+            delay = backoff(attempt)
+        if attempt + 1 == attempts or delay > settings.DRCHRONO_BACKOFF_MAX:
+            raise DrChronoAPIError(
+                f"DrChrono answered {resp.status_code} after {attempt + 1} attempt(s) for {resp.url}",
+                response=resp,
+            )
+        deadline.sleep(delay, stage)
+
+
+async def asend(client: httpx.AsyncClient, method: str, url: str, token: str | None = None, **kwargs) -> httpx.Response:
+    """
+    send() for async code: same pacing, breaker, retries and deadline, waiting without blocking the event loop.
+    """
+    stage = f"{method} {urlparse(url).path}"
+    circuit = breaker.for_url(url, 'api' if token else 'notes')
+    default_timeout = kwargs.pop('timeout', 12)
+    key = user_key(token) if token else None
+    if token:
+        kwargs['headers'] = {**kwargs.get('headers', {}), 'Authorization': f'Bearer {token}'}
+
+    attempts = settings.DRCHRONO_MAX_RETRIES + 1
+    for attempt in range(attempts):
+        if token:
+            await scheduler().aacquire(key, sleep=lambda seconds: deadline.asleep(seconds, stage))
+        timeout = deadline.timeout(default_timeout, stage)
+        try:
+            circuit.before()
+        except breaker.CircuitOpen as e:
+            raise DrChronoUnavailable(str(e)) from e
+
+        started = time.monotonic()
+        try:
+            resp = await client.request(method, url, timeout=timeout, **kwargs)
+        except httpx.HTTPError as e:
+            elapsed = time.monotonic() - started
+            circuit.record(False, elapsed)
+            timing.record_call(elapsed, 0)
+            metrics.observe_call(url, None, elapsed)
+            deadline.check(stage)
+            if attempt + 1 == attempts:
+                raise DrChronoAPIError(f"DrChrono unreachable after {attempts} attempts: {e}") from e
+            await deadline.asleep(backoff(attempt), stage)
+            continue
+        except BaseException:
+            # Cancelled (ex: a sibling fetch failed, the client went away) or interrupted: no outcome to record
+            circuit.abandon()
+            raise
+
+        elapsed = time.monotonic() - started
+        circuit.record(resp.status_code < 500, elapsed)
+        timing.record_call(elapsed, len(resp.content))
+        metrics.observe_call(url, resp.status_code, elapsed)
+        if resp.status_code not in RETRY_STATUSES:
+            return resp
+
+        delay = retry_after(resp)
+        if resp.status_code == 429 and delay is not None and token:
+            scheduler().pause(key, delay)
+        if delay is None:
+            delay = backoff(attempt)
+        if attempt + 1 == attempts or delay > settings.DRCHRONO_BACKOFF_MAX:
+            raise DrChronoAPIError(
+                f"DrChrono answered {resp.status_code} after {attempt + 1} attempt(s) for {resp.url}",
+                response=resp,
+            )
+        await deadline.asleep(delay, stage)
+
+
+def api_get(path: str, token: str, params: dict | None = None, timeout: float = 12) -> requests.Response:
+    """
+    GET an API resource with the user's bearer token, return the raw response.
+    Concurrent identical GETs (same normalized URL, same token) share one response, treat it as read only.
+    Raises DrChronoAPIError when throttling / server errors outlast the retries.
+    """
+    url = api_url(path)
+    if not settings.DRCHRONO_COALESCE_GETS:
+        return send('GET', url, token, params=params, timeout=timeout)
+    key = f"{user_key(token)} {coalesce.normalize_url(url, params)}"
+    return coalesce.gets.do(key, lambda: send('GET', url, token, params=params, timeout=timeout))
+
+
+async def aapi_get(client: httpx.AsyncClient, path: str, token: str, params: dict | None = None, timeout: float = 12) -> httpx.Response:
+    """
+    api_get() for async code, concurrent identical GETs on the same event loop share one response.
+    """
+    url = api_url(path)
+    if not settings.DRCHRONO_COALESCE_GETS:
+        return await asend(client, 'GET', url, token, params=params, timeout=timeout)
+    key = f"{user_key(token)} {coalesce.normalize_url(url, params)}"
+    return await coalesce.gets.ado(key, lambda: asend(client, 'GET', url, token, params=params, timeout=timeout))
+
+
+def response_json(resp: requests.Response | httpx.Response):
+    """
+    Parsed JSON body of a response, parsed once even when the response is shared by coalesced callers.
+    """
+    if not hasattr(resp, '_parsed_json'):
+        resp._parsed_json = resp.json()
+    return resp._parsed_json
+
+
+def iter_results(path: str, token: str, params: dict | None = None, timeout: float = 12):
+    """
+    Yield every result of a list endpoint, following DrChrono's `next` cursor across pages.
+    Raises requests.HTTPError on a non 2xx page.
+    """
+    url = api_url(path)
+    while url:
+        resp = api_get(url, token, params=params, timeout=timeout)
+        resp.raise_for_status()
+        data = response_json(resp)
+        yield from data.get('results', [])
+
+        # `next` already carries the query string
+        url = data.get('next')
+        params = None
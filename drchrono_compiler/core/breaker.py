@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+# Circuit breakers for the hosts the app talks to: the DrChrono API and each note PDF storage
+# host keep separate state. A breaker opens once too many of its recent calls failed
+# (5xx / network error) or ran slow, fails fast while open, then lets a few half-open probes
+# through and closes again when they succeed. State is per process.
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a host whose breaker is open.
+    """
+
+    def __init__(self, breaker: 'CircuitBreaker', retry_in: float):
+        self.breaker = breaker
+        self.retry_in = retry_in
+        super().__init__(
+            f"{breaker.label} looks unavailable right now, not calling it for another {retry_in:.0f}s"
+        )
+
+
+class CircuitBreaker:
+
+    def __init__(self, host: str, kind: str, clock=time.monotonic):
+        self.host = host
+        self.kind = kind
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        self.outcomes = deque()
+        self.opened_count = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def label(self) -> str:
+        return 'DrChrono' if self.kind == 'api' else f'Note storage ({self.host})'
+
+    def before(self) -> None:
+        """
+        Let a call through or raise CircuitOpen. Every call let through must be followed by record(), or by
+        abandon() when it ended without an outcome.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                waited = self.clock() - self.opened_at
+                if waited < settings.BREAKER_OPEN_SECONDS:
+                    self.rejected += 1
+                    raise CircuitOpen(self, settings.BREAKER_OPEN_SECONDS - waited)
+                self.state, self.probes = HALF_OPEN, 0
+
+            if self.state == HALF_OPEN:
+                if self.probes >= settings.BREAKER_HALF_OPEN_PROBES:
+                    self.rejected += 1
+                    raise CircuitOpen(self, settings.BREAKER_OPEN_SECONDS)
+                self.probes += 1
+
+    def record(self, ok: bool, latency: float) -> None:
+        slow = latency >= settings.BREAKER_SLOW_CALL
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probes -= 1
+                if ok and not slow:
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                else:
+                    self._open()
+                return
+
+            self.outcomes.append((ok, slow))
+            while len(self.outcomes) > settings.BREAKER_WINDOW:
+                self.outcomes.popleft()
+            if self.state == CLOSED and self._tripped():
+                self._open()
+
+    def abandon(self) -> None:
+        """
+        A call let through was cancelled or interrupted before an answer: give back its half-open probe,
+        without one the breaker would turn every call away.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN and self.probes > 0:
+                self.probes -= 1
+
+    def _tripped(self) -> bool:
+        calls = len(self.outcomes)
+        if calls < settings.BREAKER_MIN_CALLS:
+            return False
+        errors = sum(1 for ok, _ in self.outcomes if not ok)
+        slow = sum(1 for _, is_slow in self.outcomes if is_slow)
+        return errors / calls >= settings.BREAKER_ERROR_RATE or slow / calls >= settings.BREAKER_SLOW_RATE
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.opened_count += 1
+        self.outcomes.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            calls = len(self.outcomes)
+            state = self.state
+            if state == OPEN and self.clock() - self.opened_at >= settings.BREAKER_OPEN_SECONDS:
+                state = HALF_OPEN
+            return {
+                'host': self.host,
+                'kind': self.kind,
+                'state': state,
+                'recent_calls': calls,
+                'recent_errors': sum(1 for ok, _ in self.outcomes if not ok),
+                'recent_slow': sum(1 for _, slow in self.outcomes if slow),
+                'times_opened': self.opened_count,
+                'rejected': self.rejected,
+            }
+
+
+_breakers: dict[tuple, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def for_url(url: str, kind: str) -> CircuitBreaker:
+    """
+    Breaker of the host serving `url` for `kind` of call ('api' bearer calls or 'notes' downloads).
+    """
+    key = (kind, urlparse(url).netloc)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(key[1], kind)
+        return breaker
+
+
+def snapshot() -> list[dict]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.snapshot() for breaker in breakers]
+
+
+def reset() -> None:
+    """
+    Forget all breaker state (tests, or after an operator confirmed recovery).
+    """
+    with _breakers_lock:
+        _breakers.clear()
@@ -0,0 +1,132 @@
+import asyncio
+import math
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from . import deadline
+
+# Single-flight for identical DrChrono GETs: while one request for a resource is on the wire,
+# other callers asking for the same resource with the same token wait for it and share its
+# response instead of sending their own. Nothing is kept after the request completes.
+
+
+def normalize_url(url: str, params: dict | None = None) -> str:
+    """
+    Canonical form of url + params: lower case scheme / host, query merged and sorted, no fragment.
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query += [(str(k), str(v)) for k, v in (params or {}).items() if v is not None]
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', urlencode(sorted(query)), ''))
+
+
+class _LeaderCancelled(Exception):
+    """
+    Handed to the waiters of a call whose leader was cancelled: the call did not fail, they make it again.
+    """
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.requests = 0
+        self.coalesced = 0
+        self._calls: dict[str, Future] = {}
+        self._async_calls: dict[tuple, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn):
+        """
+        Return fn() for `key`, or the result of the identical call already in flight.
+        Waiters stay within their own request deadline; if the leading call ran out of its deadline
+        while the waiter still has time, the waiter makes the call itself.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.requests += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                result = fn()
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                with self._lock:
+                    del self._calls[key]
+
+        current = deadline.current()
+        try:
+            return future.result(timeout=None if current is None else current.timeout(math.inf, key))
+        except FutureTimeout:
+            raise deadline.DeadlineExceeded(current, key)
+        except deadline.DeadlineExceeded:
+            if current is not None and not current.expired:
+                return fn()
+            raise
+
+    async def ado(self, key: str, fn):
+        """
+        do() for coroutines: `fn` returns an awaitable. Calls are shared within one event loop.
+        When the leader is cancelled its waiters are not, one of them makes the call again.
+        """
+        loop_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            future = self._async_calls.get(loop_key)
+            leader = future is None
+            if leader:
+                future = self._async_calls[loop_key] = asyncio.get_running_loop().create_future()
+                self.requests += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                # The leader's request went away (ex: a sibling fetch failed, the client disconnected), waiters
+                # of other requests must not be cancelled along
+                future.set_exception(_LeaderCancelled())
+                future.exception()
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                # Retrieved here so a leader without waiters does not log "exception never retrieved"
+                future.exception()
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                with self._lock:
+                    del self._async_calls[loop_key]
+
+        current = deadline.current()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), None if current is None else current.timeout(math.inf, key))
+        except _LeaderCancelled:
+            # One of the waiters leads the call again
+            return await self.ado(key, fn)
+        except asyncio.TimeoutError:
+            raise deadline.DeadlineExceeded(current, key)
+        except deadline.DeadlineExceeded:
+            if current is not None and not current.expired:
+                return await fn()
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._calls) + len(self._async_calls)
+            return {'requests': self.requests, 'coalesced': self.coalesced, 'in_flight': in_flight}
+
+
+gets = SingleFlight()
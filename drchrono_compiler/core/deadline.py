@@ -0,0 +1,154 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+
+# Per request time budget. DeadlineMiddleware starts one from REQUEST_DEADLINE, every DrChrono call,
+# note download and render stage checks it (and caps its timeout by what is left), so a request gives
+# up quickly once the budget is spent instead of tying up a worker for minutes.
+# Code running outside a request (commands, background warm-up) has no deadline unless it opens one.
+
+_current: ContextVar['Deadline | None'] = ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+    The request ran out of its time budget. `stage` names the step that was about to run.
+    """
+
+    def __init__(self, deadline: 'Deadline', stage: str = ''):
+        self.budget = deadline.budget
+        self.stage = stage
+        message = f"time budget of {deadline.budget:g}s spent"
+        if stage:
+            message += f" before {stage}"
+        super().__init__(message)
+
+
+class Deadline:
+
+    def __init__(self, budget: float, clock=time.monotonic):
+        self.budget = budget
+        self.clock = clock
+        self.expires = clock() + budget
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - self.clock())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str = '') -> None:
+        if self.expired:
+            raise DeadlineExceeded(self, stage)
+
+    def timeout(self, default: float, stage: str = '') -> float:
+        """
+        `default` capped by the time left, raises DeadlineExceeded when nothing is left.
+        """
+        self.check(stage)
+        return min(default, self.remaining())
+
+
+def current() -> Deadline | None:
+    return _current.get()
+
+
+def check(stage: str = '') -> None:
+    """
+    Raise DeadlineExceeded when the current request is out of time, no-op without a deadline.
+    """
+    deadline = current()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def timeout(default: float, stage: str = '') -> float:
+    deadline = current()
+    if deadline is None:
+        return default
+    return deadline.timeout(default, stage)
+
+
+def sleep(seconds: float, stage: str = '') -> None:
+    """
+    time.sleep that refuses to sleep past the deadline.
+    """
+    deadline = current()
+    if deadline is not None and seconds >= deadline.remaining():
+        raise DeadlineExceeded(deadline, stage)
+    time.sleep(seconds)
+
+
+async def asleep(seconds: float, stage: str = '') -> None:
+    """
+    asyncio.sleep that refuses to sleep past the deadline.
+    """
+    deadline = current()
+    if deadline is not None and seconds >= deadline.remaining():
+        raise DeadlineExceeded(deadline, stage)
+    await asyncio.sleep(seconds)
+
+
+@contextmanager
+def budget(seconds: float):
+    """
+    Run the block under a deadline of `seconds`, ex: a command compiling one packet.
+    """
+    token = _current.set(Deadline(seconds))
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def bind(fn):
+    """
+    Wrap `fn` so it runs under the caller's deadline, for work handed to a thread pool
+    (threads do not inherit context variables).
+    """
+    captured = current()
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        token = _current.set(captured)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+class DeadlineMiddleware:
+    """
+    Give every request a deadline of REQUEST_DEADLINE seconds (0 disables). Works under WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.REQUEST_DEADLINE:
+            return self.get_response(request)
+        with budget(settings.REQUEST_DEADLINE) as deadline:
+            request.deadline = deadline
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not settings.REQUEST_DEADLINE:
+            return await self.get_response(request)
+        with budget(settings.REQUEST_DEADLINE) as deadline:
+            request.deadline = deadline
+            return await self.get_response(request)
@@ -0,0 +1,168 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+import httpx
+import uvicorn
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import CommandError
+from django.middleware.csrf import CSRF_ALLOWED_CHARS
+from django.test import Client
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from appts.services import sync_patient
+from verify.models import DrChronoCredential
+from .standin import StandInDrChrono
+
+# Harness shared by the load test commands (manage.py loadtest, loadtest_compile, coldstart): the
+# stand-in patients, the signed-in sessions that drive the traffic and the servers under test.
+
+LOADTEST_USER = 'loadtest'
+LAST_NAME = 'Loadtest'
+# One token drives every user, the stand-in has no rate limit to protect
+UNTHROTTLED = {
+    'DRCHRONO_RATE_LIMIT': 10_000,
+    'DRCHRONO_RATE_BURST': 10_000,
+    'DRCHRONO_USER_RATE_LIMIT': 10_000,
+    'DRCHRONO_USER_RATE_BURST': 10_000,
+}
+SERVERS = {
+    # Sync workers, one request at a time each: the default deployment (gunicorn.conf.py)
+    'gunicorn': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', 'drchrono_compiler.wsgi',
+        '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--log-level', 'warning',
+    ],
+    'uvicorn': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', 'drchrono_compiler.asgi:application',
+        '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers), '--lifespan', 'off', '--log-level', 'warning',
+    ],
+}
+
+
+def seed(api: StandInDrChrono, token: str, patients: int, appointments: int) -> list[tuple[dict, list[int]]]:
+    """
+    Stand-in patients (Patient<n> Loadtest) with `appointments` past appointments each, mirrored up front like
+    a list page view before compiling -> [(patient, appointment ids oldest first)].
+    """
+    seeded = []
+    for number in range(patients):
+        patient = api.add_synthetic_patient(appointments, first_name=f'Patient{number + 1}', last_name=LAST_NAME)
+        sync_patient(patient['id'], token, force=True)
+        appt_ids = sorted(appt['id'] for appt in api.appointments.values() if appt['patient'] == patient['id'])
+        seeded.append((patient, appt_ids))
+    return seeded
+
+
+def login(token: str) -> tuple[dict, dict]:
+    """
+    A session of its own (cookies and CSRF header) for one simulated user, signed in to DrChrono with `token`.
+    """
+    user, _ = User.objects.get_or_create(username=LOADTEST_USER)
+    DrChronoCredential.objects.update_or_create(user=user, defaults={
+        'access_token': token,
+        'refresh_token': '',
+        'expires_at': timezone.now() + timedelta(hours=1),
+    })
+    client = Client()
+    client.force_login(user)
+    csrf = get_random_string(32, CSRF_ALLOWED_CHARS)
+    return {'sessionid': client.cookies['sessionid'].value, 'csrftoken': csrf}, {'X-CSRFToken': csrf}
+
+
+class ServerProcess:
+    """
+    gunicorn or uvicorn (SERVERS) serving the project in a subprocess on a free localhost port, pointed at the
+    stand-in. The compile cache gets a fresh directory so every run starts cold. `env` adds environment variables.
+    """
+
+    def __init__(self, name: str, api: StandInDrChrono, workers: int, env: dict | None = None):
+        self.name, self.api, self.workers, self.env = name, api, workers, env or {}
+
+    def __enter__(self) -> str:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.cache_dir = tempfile.mkdtemp(prefix='loadtest-cache-')
+        env = {
+            **os.environ,
+            'DRCHRONO_BASE_URL': self.api.url,
+            'DRCHRONO_API_URL': self.api.api_url,
+            'EXTRA_ALLOWED_HOSTS': '127.0.0.1',
+            'COMPILE_CACHE_LOCATION': self.cache_dir,
+            **{name: str(value) for name, value in UNTHROTTLED.items()},
+            **self.env,
+        }
+        self.process = subprocess.Popen(
+            SERVERS[self.name](port, self.workers), cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        base_url = f'http://127.0.0.1:{port}'
+        give_up = time.monotonic() + 60
+        while True:
+            if self.process.poll() is not None:
+                raise CommandError(f"{self.name} exited on startup:\n{self.process.stderr.read()[-2000:]}")
+            try:
+                httpx.get(f'{base_url}/admin/login/', timeout=1)
+                return base_url
+            except httpx.HTTPError:
+                if time.monotonic() > give_up:
+                    self.__exit__()
+                    raise CommandError(f"{self.name} did not answer within 60s")
+                time.sleep(0.2)
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+class InProcessServer:
+    """
+    uvicorn serving the project's ASGI application on a free localhost port, in a background thread of this
+    process (its settings overrides apply).
+    """
+
+    def __enter__(self) -> str:
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(('127.0.0.1', 0))
+        config = uvicorn.Config(get_asgi_application(), log_level='warning', lifespan='off')
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, kwargs={'sockets': [self.socket]}, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        host, port = self.socket.getsockname()
+        return f'http://{host}:{port}'
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+        self.socket.close()
+
+
+class RunningServer:
+    """
+    A server started by hand: nothing to start or stop.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+
+    def __enter__(self) -> str:
+        return self.url
+
+    def __exit__(self, *exc):
+        pass
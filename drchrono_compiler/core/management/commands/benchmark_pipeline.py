@@ -0,0 +1,195 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from appts.models import Appointment, LineItem, PatientSync
+from core.standin import DOCTOR, OFFICE, StandInDrChrono
+from pdf import provider
+from pdf.services import fetch_hcfa_data, generate_balance_report, generate_hcfa_bill
+from verify.models import DrChronoCredential
+
+BENCHMARK_USER = 'benchmark'
+BENCHMARK_TOKEN = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the compile pipeline against the local DrChrono stand-in at several packet sizes: balance report, "
+        "HCFA bills, patient search, historical list and full compiles through GenerateSelectedPDFView. "
+        "Results are saved as JSON; --compare flags stages that got slower than a previous run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50, 200], help='Appointments per patient')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage and size, the median is kept')
+        parser.add_argument('--latency', type=float, default=0.02, help='Simulated stand-in seconds per request')
+        parser.add_argument('--bandwidth', type=int, default=None, help='Simulated stand-in bytes per second')
+        parser.add_argument('--note-pages', type=int, default=1, help='Pages per clinical note')
+        parser.add_argument('--scan-dpi', type=int, default=0, help='Scanned (image) notes at this DPI instead of blank pages')
+        parser.add_argument('--output', help='Results file (default: benchmark-results/pipeline-<time>.json)')
+        parser.add_argument('--compare', help='Earlier results file to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Slowdown ratio reported as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions (CI)')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or min(options['sizes']) < 1:
+            raise CommandError('--repeat and --sizes must be at least 1')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        api = StandInDrChrono(latency=options['latency'], bandwidth=options['bandwidth']).start()
+        overrides = override_settings(
+            DRCHRONO_API_URL=api.api_url,
+            # Host of django.test.Client requests
+            ALLOWED_HOSTS=['testserver'],
+            PREFETCH_ENABLED=False,
+            REQUEST_DEADLINE=0,
+            DRCHRONO_RATE_LIMIT=10_000,
+            DRCHRONO_RATE_BURST=10_000,
+            DRCHRONO_USER_RATE_LIMIT=10_000,
+            DRCHRONO_USER_RATE_BURST=10_000,
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'compile': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'},
+            },
+        )
+        results = {}
+        with api, overrides:
+            client = self.login()
+            self.stdout.write(f"{'stage':<18}{'appointments':>13}{'median ms':>11}{'min ms':>9}")
+            for size in options['sizes']:
+                for stage, run in self.stages(api, client, size, options).items():
+                    timings = []
+                    for _ in range(options['repeat']):
+                        # Cold compile caches every run, the stand-in latency is what is being paid
+                        caches['compile'].clear()
+                        started = time.perf_counter()
+                        run()
+                        timings.append((time.perf_counter() - started) * 1000)
+                    results.setdefault(stage, {})[str(size)] = {
+                        'median_ms': round(statistics.median(timings), 1),
+                        'min_ms': round(min(timings), 1),
+                    }
+                    self.stdout.write(f"{stage:<18}{size:>13}{statistics.median(timings):>11.1f}{min(timings):>9.1f}")
+
+        path = self.save(results, options)
+        self.stdout.write(self.style.SUCCESS(f"Results saved to {path}"))
+        if baseline is not None:
+            self.compare(baseline, results, options)
+
+    def login(self) -> Client:
+        user, _ = User.objects.get_or_create(username=BENCHMARK_USER)
+        DrChronoCredential.objects.update_or_create(user=user, defaults={
+            'access_token': BENCHMARK_TOKEN,
+            'refresh_token': '',
+            'expires_at': timezone.now() + timedelta(hours=1),
+        })
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def stages(self, api: StandInDrChrono, client: Client, size: int, options) -> dict:
+        """
+        Timed callables for one packet size, against a fresh stand-in patient with `size` appointments.
+        """
+        last_name = f'Bench{size}'
+        patient = api.add_synthetic_patient(size, options['note_pages'], options['scan_dpi'], last_name=last_name)
+        # Search finds `size` patients
+        for _ in range(size - 1):
+            api.add_patient(last_name=last_name)
+        patient_id = patient['id']
+        # Stand-in ids restart every run, drop mirror rows an earlier run left under the same id
+        Appointment.objects.filter(patient=patient_id).delete()
+        LineItem.objects.filter(patient=patient_id).delete()
+        PatientSync.objects.filter(patient=patient_id).delete()
+
+        appts = [appt for appt in api.appointments.values() if appt['patient'] == patient_id]
+        items = {item['appointment']: [item] for item in api.line_items.values() if item['patient'] == patient_id}
+        compile_url = reverse('pdf_app:generate_selected', kwargs={'patient_id': patient_id})
+        list_url = reverse('appts_app:historical_list', kwargs={'patient_id': patient_id, 'patient_name': last_name})
+
+        profile = provider.build(DOCTOR, OFFICE)
+
+        def hcfa_bills():
+            for appt in appts:
+                generate_hcfa_bill(None, fetch_hcfa_data(patient, appt, items[appt['id']], profile))
+
+        def search():
+            self.expect(client.post(reverse('search_app:search'), {'last_name': last_name}), 302, 'search')
+
+        def historical_list():
+            self.expect(client.get(list_url), 200, 'historical list')
+
+        def compile_packet():
+            resp = client.post(compile_url, {'selected_appts': [str(appt['id']) for appt in appts], 'patient_name': last_name})
+            self.expect(resp, 200, 'compile')
+
+        return {
+            # First run of the list also builds the mirror, the median is the steady state
+            'historical_list': historical_list,
+            'balance_report': lambda: generate_balance_report(patient_id, BENCHMARK_TOKEN, profile['provider_name']),
+            'hcfa_bills': hcfa_bills,
+            'search': search,
+            'compile': compile_packet,
+        }
+
+    def expect(self, resp, status: int, stage: str) -> None:
+        if resp.status_code != status:
+            raise CommandError(f"{stage} answered {resp.status_code}, expected {status}")
+
+    def save(self, results: dict, options) -> str:
+        path = options['output'] or os.path.join('benchmark-results', f"pipeline-{timezone.now():%Y%m%d-%H%M%S}.json")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        meta = {key: options[key] for key in ('sizes', 'repeat', 'latency', 'bandwidth', 'note_pages', 'scan_dpi')}
+        with open(path, 'w') as f:
+            json.dump({
+                'created': timezone.now().isoformat(),
+                'commit': commit,
+                'python': platform.python_version(),
+                'options': meta,
+                'results': results,
+            }, f, indent=2)
+        return path
+
+    def compare(self, baseline: dict, results: dict, options) -> None:
+        if baseline.get('options', {}).get('latency') != options['latency']:
+            self.stderr.write("Baseline was run with another --latency, timings are not comparable")
+        regressions = []
+        self.stdout.write(f"\n{'stage':<18}{'appointments':>13}{'before ms':>11}{'after ms':>10}{'change':>9}")
+        for stage, sizes in results.items():
+            for size, timing in sizes.items():
+                before = baseline.get('results', {}).get(stage, {}).get(size)
+                if not before:
+                    continue
+                change = timing['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0
+                flag = ''
+                if change > options['tolerance']:
+                    flag = '  slower'
+                    regressions.append(f'{stage}@{size}')
+                self.stdout.write(
+                    f"{stage:<18}{size:>13}{before['median_ms']:>11.1f}{timing['median_ms']:>10.1f}{change:>+9.0%}{flag}"
+                )
+        if regressions:
+            message = f"Slower than {options['compare']} by more than {options['tolerance']:.0%}: {', '.join(regressions)}"
+            if options['fail_on_regression']:
+                raise CommandError(message)
+            self.stderr.write(message)
+        else:
+            self.stdout.write(self.style.SUCCESS("No regressions"))
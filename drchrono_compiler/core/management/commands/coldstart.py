@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+import time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from core.loadtest import LAST_NAME, ServerProcess, login, seed
+from core.standin import StandInDrChrono
+
+# Memory of a process from /proc/<pid>/smaps_rollup, in kB
+MEMORY_FIELDS = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'uss', 'Private_Dirty': 'uss'}
+
+
+def process_memory(pid: int) -> dict[str, float]:
+    """
+    RSS, PSS (shared pages split between the processes sharing them) and USS (private pages) in MB.
+    """
+    memory = {'rss': 0.0, 'pss': 0.0, 'uss': 0.0}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            field, _, value = line.partition(':')
+            if field in MEMORY_FIELDS:
+                memory[MEMORY_FIELDS[field]] += int(value.split()[0]) / 1024
+    return memory
+
+
+def child_pids(pid: int) -> list[int]:
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # Fields after the command name, which may hold spaces: state, ppid, ...
+                ppid = int(f.read().rpartition(')')[2].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure gunicorn cold start without and with the worker preload (core.startup, WORKER_PRELOAD): "
+        "seconds until the server answers, the first compile of every worker against a warm one, and the "
+        "memory of the master and of each worker (RSS, PSS, USS) after start up and after the compiles. Linux only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+        parser.add_argument('--appointments', type=int, default=5, help='Appointments per compile')
+        parser.add_argument('--latency', type=float, default=0.0, help='Simulated stand-in seconds per request')
+        parser.add_argument('--timeout', type=float, default=120, help='Seconds before a compile counts as failed')
+        parser.add_argument('--output', help='Save results as JSON')
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/smaps_rollup'):
+            raise CommandError('Memory is read from /proc/<pid>/smaps_rollup (Linux 4.14+)')
+        if options['workers'] < 1 or options['appointments'] < 1:
+            raise CommandError('--workers and --appointments must be at least 1')
+        results = {}
+        api = StandInDrChrono(latency=options['latency']).start()
+        with api, override_settings(DRCHRONO_API_URL=api.api_url):
+            token = f'coldstart-{get_random_string(8)}'
+            # A first and a warm compile per worker, each of its own patient so the compile cache does not help the second
+            patients = seed(api, token, 2 * options['workers'], options['appointments'])
+            session = login(token)
+            for mode, preload in (('lazy', '0'), ('preload', '1')):
+                started = time.perf_counter()
+                server = ServerProcess('gunicorn', api, options['workers'], env={'WORKER_PRELOAD': preload})
+                with server as base_url:
+                    ready = time.perf_counter() - started
+                    # Every worker up, not just the one that answered
+                    while len(child_pids(server.process.pid)) < options['workers']:
+                        time.sleep(0.1)
+                    idle = self.memory(server.process.pid)
+                    first = asyncio.run(self.compiles(base_url, session, patients[:options['workers']], options))
+                    warm = asyncio.run(self.compiles(base_url, session, patients[options['workers']:], options))
+                    busy = self.memory(server.process.pid)
+                results[mode] = {
+                    'ready_s': round(ready, 2),
+                    'first_compile_ms': first,
+                    'warm_compile_ms': warm,
+                    'memory_after_start': idle,
+                    'memory_after_compiles': busy,
+                }
+        self.report(results, options)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'created': timezone.now().isoformat(),
+                    'options': {key: options[key] for key in ('workers', 'appointments', 'latency')},
+                    'results': results,
+                }, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results saved to {options['output']}"))
+
+    def memory(self, master: int) -> dict:
+        workers = [process_memory(pid) for pid in child_pids(master)]
+        return {
+            'master': {key: round(value, 1) for key, value in process_memory(master).items()},
+            # Mean of the workers
+            'worker': {key: round(sum(worker[key] for worker in workers) / len(workers), 1) for key in ('rss', 'pss', 'uss')},
+        }
+
+    async def compiles(self, base_url: str, session, patients, options) -> list[float]:
+        """
+        One compile per patient, all at once so each sync worker takes one. Milliseconds each, sorted.
+        """
+        cookies, headers = session
+
+        async def compile_one(client, patient, appt_ids):
+            started = time.perf_counter()
+            resp = await client.post(
+                reverse('pdf_app:generate_selected', kwargs={'patient_id': patient['id']}),
+                data={'selected_appts': [str(appt_id) for appt_id in appt_ids], 'patient_name': LAST_NAME},
+            )
+            if resp.headers.get('Content-Type') != 'application/pdf':
+                raise CommandError(f"Compile failed: HTTP {resp.status_code}")
+            return round((time.perf_counter() - started) * 1000, 1)
+
+        async with httpx.AsyncClient(base_url=base_url, cookies=cookies, headers=headers, timeout=options['timeout']) as client:
+            return sorted(await asyncio.gather(*(compile_one(client, patient, appt_ids) for patient, appt_ids in patients)))
+
+    def report(self, results: dict, options) -> None:
+        self.stdout.write(
+            f"gunicorn, {options['workers']} workers, {options['appointments']} appointments per compile\n"
+            f"{'':<9}{'ready s':>8}{'first ms':>10}{'warm ms':>9}   {'worker MB after start':<22}{'after compiles':<22}{'master RSS':>10}\n"
+            f"{'':<9}{'':>8}{'(max)':>10}{'(max)':>9}   {'RSS / PSS / USS':<22}{'RSS / PSS / USS':<22}"
+        )
+        for mode, row in results.items():
+            start, busy = row['memory_after_start']['worker'], row['memory_after_compiles']['worker']
+            self.stdout.write(
+                f"{mode:<9}{row['ready_s']:>8.2f}{row['first_compile_ms'][-1]:>10.0f}{row['warm_compile_ms'][-1]:>9.0f}   "
+                f"{start['rss']:.0f} / {start['pss']:.0f} / {start['uss']:<10.0f}"
+                f"{busy['rss']:.0f} / {busy['pss']:.0f} / {busy['uss']:<10.0f}"
+                f"{row['memory_after_compiles']['master']['rss']:>10.0f}"
+            )
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import random
+import time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from core.loadtest import LAST_NAME, SERVERS, RunningServer, ServerProcess, login, seed
+from core.standin import StandInDrChrono
+from core.timing import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test a running server with mixed traffic (patient searches, appointment lists, compiles of several "
+        "sizes) against the local DrChrono stand-in. Starts gunicorn (sync workers) and / or uvicorn (ASGI) in "
+        "turn, or targets --url. Reports throughput, error rate and p50 / p95 / p99 latency per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', nargs='+', choices=sorted(SERVERS), default=sorted(SERVERS), help='Servers to start and test in turn')
+        parser.add_argument('--url', help=(
+            'Test this already running server instead. It must share the database and run with '
+            'DRCHRONO_BASE_URL=http://127.0.0.1:<--standin-port>'
+        ))
+        parser.add_argument('--workers', type=int, default=2, help='Server worker processes')
+        parser.add_argument('--users', type=int, default=10, help='Simulated users, each sending its next request when the last one is answered')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds of traffic per server')
+        parser.add_argument('--think', type=float, default=0.0, help='Seconds each user pauses between requests')
+        parser.add_argument('--mix', nargs='+', default=['search=4', 'list=4', 'compile=2'], help='Traffic weights, endpoint=weight')
+        parser.add_argument('--compile-sizes', type=int, nargs='+', default=[5, 20, 60], help='Appointments per compile, picked at random')
+        parser.add_argument('--patients', type=int, default=10, help='Stand-in patients')
+        parser.add_argument('--latency', type=float, default=0.05, help='Simulated stand-in seconds per request')
+        parser.add_argument('--standin-port', type=int, default=0, help='Stand-in port (8800 with --url)')
+        parser.add_argument('--timeout', type=float, default=120, help='Seconds before a request counts as failed')
+        parser.add_argument('--output', help='Save results as JSON')
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+        if options['users'] < 1 or options['workers'] < 1 or options['patients'] < 1 or min(options['compile_sizes']) < 1:
+            raise CommandError('--users, --workers, --patients and --compile-sizes must be at least 1')
+        port = options['standin_port'] or (8800 if options['url'] else 0)
+
+        results = {}
+        api = StandInDrChrono(latency=options['latency']).start(port=port)
+        # Seeding mirrors the patients from this process
+        with api, override_settings(DRCHRONO_API_URL=api.api_url):
+            token = f'loadtest-{get_random_string(8)}'
+            # Enough appointments for the biggest compile
+            patients = seed(api, token, options['patients'], max(options['compile_sizes']))
+            sessions = [login(token) for _ in range(options['users'])]
+
+            targets = [(options['url'], options['url'])] if options['url'] else [(name, None) for name in options['server']]
+            for name, url in targets:
+                with ServerProcess(name, api, options['workers']) if url is None else RunningServer(url) as base_url:
+                    label = name if options['url'] else f"{name}, {options['workers']} workers"
+                    self.stdout.write(
+                        f"\n{label}: {options['users']} users for {options['duration']:.0f}s, "
+                        f"stand-in latency {options['latency'] * 1000:.0f} ms"
+                    )
+                    started = time.perf_counter()
+                    samples = asyncio.run(self.run(base_url, sessions, patients, mix, options))
+                    results[name] = self.report(samples, time.perf_counter() - started)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'created': timezone.now().isoformat(),
+                    'options': {key: options[key] for key in (
+                        'workers', 'users', 'duration', 'think', 'mix', 'compile_sizes', 'patients', 'latency',
+                    )},
+                    'results': results,
+                }, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results saved to {options['output']}"))
+
+    def parse_mix(self, values: list[str]) -> dict[str, float]:
+        mix = {}
+        for value in values:
+            endpoint, _, weight = value.partition('=')
+            if endpoint not in ('search', 'list', 'compile'):
+                raise CommandError(f"Unknown endpoint {endpoint!r} in --mix, use search, list or compile")
+            try:
+                mix[endpoint] = float(weight or 1)
+            except ValueError:
+                raise CommandError(f"--mix weight of {endpoint} is not a number")
+        if not any(mix.values()):
+            raise CommandError('--mix needs a positive weight')
+        return mix
+
+    # ── Traffic ─────────────────────────────────────────────────────────────────
+    async def run(self, base_url: str, sessions, patients, mix: dict, options) -> list[tuple[str, float, str | None]]:
+        """
+        (endpoint, seconds, error or None) per request sent before the duration ran out.
+        """
+        endpoints, weights = list(mix), list(mix.values())
+        stop_at = time.perf_counter() + options['duration']
+        samples = []
+
+        async def request(client, endpoint: str):
+            patient, appt_ids = random.choice(patients)
+            if endpoint == 'search':
+                return 'search', 302, await client.post(reverse('search_app:search'), data={'last_name': LAST_NAME})
+            if endpoint == 'list':
+                url = reverse('appts_app:historical_list', kwargs={'patient_id': patient['id'], 'patient_name': LAST_NAME})
+                return 'list', 200, await client.get(url)
+            size = random.choice(options['compile_sizes'])
+            resp = await client.post(
+                reverse('pdf_app:generate_selected', kwargs={'patient_id': patient['id']}),
+                data={'selected_appts': [str(appt_id) for appt_id in appt_ids[:size]], 'patient_name': LAST_NAME},
+            )
+            return f'compile:{size}', 200, resp
+
+        async def user(cookies, headers):
+            async with httpx.AsyncClient(base_url=base_url, cookies=cookies, headers=headers, timeout=options['timeout']) as client:
+                while time.perf_counter() < stop_at:
+                    endpoint = random.choices(endpoints, weights)[0]
+                    started = time.perf_counter()
+                    try:
+                        name, expected, resp = await request(client, endpoint)
+                        error = None if resp.status_code == expected else f'HTTP {resp.status_code}'
+                        # The compile view answers 200 with the form and a message when it could not compile
+                        if error is None and name.startswith('compile') and resp.headers.get('Content-Type') != 'application/pdf':
+                            error = 'no PDF'
+                    except httpx.HTTPError as e:
+                        name, error = endpoint, type(e).__name__
+                    samples.append((name, time.perf_counter() - started, error))
+                    if options['think']:
+                        await asyncio.sleep(options['think'])
+
+        await asyncio.gather(*(user(cookies, headers) for cookies, headers in sessions))
+        return samples
+
+    # ── Report ──────────────────────────────────────────────────────────────────
+    def report(self, samples, wall: float) -> dict:
+        by_endpoint = {}
+        for name, seconds, error in samples:
+            by_endpoint.setdefault(name, []).append((seconds, error))
+        by_endpoint['all'] = [(seconds, error) for _, seconds, error in samples]
+
+        self.stdout.write(
+            f"{'endpoint':<12}{'requests':>9}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        )
+        summary = {}
+        for name in sorted(by_endpoint, key=lambda name: (name == 'all', name.split(':')[0], int(name.partition(':')[2] or 0))):
+            rows = by_endpoint[name]
+            latencies = sorted(seconds * 1000 for seconds, _ in rows)
+            errors = [error for _, error in rows if error]
+            summary[name] = {
+                'requests': len(rows),
+                'errors': len(errors),
+                'error_rate': round(len(errors) / len(rows), 4),
+                'per_second': round(len(rows) / wall, 2),
+                'p50_ms': round(percentile(latencies, 50), 1),
+                'p95_ms': round(percentile(latencies, 95), 1),
+                'p99_ms': round(percentile(latencies, 99), 1),
+                'max_ms': round(latencies[-1], 1),
+                'error_kinds': {kind: errors.count(kind) for kind in sorted(set(errors))},
+            }
+            row = summary[name]
+            self.stdout.write(
+                f"{name:<12}{row['requests']:>9}{row['errors']:>8}{row['per_second']:>8.1f}"
+                f"{row['p50_ms']:>9.0f}{row['p95_ms']:>9.0f}{row['p99_ms']:>9.0f}{row['max_ms']:>9.0f}"
+            )
+        if not samples:
+            self.stderr.write('No request finished within --duration')
+        for name, row in summary.items():
+            if row['errors'] and name != 'all':
+                kinds = ', '.join(f'{kind} x{count}' for kind, count in row['error_kinds'].items())
+                self.stderr.write(f"{name}: {row['error_rate']:.1%} failed ({kinds})")
+        return summary
+
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.standin import StandInDrChrono
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the local DrChrono stand-in until interrupted, with synthetic patients and / or a recorded "
+        "fixture, for working on the app offline. Point the app at it with DRCHRONO_BASE_URL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8800)
+        parser.add_argument('--fixture', help='Recorded fixture JSON to serve (see bench_appointment_list --record)')
+        parser.add_argument('--patients', type=int, default=3, help='Synthetic patients to add')
+        parser.add_argument('--appointments', type=int, default=20, help='Past appointments per synthetic patient')
+        parser.add_argument('--note-pages', type=int, default=1, help='Pages per clinical note')
+        parser.add_argument('--scan-dpi', type=int, default=0, help='Scanned (image) notes at this DPI instead of blank pages')
+        parser.add_argument('--latency', type=float, default=0.0, help='Simulated seconds per request')
+        parser.add_argument('--bandwidth', type=int, default=None, help='Simulated bytes per second')
+
+    def handle(self, *args, **options):
+        api = StandInDrChrono(latency=options['latency'], bandwidth=options['bandwidth'])
+        if options['fixture']:
+            api.load_fixture(options['fixture'])
+        for number in range(options['patients']):
+            api.add_synthetic_patient(
+                options['appointments'], options['note_pages'], options['scan_dpi'],
+                first_name=f'Patient{number + 1}', last_name='Standin',
+            )
+
+        api.start(port=options['port'])
+        self.stdout.write(self.style.SUCCESS(
+            f"DrChrono stand-in on {api.url}: {len(api.patients)} patients, {len(api.appointments)} appointments"
+        ))
+        self.stdout.write("Run the app with:")
+        self.stdout.write(f"  DRCHRONO_BASE_URL={api.url} OAUTHLIB_INSECURE_TRANSPORT=1 DRCHRONO_CLIENT_ID=standin DRCHRONO_CLIENT_SECRET=standin")
+        self.stdout.write("Patients:")
+        for patient in api.patients.values():
+            self.stdout.write(f"  {patient['id']} {patient['last_name']}, {patient['first_name']} ({patient.get('chart_id', '')})")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            api.stop()
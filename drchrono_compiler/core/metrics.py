@@ -0,0 +1,80 @@
+import os
+import re
+from urllib.parse import urlparse
+
+from django.conf import settings
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Prometheus metrics, served at /metrics when METRICS_ENABLED (core.views.metrics).
+# Collection is always on and cheap (an in memory increment per event). With several worker processes
+# (gunicorn, uvicorn --workers, render pool processes) PROMETHEUS_MULTIPROC_DIR must point at an empty
+# directory: every process writes its values to mmapped files there and a scrape sums them up.
+# prometheus_client reads the variable on import, set it in the environment before the server starts.
+
+# Compile sizes are bucketed so labels stay few
+PACKET_SIZES = ((1, '1'), (5, '2-5'), (20, '6-20'), (60, '21-60'))
+# Path ids become :id so labels stay few
+_ID = re.compile(r'/\d+(?=/|$)')
+
+SECONDS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+
+drchrono_requests = Histogram(
+    'drchrono_request_seconds', 'DrChrono round trips (retries count again) by endpoint and status',
+    ['endpoint', 'status'], buckets=SECONDS,
+)
+token_refreshes = Counter('drchrono_token_refreshes_total', 'OAuth token refreshes', ['result'])
+compile_seconds = Histogram(
+    'packet_compile_seconds', 'Packet compiles by number of appointments', ['appointments'], buckets=SECONDS,
+)
+compile_bytes = Histogram(
+    'packet_compile_bytes', 'Size of compiled packets by number of appointments', ['appointments'],
+    buckets=(1e5, 5e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8),
+)
+compiles_in_flight = Gauge(
+    'packet_compiles_in_flight', 'Compiles (PDF and ZIP) running now', multiprocess_mode='livesum',
+)
+notes_downloaded = Counter('clinical_notes_downloaded_total', 'Clinical note PDFs downloaded')
+note_bytes = Counter('clinical_note_bytes_total', 'Bytes of clinical note PDFs downloaded')
+hcfa_pages = Counter('hcfa_pages_rendered_total', 'HCFA claim pages rendered')
+compile_admissions = Counter(
+    'packet_compile_admissions_total',
+    'Compile admission decisions (pdf.admission): light, heavy, background or rejected (no heavy compile slot free)',
+    ['decision'],
+)
+cache_lookups = Counter(
+    'compile_cache_lookups_total', 'Compile cache lookups: hit, joined (an in-flight warm-up fetch) or miss',
+    ['kind', 'result'],
+)
+
+
+def packet_size(appointments: int) -> str:
+    for limit, label in PACKET_SIZES:
+        if appointments <= limit:
+            return label
+    return f'{PACKET_SIZES[-1][0] + 1}+'
+
+
+def endpoint(url: str) -> str:
+    """
+    Label for a DrChrono URL: the API path with ids replaced (ex: appointments/:id), 'notes' for note storage.
+    """
+    api_path = urlparse(settings.DRCHRONO_API_URL).path.rstrip('/')
+    path = urlparse(url).path
+    if not path.startswith(api_path + '/'):
+        return 'notes'
+    return _ID.sub('/:id', path[len(api_path) + 1:]).strip('/')
+
+
+def observe_call(url: str, status: int | None, seconds: float) -> None:
+    drchrono_requests.labels(endpoint(url), str(status) if status else 'error').observe(seconds)
+
+
+def render() -> bytes:
+    """
+    The exposition text: this process's metrics, or every process's under PROMETHEUS_MULTIPROC_DIR.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
@@ -1,3 +1,27 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+# Profiles of single requests, recorded on demand by staff (core.profiling) and downloaded from the admin.
+
+
+class RequestProfile(models.Model):
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    method = models.CharField(max_length=8)
+    # URL route and view name, not the path: paths carry patient names
+    route = models.CharField(max_length=255, blank=True)
+    view = models.CharField(max_length=255, blank=True)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    duration_ms = models.PositiveIntegerField()
+    peak_memory = models.PositiveBigIntegerField(help_text='Peak traced Python memory in bytes (tracemalloc)')
+    # core.timing summary, stage peaks added under stages.<name>.peak_bytes
+    stages = models.JSONField(default=dict)
+    report = models.TextField(help_text='CPU hot spots and allocation sites')
+    # marshalled pstats data, the format of cProfile's dump_stats (snakeviz, pstats)
+    pstats = models.BinaryField()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.view or self.route} ({self.duration_ms} ms, {self.created_at:%Y-%m-%d %H:%M})"
@@ -0,0 +1,190 @@
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+
+from . import timing
+
+# On demand profiling of one request, for staff: ?profile=1 or an `X-Profile: 1` header on a view
+# wrapped in @profiled runs it under cProfile and tracemalloc and stores a RequestProfile (admin).
+# Render steps handed to the render thread pool are profiled too (pdf.compile.render wraps them with
+# threaded()): before Python 3.12 a profiler only sees its own thread, so they get one of their own merged
+# in; from 3.12 the request's profiler sees every thread and a second one would fail to start. The render
+# process pool is not profiled.
+# cProfile and tracemalloc are process wide, so one request per process is profiled at a time and
+# other requests running meanwhile show up in it. Without the switch a request pays one dict lookup.
+
+_current: ContextVar['Session | None'] = ContextVar('profile', default=None)
+_busy = threading.Lock()
+# cProfile runs on sys.monitoring from 3.12: one process wide profiler
+_PER_THREAD = sys.version_info < (3, 12)
+
+REPORT_LINES = 40
+ALLOCATION_SITES = 25
+
+
+class Session:
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.thread_profiles = []
+        self._lock = threading.Lock()
+
+    def run_threaded(self, fn, *args, **kwargs):
+        """
+        Run `fn` under a profiler of this thread, merged into the session's stats.
+        """
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(fn, *args, **kwargs)
+        finally:
+            with self._lock:
+                self.thread_profiles.append(profile)
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.profile, stream=io.StringIO())
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        return stats
+
+
+def requested(request, user) -> bool:
+    if not settings.REQUEST_PROFILING:
+        return False
+    if request.GET.get('profile') != '1' and request.headers.get('X-Profile') != '1':
+        return False
+    return user.is_authenticated and user.is_staff
+
+
+def threaded(fn):
+    """
+    Wrap `fn`, run in a thread pool, so it is profiled when the request that handed it over is.
+    Pair with timing.bind: the thread needs the request's context.
+    """
+    if not _PER_THREAD:
+        return fn
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        session = _current.get()
+        if session is None:
+            return fn(*args, **kwargs)
+        return session.run_threaded(fn, *args, **kwargs)
+    return run
+
+
+def _start():
+    """
+    Begin a session, None when another request of this process is being profiled.
+    """
+    if not _busy.acquire(blocking=False):
+        return None, None
+    session = Session()
+    token = _current.set(session)
+    trace = timing.current()
+    if trace is not None:
+        trace.memory = {}
+    tracemalloc.start()
+    session.started = time.perf_counter()
+    session.profile.enable()
+    return session, token
+
+
+def _stop(session: Session, token) -> None:
+    session.profile.disable()
+    session.seconds = time.perf_counter() - session.started
+    session.peak_memory = tracemalloc.get_traced_memory()[1]
+    session.snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    _current.reset(token)
+    _busy.release()
+
+
+def _save(session: Session, request, user, response):
+    from .models import RequestProfile
+
+    trace = timing.current()
+    summary = trace.summary() if trace is not None else {}
+    stages = summary.get('stages', {})
+    for name, peak in (getattr(trace, 'memory', None) or {}).items():
+        stages.setdefault(name, {})['peak_bytes'] = peak
+
+    stats = session.stats()
+    report = io.StringIO()
+    stats.stream = report
+    report.write(f"CPU: top {REPORT_LINES} functions by cumulative time\n")
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_LINES)
+    report.write(f"\nCPU: top {REPORT_LINES} functions by own time\n")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(REPORT_LINES)
+    report.write(f"\nMemory: peak {session.peak_memory / 1e6:.1f} MB traced, per stage:\n")
+    for name, stage in sorted(stages.items(), key=lambda item: -item[1].get('peak_bytes', 0)):
+        if 'peak_bytes' in stage:
+            report.write(f"  {name:<24}{stage['peak_bytes'] / 1e6:>10.1f} MB\n")
+    report.write(f"\nMemory: top {ALLOCATION_SITES} allocation sites still held at the end of the request\n")
+    for stat in session.snapshot.statistics('lineno')[:ALLOCATION_SITES]:
+        report.write(f"  {stat}\n")
+
+    match = getattr(request, 'resolver_match', None)
+    return RequestProfile.objects.create(
+        user=user if user.is_authenticated else None,
+        method=request.method,
+        route=match.route if match else '',
+        view=match.view_name if match else '',
+        status=getattr(response, 'status_code', None),
+        duration_ms=round(session.seconds * 1000),
+        peak_memory=session.peak_memory,
+        stages=stages,
+        report=report.getvalue(),
+        pstats=marshal.dumps(stats.stats),
+    )
+
+
+def profiled(view):
+    """
+    View decorator (sync or async): profile the request when staff ask for it, the response then
+    carries the stored profile's id in X-Profile-Id.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def run_async(request, *args, **kwargs):
+            user = await request.auser()
+            if not requested(request, user):
+                return await view(request, *args, **kwargs)
+            session, token = _start()
+            if session is None:
+                return await view(request, *args, **kwargs)
+            try:
+                response = await view(request, *args, **kwargs)
+            finally:
+                _stop(session, token)
+            saved = await sync_to_async(_save)(session, request, user, response)
+            response['X-Profile-Id'] = str(saved.pk)
+            return response
+        return run_async
+
+    @wraps(view)
+    def run(request, *args, **kwargs):
+        if not requested(request, request.user):
+            return view(request, *args, **kwargs)
+        session, token = _start()
+        if session is None:
+            return view(request, *args, **kwargs)
+        try:
+            response = view(request, *args, **kwargs)
+            # Lazy template responses render inside the profile
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        finally:
+            _stop(session, token)
+        response['X-Profile-Id'] = str(_save(session, request, request.user, response).pk)
+        return response
+    return run
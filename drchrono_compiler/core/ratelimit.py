@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+
+# Client side pacing of DrChrono API calls. Every call takes a token from the global bucket
+# (whole process) and from the bucket of the user's access token, waiting when either is empty.
+# A 429 pauses that user's bucket for the Retry-After the API asked for.
+
+# Idle user buckets kept before full ones are dropped
+MAX_USER_BUCKETS = 1000
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, holding at most `capacity`. Not thread safe, the scheduler locks around it.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """
+        Seconds until a token is available (0 -> available now).
+        """
+        now = self.clock()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    def idle(self) -> bool:
+        now = self.clock()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class RequestScheduler:
+    """
+    Global + per-user token buckets. acquire(key) blocks until both allow one more request.
+    """
+
+    def __init__(self, rate: float, burst: float, user_rate: float, user_burst: float, clock=time.monotonic):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.clock = clock
+        self.global_bucket = TokenBucket(rate, burst, clock)
+        self.user_buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _user_bucket(self, key: str) -> TokenBucket:
+        bucket = self.user_buckets.get(key)
+        if bucket is None:
+            if len(self.user_buckets) >= MAX_USER_BUCKETS:
+                self.user_buckets = {k: b for k, b in self.user_buckets.items() if not b.idle()}
+            bucket = self.user_buckets[key] = TokenBucket(self.user_rate, self.user_burst, self.clock)
+        return bucket
+
+    def _try_take(self, key: str | None) -> float:
+        """
+        Take a slot for `key` if both buckets allow it (-> 0), else return the seconds to wait.
+        """
+        with self._lock:
+            buckets = [self.global_bucket]
+            if key is not None:
+                buckets.append(self._user_bucket(key))
+            wait = max(bucket.wait_time() for bucket in buckets)
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.take()
+            return wait
+
+    def acquire(self, key: str | None = None, sleep=time.sleep) -> float:
+        """
+        Wait for a slot for `key` (None -> global budget only), return the seconds spent waiting.
+        """
+        waited = 0.0
+        while (wait := self._try_take(key)) > 0:
+            sleep(wait)
+            waited += wait
+        return waited
+
+    async def aacquire(self, key: str | None = None, sleep=asyncio.sleep) -> float:
+        """
+        acquire() for the event loop, waits without blocking it.
+        """
+        waited = 0.0
+        while (wait := self._try_take(key)) > 0:
+            await sleep(wait)
+            waited += wait
+        return waited
+
+    def pause(self, key: str | None, seconds: float) -> None:
+        """
+        Hold back requests for `key` (None -> everyone) for `seconds`, ex: a 429 Retry-After.
+        """
+        with self._lock:
+            bucket = self.global_bucket if key is None else self._user_bucket(key)
+            bucket.pause(seconds)
+
+
+def user_key(token: str) -> str:
+    # Buckets are keyed on a digest, raw access tokens are not kept around
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+_scheduler = None
+_scheduler_config = None
+_scheduler_lock = threading.Lock()
+
+
+def scheduler() -> RequestScheduler:
+    """
+    Process wide scheduler, rebuilt when the rate limit settings change.
+    """
+    global _scheduler, _scheduler_config
+    config = (
+        settings.DRCHRONO_RATE_LIMIT,
+        settings.DRCHRONO_RATE_BURST,
+        settings.DRCHRONO_USER_RATE_LIMIT,
+        settings.DRCHRONO_USER_RATE_BURST,
+    )
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_config != config:
+            _scheduler = RequestScheduler(*config)
+            _scheduler_config = config
+        return _scheduler
@@ -0,0 +1,524 @@
+"""
+Local stand-in for the DrChrono API, used by tests and offline runs.
+
+Serves an in-memory set of patients, appointments, line items and clinical note PDFs
+over HTTP on localhost, following the response shapes the app relies on, plus the OAuth
+endpoints (authorize approves right away). `manage.py run_standin` serves one for offline use.
+"""
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from itertools import count
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from pypdf import PdfWriter
+
+# Keys DrChrono only returns on appointments when verbose=true
+VERBOSE_APPOINTMENT_KEYS = ('clinical_note', 'custom_vitals', 'status_transitions', 'reminders', 'extended_updated_at')
+
+# The practice: one doctor (the current user) and its office, every appointment is theirs unless told otherwise
+DOCTOR = {
+    'id': 1, 'first_name': 'Emily', 'last_name': 'Kurokawa', 'suffix': 'MD', 'npi_number': '1326453796',
+    'practice_group_name': 'Back Pain MD', 'office_phone': '(678) 404-7643',
+}
+OFFICE = {
+    'id': 1, 'doctor': 1, 'name': 'Primary Office', 'address': '4500 Satellite Blvd, Suite 1140', 'city': 'Duluth',
+    'state': 'GA', 'zip_code': '30096', 'phone_number': '(678) 404-7643',
+}
+
+
+def blank_note_pdf(pages: int = 1) -> bytes:
+    """
+    Return a minimal clinical note PDF with the given number of blank pages.
+    """
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=612, height=792)
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def scanned_note_pdf(pages: int = 1, dpi: int = 300, seed: int = 0) -> bytes:
+    """
+    Return a clinical note PDF like a scanned paper chart: one full page grayscale JPEG per page, at `dpi`.
+    """
+    from PIL import Image, ImageDraw
+
+    rnd = random.Random(seed)
+    scans = []
+    for _ in range(pages):
+        scan = Image.new('L', (int(8.5 * dpi), 11 * dpi), 245)
+        draw = ImageDraw.Draw(scan)
+        for y in range(dpi // 2, scan.height - dpi // 2, dpi // 7):
+            draw.text((dpi // 2, y), ' '.join(''.join(rnd.choices('abcdefghijklmnop', k=6)) for _ in range(20)), fill=20)
+        # Paper grain, what makes real scans big
+        scans.append(Image.blend(scan, Image.effect_noise(scan.size, 12).convert('L'), 0.15))
+    buffer = BytesIO()
+    scans[0].save(buffer, 'PDF', resolution=dpi, save_all=True, append_images=scans[1:], quality=90)
+    return buffer.getvalue()
+
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class StandInDrChrono:
+    """
+    In-memory DrChrono look-alike. Use as a context manager:
+
+        with StandInDrChrono() as api:
+            patient = api.add_patient(first_name='Jane', last_name='Doe')
+            api.add_appointment(patient['id'], '2025-01-10T09:00:00')
+            with override_settings(DRCHRONO_API_URL=api.api_url): ...
+    """
+
+    def __init__(self, page_size: int = 50, latency: float = 0.0, bandwidth: int | None = None,
+                 rate_limit: int | None = None, rate_window: float = 1.0):
+        self.default_page_size = page_size
+        # Simulated network: fixed seconds per request plus body size / bandwidth (bytes per second)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        # Simulated throttling: at most `rate_limit` API requests per `rate_window` seconds, then 429 + Retry-After
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.throttled = 0
+        self._window_start = 0.0
+        self._window_count = 0
+        self._failures = []
+        self.doctors = {DOCTOR['id']: dict(DOCTOR)}
+        self.offices = {OFFICE['id']: dict(OFFICE)}
+        self.patients = {}
+        self.appointments = {}
+        self.line_items = {}
+        self.notes = {}
+        # Bearer token -> patient ids it may read, like a user of another practice; tokens not listed read every patient
+        self.practices = {}
+        # Refresh tokens the token endpoint accepts; each one is rotated (single use) like DrChrono's
+        self.refresh_tokens = set()
+        self.token_refreshes = 0
+        # Codes handed out by /o/authorize/, exchanged once at the token endpoint
+        self.auth_codes = set()
+        self.calls = []
+        self._ids = count(1000)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    # ── Data setup ──────────────────────────────────────────────────────────────
+    def add_patient(self, **fields) -> dict:
+        patient = {
+            'id': next(self._ids),
+            'first_name': 'Jane',
+            'last_name': 'Doe',
+            'date_of_birth': '1980-01-31',
+            'gender': 'Female',
+            'address': '1 Main St',
+            'city': 'Duluth',
+            'state': 'GA',
+            'zip_code': '30096',
+            'cell_phone': '(678) 555-0100',
+            'chart_id': f'CH{len(self.patients) + 1:04d}',
+            **fields,
+        }
+        self.patients[patient['id']] = patient
+        return patient
+
+    def add_appointment(self, patient_id: int, scheduled_time: str, note: bool = True, **fields) -> dict:
+        appt_id = fields.pop('id', None) or next(self._ids)
+        appt = {
+            'id': appt_id,
+            'patient': patient_id,
+            'doctor': DOCTOR['id'],
+            'office': OFFICE['id'],
+            'scheduled_time': scheduled_time,
+            'status': 'Complete',
+            'reason': 'Follow up',
+            'icd10_codes': ['M54.5'],
+            'clinical_note': None,
+            'updated_at': _now(),
+            **fields,
+        }
+        if note:
+            self.notes[appt_id] = blank_note_pdf()
+            appt['clinical_note'] = {
+                'locked': True,
+                'pdf': f'/notes/{appt_id}.pdf',
+                'updated_at': _now(),
+            }
+        self.appointments[appt_id] = appt
+        return appt
+
+    def add_line_item(self, appointment_id: int, **fields) -> dict:
+        appt = self.appointments[appointment_id]
+        item = {
+            'id': next(self._ids),
+            'appointment': appointment_id,
+            'patient': appt['patient'],
+            'service_date': appt['scheduled_time'][:10],
+            'code': '99213',
+            'procedure_type': 'C',
+            'diagnosis_pointers': ['A'],
+            'price': '150.00',
+            'balance_total': '150.00',
+            'updated_at': _now(),
+            **fields,
+        }
+        self.line_items[item['id']] = item
+        return item
+
+    def add_synthetic_patient(self, appointments: int, note_pages: int = 1, scan_dpi: int = 0, **fields) -> dict:
+        """
+        A patient with `appointments` past appointments (one a day back from yesterday), each with a line item
+        and a clinical note of `note_pages` pages: blank, or scanned at `scan_dpi` for realistic note sizes.
+        """
+        patient = self.add_patient(**fields)
+        for days in range(1, appointments + 1):
+            scheduled = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT09:00:00')
+            appt = self.add_appointment(patient['id'], scheduled)
+            self.add_line_item(appt['id'])
+            if scan_dpi:
+                self.notes[appt['id']] = scanned_note_pdf(note_pages, scan_dpi, seed=appt['id'])
+            elif note_pages != 1:
+                self.notes[appt['id']] = blank_note_pdf(note_pages)
+        return patient
+
+    def update(self, collection: dict, obj_id: int, **fields) -> dict:
+        """
+        Change a stored object and bump its updated_at, like an edit inside DrChrono.
+        """
+        obj = collection[obj_id]
+        obj.update(fields, updated_at=_now())
+        return obj
+
+    def load_fixture(self, path) -> 'StandInDrChrono':
+        """
+        Load patients, appointments and line items from a JSON fixture
+        ({"patients": [...], "appointments": [...], "line_items": [...]}), ex: one recorded by bench_appointment_list.
+        Every appointment with a clinical note gets a blank note PDF.
+        """
+        with open(path) as fixture:
+            data = json.load(fixture)
+
+        for patient in data.get('patients', []):
+            self.patients[patient['id']] = patient
+        for appt in data.get('appointments', []):
+            note = appt.get('clinical_note')
+            if isinstance(note, dict) and note.get('pdf'):
+                self.notes[appt['id']] = blank_note_pdf()
+                appt['clinical_note'] = {**note, 'pdf': f"/notes/{appt['id']}.pdf"}
+            self.appointments[appt['id']] = appt
+        for item in data.get('line_items', []):
+            self.line_items[item['id']] = item
+        return self
+
+    def fail_next(self, count: int, status: int = 503, retry_after: str | None = None) -> None:
+        """
+        Answer the next `count` API requests with `status` (ex: 429 with a Retry-After, 503).
+        """
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def transfer_delay(self, size: int) -> float:
+        delay = self.latency
+        if self.bandwidth:
+            delay += size / self.bandwidth
+        return delay
+
+    # ── Server lifecycle ────────────────────────────────────────────────────────
+    @property
+    def url(self) -> str:
+        if self._server is None:
+            return 'http://127.0.0.1'
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self) -> str:
+        return f'{self.url}/api'
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> 'StandInDrChrono':
+        self._server = _Server((host, port), _Handler)
+        self._server.standin = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        # Already started (ex: to read its port for settings overrides) stays as it is
+        return self if self._server is not None else self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def calls_to(self, path: str) -> list:
+        """
+        Return logged (path, query) calls whose path starts with `path`.
+        """
+        return [call for call in self.calls if call[0].startswith(path)]
+
+    # ── Request handling ────────────────────────────────────────────────────────
+    def handle(self, method: str, path: str, query: dict, token: str = '') -> tuple[int, str, bytes, dict]:
+        with self._lock:
+            self.calls.append((path, query))
+            refusal = self._refusal(path)
+        if refusal is not None:
+            return refusal
+        if not self._may_read(token, path, query):
+            # Another practice's patient: not found, and left out of listings
+            if re.fullmatch(r'/api/(patients|appointments)/\d+', path):
+                return (*self._json(404, {'detail': 'Not found.'}), {})
+            return (*self._page([], query, path), {})
+
+        for pattern, handler in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if match:
+                response = handler(self, method, query, *match.groups())
+                return response if len(response) == 4 else (*response, {})
+        return (*self._json(404, {'detail': 'Not found.'}), {})
+
+    def _refusal(self, path: str) -> tuple[int, str, bytes, dict] | None:
+        """
+        Scripted failure or rate limit answer for an API request, None to serve it. Called under the lock.
+        """
+        if not path.startswith('/api/'):
+            return None
+        if self._failures:
+            status, retry_after = self._failures.pop(0)
+            if status == 429:
+                self.throttled += 1
+            headers = {'Retry-After': retry_after} if retry_after else {}
+            return (*self._json(status, {'detail': 'Scripted failure.'}), headers)
+
+        if self.rate_limit:
+            now = time.monotonic()
+            if now - self._window_start >= self.rate_window:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            if self._window_count > self.rate_limit:
+                self.throttled += 1
+                wait = self.rate_window - (now - self._window_start)
+                return (*self._json(429, {'detail': 'Request was throttled.'}), {'Retry-After': f'{wait:.3f}'})
+        return None
+
+    def _may_read(self, token: str, path: str, query: dict) -> bool:
+        if token not in self.practices:
+            return True
+        patient = query.get('patient')
+        if match := re.fullmatch(r'/api/patients/(\d+)', path):
+            patient = match.group(1)
+        elif match := re.fullmatch(r'/api/appointments/(\d+)', path):
+            patient = self.appointments.get(int(match.group(1)), {}).get('patient')
+        return patient is None or int(patient) in self.practices[token]
+
+    def _json(self, status: int, payload) -> tuple[int, str, bytes]:
+        return status, 'application/json', json.dumps(payload).encode()
+
+    def _page(self, results: list, query: dict, path: str) -> tuple[int, str, bytes]:
+        page_size = int(query.get('page_size', self.default_page_size))
+        offset = int(query.get('cursor', 0))
+        page = results[offset:offset + page_size]
+        next_url = None
+        if offset + page_size < len(results):
+            next_url = f'{self.url}{path}?' + urlencode({**query, 'cursor': offset + page_size})
+        return self._json(200, {'previous': None, 'next': next_url, 'results': page})
+
+    def _patient(self, method, query, patient_id):
+        patient = self.patients.get(int(patient_id))
+        if patient is None:
+            return self._json(404, {'detail': 'Not found.'})
+        return self._json(200, patient)
+
+    def _patients_summary(self, method, query):
+        results = [
+            p for p in self.patients.values()
+            if all(str(p.get(key, '')).lower() == value.lower() for key, value in query.items()
+                   if key in ('first_name', 'last_name', 'date_of_birth', 'chart_id'))
+        ]
+        return self._page(results, query, '/api/patients_summary')
+
+    def _appointment_view(self, appt: dict, verbose: bool) -> dict:
+        if verbose:
+            note = appt.get('clinical_note')
+            if note and note.get('pdf', '').startswith('/'):
+                # Note links are stored relative so they follow the bound port
+                appt = {**appt, 'clinical_note': {**note, 'pdf': f"{self.url}{note['pdf']}"}}
+            return appt
+        return {k: v for k, v in appt.items() if k not in VERBOSE_APPOINTMENT_KEYS}
+
+    def _appointments(self, method, query):
+        results = list(self.appointments.values())
+        if 'patient' in query:
+            results = [a for a in results if a['patient'] == int(query['patient'])]
+        if 'since' in query:
+            results = [a for a in results if a['updated_at'] >= query['since']]
+        verbose = query.get('verbose') == 'true'
+        results = [self._appointment_view(a, verbose) for a in results]
+        return self._page(results, query, '/api/appointments')
+
+    def _appointment(self, method, query, appt_id):
+        appt = self.appointments.get(int(appt_id))
+        if appt is None:
+            return self._json(404, {'detail': 'Not found.'})
+        return self._json(200, self._appointment_view(appt, query.get('verbose') == 'true'))
+
+    def _doctor(self, method, query, doctor_id):
+        doctor = self.doctors.get(int(doctor_id))
+        if doctor is None:
+            return self._json(404, {'detail': 'Not found.'})
+        return self._json(200, doctor)
+
+    def _office(self, method, query, office_id):
+        office = self.offices.get(int(office_id))
+        if office is None:
+            return self._json(404, {'detail': 'Not found.'})
+        return self._json(200, office)
+
+    def _line_items(self, method, query):
+        results = list(self.line_items.values())
+        for key in ('appointment', 'patient'):
+            if key in query:
+                results = [i for i in results if i[key] == int(query[key])]
+        if 'since' in query:
+            results = [i for i in results if i['updated_at'] >= query['since']]
+        return self._page(results, query, '/api/line_items')
+
+    def _clinical_notes(self, method, query):
+        results = []
+        for appt in self.appointments.values():
+            note = appt.get('clinical_note')
+            if not note:
+                continue
+            results.append({
+                'appointment': appt['id'],
+                'patient': appt['patient'],
+                'archived': False,
+                'pdf': f"{self.url}{note['pdf']}" if note.get('pdf', '').startswith('/') else note.get('pdf'),
+                'updated_at': note.get('updated_at') or appt['updated_at'],
+            })
+        for key in ('appointment', 'patient'):
+            if key in query:
+                results = [n for n in results if n[key] == int(query[key])]
+        if 'since' in query:
+            results = [n for n in results if n['updated_at'] >= query['since']]
+        return self._page(results, query, '/api/clinical_notes')
+
+    def _note(self, method, query, appt_id):
+        pdf = self.notes.get(int(appt_id))
+        if pdf is None:
+            return 404, 'text/plain', b'missing'
+        return 200, 'application/pdf', pdf
+
+    def _authorize(self, method, query):
+        """
+        Approve right away, like a user clicking Authorize: back to redirect_uri with a single use code.
+        """
+        if not query.get('redirect_uri'):
+            return self._json(400, {'error': 'invalid_request'})
+        code = f'code-{next(self._ids)}'
+        with self._lock:
+            self.auth_codes.add(code)
+        location = f"{query['redirect_uri']}?" + urlencode({'code': code, 'state': query.get('state', '')})
+        return 302, 'text/plain', b'', {'Location': location}
+
+    def _token(self, method, query):
+        grant = query.get('grant_type')
+        if method != 'POST' or grant not in ('refresh_token', 'authorization_code'):
+            return self._json(400, {'error': 'unsupported_grant_type'})
+        with self._lock:
+            self.token_refreshes += 1
+            if grant == 'authorization_code':
+                if query.get('code') not in self.auth_codes:
+                    return self._json(400, {'error': 'invalid_grant'})
+                self.auth_codes.discard(query['code'])
+            else:
+                if query.get('refresh_token') not in self.refresh_tokens:
+                    return self._json(400, {'error': 'invalid_grant'})
+                self.refresh_tokens.discard(query['refresh_token'])
+            new_refresh = f'refresh-{self.token_refreshes}'
+            self.refresh_tokens.add(new_refresh)
+        return self._json(200, {
+            'access_token': f'access-{self.token_refreshes}',
+            'refresh_token': new_refresh,
+            'expires_in': 7200,
+            'token_type': 'Bearer',
+            'scope': query.get('scope', ''),
+        })
+
+    def _revoke(self, method, query):
+        return self._json(200, {})
+
+    def _current_user(self, method, query):
+        return self._json(200, {'id': 1, 'username': 'standin_user', 'doctor': DOCTOR['id']})
+
+    ROUTES = [
+        (r'/api/patients/(\d+)', _patient),
+        (r'/api/patients_summary', _patients_summary),
+        (r'/api/appointments', _appointments),
+        (r'/api/appointments/(\d+)', _appointment),
+        (r'/api/doctors/(\d+)', _doctor),
+        (r'/api/offices/(\d+)', _office),
+        (r'/api/line_items', _line_items),
+        (r'/api/clinical_notes', _clinical_notes),
+        (r'/api/users/current', _current_user),
+        (r'/notes/(\d+)\.pdf', _note),
+        (r'/o/authorize/', _authorize),
+        (r'/o/token/', _token),
+        (r'/o/revoke_token/', _revoke),
+    ]
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open many connections at once, the default backlog of 5 resets some of them
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def _dispatch(self, method: str):
+        parsed = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode()
+            query.update({k: v[-1] for k, v in parse_qs(body).items()})
+
+        standin = self.server.standin
+        token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+        status, content_type, body, headers = standin.handle(method, parsed.path, query, token)
+        delay = standin.transfer_delay(len(body))
+        if delay:
+            time.sleep(delay)
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Client timed out / gave up while the simulated delay ran
+            pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def log_message(self, format, *args):
+        # Keep test output quiet
+        pass
@@ -0,0 +1,57 @@
+import gc
+import os
+
+# Worker start up. gunicorn calls preload() in the master before it forks the workers (when_ready in
+# gunicorn.conf.py): Django, every view module, ReportLab / pypdf / Pillow, the parsed HCFA form, font
+# metrics and page templates are then loaded once and shared copy-on-write by all workers, and the
+# first compile of a worker no longer pays for them. Servers that spawn fresh processes (uvicorn
+# --workers, the render process pool) load these on first use instead, the heavy libraries lazily.
+
+# Page templates compiled ahead (the cached template loader keeps them per process)
+TEMPLATES = ('appts/historical_list.html', 'search/search.html', 'search/results.html')
+
+# Placeholder claim input for the warm-up render, every box of the form filled
+_PATIENT = {
+    'first_name': 'Warm', 'last_name': 'Up', 'date_of_birth': '1980-01-31', 'gender': 'Female', 'address': '1 Main St',
+    'city': 'Duluth', 'state': 'GA', 'zip_code': '30096', 'cell_phone': '(678) 555-0100',
+}
+_APPOINTMENT = {'icd10_codes': ['M54.5'], 'clinical_note': {'updated_at': '2025-01-31T09:00:00'}}
+_LINE_ITEM = {'service_date': '2025-01-31', 'code': '99213', 'diagnosis_pointers': ['A'], 'price': '150.00'}
+_PROVIDER = {
+    'provider_name': 'Warm Up', 'provider_npi': '0000000000', 'physician_signature': 'W. Up', 'provider_info': 'Warm Up',
+    'office': 'Office', 'provider_address': '1 Main St', 'provider_city_state': 'Duluth, GA 30096',
+    'provider_number': '678 555-0100',
+}
+
+
+def preload() -> None:
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drchrono_compiler.settings')
+    import django
+    django.setup()
+    from django.db import connections
+    from django.urls import get_resolver
+
+    # Imports every view module
+    get_resolver().url_patterns
+    warm_up()
+    # Nothing opened here may be shared with the workers
+    connections.close_all()
+    # Keep the garbage collector from writing to the preloaded objects (their gc headers) in every
+    # worker, which would copy the shared pages
+    gc.freeze()
+
+
+def warm_up() -> None:
+    """
+    Do once what the first compile of a process would: import the PDF libraries, parse the HCFA form and
+    render a throwaway claim and balance report (ReportLab loads fonts, encodings and styles on first use).
+    """
+    import PIL.Image  # packet compaction
+    from django.template.loader import get_template
+    from pdf import services
+
+    services.hcfa_template()
+    services.generate_hcfa_bill(None, services.fetch_hcfa_data(_PATIENT, _APPOINTMENT, [_LINE_ITEM], _PROVIDER))
+    services.render_balance_report({}, [], {}, _PROVIDER['provider_name'])
+    for name in TEMPLATES:
+        get_template(name)
@@ -1,3 +1,1306 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import pstats
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from pypdf import PdfReader
+import httpx
+import requests
+
+from appts.models import Appointment, LineItem, PatientBalance, PatientSync
+from appts.services import (
+    fetch_appointment_details, historical_appointments, line_items_by_appointment, patient_balance, sync_patient,
+)
+from core import breaker, coalesce, deadline, profiling, startup, timing
+from core.api import DrChronoAPIError, DrChronoUnavailable, aapi_get, api_get, iter_results, response_json
+from core.management.commands.coldstart import process_memory
+from core.management.commands.loadtest import Command as LoadTestCommand, percentile
+from core.models import RequestProfile
+from core.ratelimit import RequestScheduler
+from core.standin import StandInDrChrono, scanned_note_pdf
+from pdf import admission, jobs, provider
+from pdf import cache as compile_cache
+from pdf.compact import compact_pdf
+from pdf import render as process_render
+from pdf.compile import compile_packet_sync
+from pdf.models import CompileRun, CompileSlot
+from pdf import services as pdf_services
+from pdf.prefetch import start_warm_up
+from verify.models import DrChronoCredential
+from verify.services import get_valid_access_token
+
+# One JSON line per request (core.timing) would drown the test output, tests of it use assertLogs
+logging.getLogger('core.timing').setLevel(logging.WARNING)
+
+
+def _days_ago(days: int) -> str:
+    return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT09:00:00')
+
+
+class StandInTestCase(TestCase):
+    """
+    Runs each test against a fresh local DrChrono stand-in.
+    """
+
+    def setUp(self):
+        self.api = StandInDrChrono().start()
+        self.addCleanup(self.api.stop)
+        self.addCleanup(breaker.reset)
+        settings_override = override_settings(
+            DRCHRONO_API_URL=self.api.api_url,
+            DRCHRONO_WEBHOOK_SECRET='s3cret',
+            PREFETCH_ENABLED=False,
+            DRCHRONO_USER_RATE_LIMIT=1000,
+            DRCHRONO_USER_RATE_BURST=1000,
+            DRCHRONO_BACKOFF_BASE=0.01,
+            PRACTICE_FEDERAL_ID='12-3456789',
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'compile': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': self.id()},
+            },
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.patient = self.api.add_patient()
+
+    def login(self, expires_in: int = 3600) -> User:
+        user = User.objects.create(username='biller')
+        DrChronoCredential.objects.create(
+            user=user, access_token='token', refresh_token='refresh',
+            expires_at=timezone.now() + timedelta(seconds=expires_in),
+        )
+        self.client.force_login(user)
+        return user
+
+
+class AppointmentMirrorTests(StandInTestCase):
+
+    def test_first_sync_builds_mirror(self):
+        past = self.api.add_appointment(self.patient['id'], _days_ago(10))
+        self.api.add_appointment(self.patient['id'], _days_ago(20), note=False)
+        self.api.add_appointment(self.patient['id'], _days_ago(-5))
+        self.api.add_line_item(past['id'])
+
+        sync_patient(self.patient['id'], 'token')
+
+        self.assertEqual(Appointment.objects.count(), 3)
+        self.assertEqual([a.id for a in historical_appointments(self.patient['id'])], [past['id']])
+        self.assertEqual(len(line_items_by_appointment([past['id']])[past['id']]), 1)
+
+    def test_listing_is_lean(self):
+        self.api.add_appointment(self.patient['id'], _days_ago(10))
+
+        sync_patient(self.patient['id'], 'token')
+
+        self.assertNotIn('verbose', self.api.calls_to('/api/appointments')[0][1])
+        self.assertEqual(historical_appointments(self.patient['id']).count(), 1)
+
+    def test_filters_apply_to_mirror(self):
+        self.api.add_appointment(self.patient['id'], _days_ago(10), status='Complete')
+        self.api.add_appointment(self.patient['id'], _days_ago(40), status='No Show')
+        sync_patient(self.patient['id'], 'token')
+
+        recent = historical_appointments(self.patient['id'], start=datetime.now().date() - timedelta(days=20))
+        no_shows = historical_appointments(self.patient['id'], status='No Show')
+
+        self.assertEqual(recent.count(), 1)
+        self.assertEqual(no_shows.get().status, 'No Show')
+
+    def test_details_fetched_only_for_selection(self):
+        first = self.api.add_appointment(self.patient['id'], _days_ago(10))
+        self.api.add_appointment(self.patient['id'], _days_ago(20))
+
+        details, failures = fetch_appointment_details([first['id'], 999], 'token')
+
+        self.assertEqual(list(details), [first['id']])
+        self.assertIn('clinical_note', details[first['id']])
+        self.assertEqual(list(failures), [999])
+
+    def test_reads_within_interval_only_check_access(self):
+        self.api.add_appointment(self.patient['id'], _days_ago(10))
+        sync_patient(self.patient['id'], 'token')
+        calls = len(self.api.calls)
+
+        sync_patient(self.patient['id'], 'token')
+
+        self.assertEqual([path for path, _ in self.api.calls[calls:]], [f"/api/patients/{self.patient['id']}"])
+
+    def test_mirror_is_not_served_to_a_user_without_access(self):
+        self.api.add_appointment(self.patient['id'], _days_ago(10))
+        sync_patient(self.patient['id'], 'token')
+        self.api.practices['other'] = set()
+
+        with self.assertRaises(requests.HTTPError):
+            sync_patient(self.patient['id'], 'other')
+
+    def test_first_sync_drops_rows_drchrono_no_longer_lists(self):
+        appt = self.api.add_appointment(self.patient['id'], _days_ago(10))
+        item = self.api.add_line_item(appt['id'])
+        sync_patient(self.patient['id'], 'token')
+        del self.api.appointments[appt['id']], self.api.line_items[item['id']]
+        PatientSync.objects.all().delete()
+
+        sync_patient(self.patient['id'], 'token')
+
+        self.assertFalse(Appointment.objects.filter(patient=self.patient['id']))
+        self.assertFalse(LineItem.objects.filter(patient=self.patient['id']))
+        self.assertEqual(patient_balance(self.patient['id']).balance_total, 0)
+
+    def test_incremental_sync_asks_since_last_sync(self):
+        appt = self.api.add_appointment(self.patient['id'], _days_ago(10))
+        sync_patient(self.patient['id'], 'token')
+        self.api.update(self.api.appointments, appt['id'], reason='Changed')
+
+        sync_patient(self.patient['id'], 'token', force=True)
+
+        first, second = [query['since'] for _, query in self.api.calls_to('/api/appointments')]
+        self.assertGreater(second, first)
+        self.assertEqual(Appointment.objects.get(id=appt['id']).reason, 'Changed')
+
+    def test_change_notification_invalidates_row(self):
+        appt = self.api.add_appointment(self.patient['id'], _days_ago(10))
+        sync_patient(self.patient['id'], 'token')
+        self.api.add_line_item(appt['id'], balance_total='40.00')
+
+        body = json.dumps({'object': {'id': appt['id'], 'appointment': appt['id']}}).encode()
+        signature = hmac.new(b's3cret', body, hashlib.sha256).hexdigest()
+        resp = self.client.post(
+            reverse('appts_app:webhook'), body, content_type='application/json',
+            headers={'X-drchrono-event': 'LINE_ITEM_CREATE', 'X-drchrono-signature': signature},
+        )
+
+        self.assertEqual(resp.status_code, 204)
+        self.assertTrue(Appointment.objects.get(id=appt['id']).stale)
+
+        sync_patient(self.patient['id'], 'token')
+
+        self.assertFalse(Appointment.objects.get(id=appt['id']).stale)
+        self.assertEqual(LineItem.objects.filter(appointment=appt['id']).count(), 1)
+
+    def test_change_notification_rejects_bad_signature(self):
+        resp = self.client.post(
+            reverse('appts_app:webhook'), b'{}', content_type='application/json',
+            headers={'X-drchrono-event': 'APPOINTMENT_DELETE', 'X-drchrono-signature': 'nope'},
+        )
+        self.assertEqual(resp.status_code, 403)
+
+
+class CompileCacheWarmUpTests(StandInTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for days in (10, 20, 30):
+            self.api.add_appointment(self.patient['id'], _days_ago(days))
+        sync_patient(self.patient['id'], 'token')
+        self.appts = list(historical_appointments(self.patient['id']))
+
+    def test_warm_up_fills_compile_caches(self):
+        warm_up = start_warm_up('user', self.patient['id'], self.appts, 'token')
+        warm_up.wait(timeout=10)
+        calls = len(self.api.calls)
+
+        details, failures = compile_cache.appointment_details([a.id for a in self.appts], 'token')
+        notes = [compile_cache.note_pdf(payload, 'token') for payload in details.values()]
+
+        self.assertEqual((len(details), failures), (3, {}))
+        self.assertTrue(all(notes))
+        self.assertEqual(len(self.api.calls), calls)
+        # The appointments' provider profile too
+        self.assertEqual(compile_cache.compile_cache().get(provider.profile_key(1, 1))['provider_npi'], '1326453796')
+
+    def test_another_user_misses_the_warmed_caches(self):
+        start_warm_up('user', self.patient['id'], self.appts, 'token').wait(timeout=10)
+        self.api.practices['other'] = set()
+
+        details, failures = compile_cache.appointment_details([a.id for a in self.appts], 'other')
+
+        self.assertEqual((details, len(failures)), ({}, 3))
+        self.assertIsNone(compile_cache.patient_json(self.patient['id'], 'other'))
+        self.assertIsNotNone(compile_cache.patient_json(self.patient['id'], 'token'))
+
+    def test_warm_up_is_deduplicated_per_patient(self):
+        self.api.latency = 0.05
+        first = start_warm_up('user', self.patient['id'], self.appts, 'token')
+        second = start_warm_up('user', self.patient['id'], self.appts, 'token')
+        first.wait(timeout=10)
+
+        self.assertIs(first, second)
+        self.assertEqual(len(self.api.calls_to('/api/appointments/')), 3)
+
+    def test_new_patient_cancels_previous_warm_up(self):
+        first = start_warm_up('user', self.patient['id'], self.appts, 'token')
+        other = self.api.add_patient()
+        start_warm_up('user', other['id'], [], 'token').wait(timeout=10)
+
+        self.assertTrue(first.cancelled.is_set())
+        # Fetches already running finish, keep them from landing in the next test's stand-in
+        first.wait(timeout=10)
+
+
+@override_settings(APPOINTMENT_PAGE_SIZE=5)
+class HistoricalListTests(StandInTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+        self.appts = [self.api.add_appointment(self.patient['id'], _days_ago(days)) for days in range(1, 13)]
+        self.url = reverse('appts_app:historical_list', kwargs={'patient_id': self.patient['id'], 'patient_name': 'Jane Doe'})
+
+    def test_reload_gets_not_modified(self):
+        first = self.client.get(self.url)
+        calls = len(self.api.calls)
+
+        again = self.client.get(self.url, headers={'If-None-Match': first['ETag']})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(again.status_code, 304)
+        # Only the access check
+        self.assertEqual(len(self.api.calls), calls + 1)
+
+    def test_another_practice_does_not_see_the_mirror(self):
+        self.assertEqual(len(self.client.get(self.url).context['appointments']), 5)
+        other = User.objects.create(username='other')
+        DrChronoCredential.objects.create(
+            user=other, access_token='other', refresh_token='other', expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.api.practices['other'] = set()
+        self.client.force_login(other)
+
+        page = self.client.get(self.url)
+
+        self.assertContains(page, 'DrChrono returned 404')
+        self.assertEqual(len(page.context['appointments']), 0)
+        self.assertIsNone(page.context['balance'])
+
+    @override_settings(DRCHRONO_MAX_RETRIES=0)
+    def test_mirror_is_shown_when_drchrono_fails_after_access_was_checked(self):
+        self.client.get(self.url)
+        self.api.fail_next(1)
+
+        page = self.client.get(self.url)
+
+        self.assertContains(page, 'showing the last synced appointments')
+        self.assertEqual(len(page.context['appointments']), 5)
+
+    def test_messages_are_not_hidden_by_not_modified(self):
+        first = self.client.get(self.url)
+        resp = self.client.post(
+            reverse('pdf_app:generate_selected', kwargs={'patient_id': self.patient['id']}), {'patient_name': 'Jane Doe'},
+        )
+        self.assertRedirects(resp, self.url, fetch_redirect_response=False)
+
+        again = self.client.get(self.url, headers={'If-None-Match': first['ETag']})
+
+        self.assertEqual(again.status_code, 200)
+        self.assertContains(again, 'No appointments were selected')
+        # Once shown, the page revalidates again
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': first['ETag']}).status_code, 304)
+
+    def test_change_busts_etag(self):
+        first = self.client.get(self.url)
+        self.api.appointments[self.appts[0]['id']].update(reason='Changed', updated_at=_days_ago(-1))
+        sync_patient(self.patient['id'], 'token', force=True)
+
+        again = self.client.get(self.url, headers={'If-None-Match': first['ETag']})
+
+        self.assertEqual(again.status_code, 200)
+
+    def test_sync_error_shows_drchrono_answer(self):
+        self.api.fail_next(1, status=400)
+
+        page = self.client.get(self.url)
+
+        self.assertContains(page, 'DrChrono returned 400: {&quot;detail&quot;: &quot;Scripted failure.&quot;}')
+        with mock.patch('appts.views.sync_patient', side_effect=requests.HTTPError('connection dropped')):
+            self.assertContains(self.client.get(self.url), 'DrChrono request failed: connection dropped')
+
+    def test_select_all_spans_pages(self):
+        from appts.services import selected_appointment_ids
+        from django.http import QueryDict
+
+        page = self.client.get(self.url + '?page=2')
+        page_ids = [str(appt.id) for appt in page.context['appointments']]
+        data = QueryDict(mutable=True)
+        data.setlist('page_appts', page_ids)
+        data.setlist('selected_appts', page_ids[1:])
+        data['select_all'] = '1'
+
+        selected = selected_appointment_ids(self.patient['id'], data)
+
+        self.assertEqual(page.context['paginator'].count, 12)
+        self.assertEqual(len(selected), 11)
+        self.assertNotIn(page_ids[0], selected)
+
+
+class RateLimitTests(StandInTestCase):
+
+    def test_scheduler_enforces_user_and_global_budgets(self):
+        clock = SimpleNamespace(now=0.0)
+        def sleep(seconds):
+            clock.now += seconds
+        scheduler = RequestScheduler(rate=10, burst=10, user_rate=2, user_burst=2, clock=lambda: clock.now)
+
+        waits = [scheduler.acquire('a', sleep=sleep) for _ in range(4)]
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertAlmostEqual(sum(waits), 1.0)
+        # Another user only shares the global budget
+        self.assertEqual(scheduler.acquire('b', sleep=sleep), 0)
+
+        scheduler.pause('b', 5)
+        self.assertAlmostEqual(scheduler.acquire('b', sleep=sleep), 5)
+
+    def test_throttled_requests_are_retried(self):
+        self.api.rate_limit, self.api.rate_window = 5, 0.3
+        ids = [self.api.add_appointment(self.patient['id'], _days_ago(i + 1))['id'] for i in range(15)]
+
+        details, failures = fetch_appointment_details(ids, 'token')
+
+        self.assertEqual(failures, {})
+        self.assertEqual(list(details), ids)
+        self.assertGreater(self.api.throttled, 0)
+
+    def test_retry_after_is_honored(self):
+        self.api.fail_next(1, status=429, retry_after='0.5')
+
+        started = time.monotonic()
+        list(iter_results('appointments', 'token'))
+        self.assertGreaterEqual(time.monotonic() - started, 0.5)
+        self.assertEqual(len(self.api.calls_to('/api/appointments')), 2)
+
+    @override_settings(DRCHRONO_MAX_RETRIES=2)
+    def test_persistent_errors_raise_instead_of_skipping(self):
+        appt = self.api.add_appointment(self.patient['id'], _days_ago(3))
+        self.api.fail_next(3, status=503)
+
+        with self.assertRaises(DrChronoAPIError):
+            fetch_appointment_details([appt['id']], 'token')
+        self.assertEqual(len(self.api.calls_to('/api/appointments')), 3)
+
+
+class DeadlineTests(StandInTestCase):
+
+    def test_call_gives_up_at_deadline(self):
+        self.api.latency = 1.0
+
+        started = time.monotonic()
+        with deadline.budget(0.3), self.assertRaises(deadline.DeadlineExceeded):
+            api_get(f"patients/{self.patient['id']}", 'token')
+        self.assertLess(time.monotonic() - started, 0.8)
+
+    @override_settings(REQUEST_DEADLINE=1.0, DRCHRONO_FETCH_CONCURRENCY=1)
+    def test_compile_stops_with_partial_report(self):
+        self.login()
+        ids = [str(self.api.add_appointment(self.patient['id'], _days_ago(i + 1))['id']) for i in range(8)]
+        self.api.latency = 0.15
+
+        started = time.monotonic()
+        resp = self.client.post(
+            reverse('pdf_app:generate_selected', kwargs={'patient_id': self.patient['id']}),
+            {'selected_appts': ids, 'patient_name': 'Jane Doe'},
+        )
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertLess(elapsed, 1.6)
+        [message] = [str(m) for m in get_messages(resp.wsgi_request)]
+        self.assertIn('time budget of 1s spent', message)
+        self.assertIn('of 8 appointments', message)
+        run = CompileRun.objects.get()
+        self.assertEqual((run.outcome, run.appointments, run.output_bytes), (CompileRun.DEADLINE, 8, None))
+
+
+@override_settings(BREAKER_MIN_CALLS=3, BREAKER_WINDOW=5, BREAKER_OPEN_SECONDS=30, DRCHRONO_MAX_RETRIES=0)
+class CircuitBreakerTests(StandInTestCase):
+
+    def test_breaker_opens_probes_and_closes(self):
+        clock = SimpleNamespace(now=0.0)
+        circuit = breaker.CircuitBreaker('api.example', 'api', clock=lambda: clock.now)
+        for _ in range(3):
+            circuit.before()
+            circuit.record(False, 0.1)
+
+        with self.assertRaises(breaker.CircuitOpen):
+            circuit.before()
+
+        clock.now = 31
+        circuit.before()
+        # Only one half-open probe at a time
+        with self.assertRaises(breaker.CircuitOpen):
+            circuit.before()
+        circuit.record(True, 0.1)
+        self.assertEqual(circuit.state, breaker.CLOSED)
+
+    async def test_cancelled_probe_gives_its_slot_back(self):
+        self.api.fail_next(3, status=503)
+        async with httpx.AsyncClient() as client:
+            for _ in range(3):
+                with self.assertRaises(DrChronoAPIError):
+                    await aapi_get(client, f"patients/{self.patient['id']}", 'token')
+            circuit = breaker.for_url(self.api.api_url, 'api')
+            circuit.opened_at -= settings.BREAKER_OPEN_SECONDS
+            self.api.latency = 0.5
+
+            probe = asyncio.ensure_future(aapi_get(client, f"patients/{self.patient['id']}", 'token'))
+            await asyncio.sleep(0.2)
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+
+            self.assertEqual((circuit.state, circuit.probes), (breaker.HALF_OPEN, 0))
+            self.api.latency = 0
+            self.assertEqual((await aapi_get(client, f"patients/{self.patient['id']}", 'token')).status_code, 200)
+            self.assertEqual(circuit.state, breaker.CLOSED)
+
+    @override_settings(BREAKER_SLOW_CALL=0.2, BREAKER_SLOW_RATE=1.0)
+    def test_slow_calls_open_breaker(self):
+        self.api.latency = 0.25
+        for _ in range(3):
+            api_get(f"patients/{self.patient['id']}", 'token')
+
+        with self.assertRaises(DrChronoUnavailable):
+            api_get(f"patients/{self.patient['id']}", 'token')
+
+    def test_open_api_breaker_fails_fast_and_shows_on_status(self):
+        self.api.fail_next(3, status=503)
+        for _ in range(3):
+            with self.assertRaises(DrChronoAPIError):
+                api_get(f"patients/{self.patient['id']}", 'token')
+        calls = len(self.api.calls)
+
+        with self.assertRaises(DrChronoUnavailable):
+            api_get(f"patients/{self.patient['id']}", 'token')
+        self.assertEqual(len(self.api.calls), calls)
+
+        # Note storage keeps its own state
+        appt = self.api.add_appointment(self.patient['id'], _days_ago(2))
+        self.assertIsNotNone(compile_cache.download_note(f"{self.api.url}{appt['clinical_note']['pdf']}"))
+
+        status = self.client.get(reverse('core_app:status'))
+        self.assertEqual(status.status_code, 503)
+        states = {b['kind']: b['state'] for b in status.json()['breakers']}
+        self.assertEqual(states, {'api': 'open', 'notes': 'closed'})
+
+
+class CoalescingTests(StandInTestCase):
+
+    def test_urls_normalize(self):
+        self.assertEqual(
+            coalesce.normalize_url('HTTP://Api.Example/appointments?verbose=true', {'patient': 7}),
+            coalesce.normalize_url('http://api.example/appointments', {'patient': '7', 'verbose': 'true'}),
+        )
+
+    def test_identical_gets_share_one_request(self):
+        self.api.latency = 0.3
+        path = f"patients/{self.patient['id']}"
+        before = coalesce.gets.stats()['coalesced']
+        results = []
+
+        def fetch(token):
+            results.append((token, response_json(api_get(path, token))))
+
+        threads = [threading.Thread(target=fetch, args=('token',)) for _ in range(5)]
+        threads.append(threading.Thread(target=fetch, args=('other-user',)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # One call per token, the other four callers joined the first
+        self.assertEqual(len(self.api.calls_to('/api/patients/')), 2)
+        self.assertEqual(coalesce.gets.stats()['coalesced'] - before, 4)
+        self.assertTrue(all(data['id'] == self.patient['id'] for _, data in results))
+
+
+    async def test_cancelled_leader_does_not_cancel_its_waiters(self):
+        flight = coalesce.SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(len(calls))
+            await asyncio.sleep(0.2)
+            return len(calls)
+
+        leader = asyncio.ensure_future(flight.ado('key', fetch))
+        await asyncio.sleep(0.05)
+        waiters = [asyncio.ensure_future(flight.ado('key', fetch)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        leader.cancel()
+
+        # The waiters share one new call
+        self.assertEqual(await asyncio.gather(*waiters), [2, 2])
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(flight.stats()['in_flight'], 0)
+
+
+class AsyncCompileTests(StandInTestCase):
+
+    @override_settings(DRCHRONO_FETCH_CONCURRENCY=8)
+    def test_compile_fetches_concurrently(self):
+        ids = [self.api.add_appointment(self.patient['id'], _days_ago(i + 1))['id'] for i in range(6)]
+        for appt_id in ids:
+            self.api.add_line_item(appt_id)
+        self.api.latency = 0.2
+
+        started = time.monotonic()
+        compiled = []
+        packet = compile_packet_sync(self.patient['id'], ids, 'token', compiled)
+        elapsed = time.monotonic() - started
+
+        # 6 details + 6 notes one after another would take 2.4s on their own
+        self.assertLess(elapsed, 2.0)
+        self.assertTrue(packet.pdf.startswith(b'%PDF'))
+        self.assertEqual(sorted(compiled), sorted(ids))
+        self.assertEqual(packet.warnings, [])
+
+    def test_process_pool_renders_same_packet(self):
+        ids = [self.api.add_appointment(self.patient['id'], _days_ago(i + 1))['id'] for i in range(3)]
+        for appt_id in ids:
+            self.api.add_line_item(appt_id)
+        threaded = compile_packet_sync(self.patient['id'], ids, 'token')
+
+        with override_settings(RENDER_PROCESSES=2):
+            self.addCleanup(process_render.shutdown)
+            self.assertTrue(process_render.start())
+            pooled = compile_packet_sync(self.patient['id'], ids, 'token')
+
+        # Balance report, then note + claim per appointment, in order
+        self.assertEqual(len(PdfReader(BytesIO(pooled.pdf)).pages), len(PdfReader(BytesIO(threaded.pdf)).pages))
+        self.assertEqual(len(PdfReader(BytesIO(pooled.pdf)).pages), 1 + 2 * len(ids))
+
+    def test_async_view_returns_packet(self):
+        self.login()
+        ids = [str(self.api.add_appointment(self.patient['id'], _days_ago(i + 1))['id']) for i in range(2)]
+        for appt_id in ids:
+            self.api.add_line_item(int(appt_id))
+
+        resp = self.client.post(
+            reverse('pdf_app:generate_selected', kwargs={'patient_id': self.patient['id']}),
+            {'selected_appts': ids, 'patient_name': 'Jane Doe'},
+        )
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'application/pdf')
+
+
+class CompactionTests(StandInTestCase):
+
+    def test_compaction_downsamples_scans(self):
+        note = scanned_note_pdf(pages=2, dpi=300)
+
+        compacted, result = compact_pdf(note, max_dpi=100, quality=70)
+
+        self.assertEqual(result.images, 2)
+        self.assertLess(len(compacted), len(note) / 2)
+        pages = PdfReader(BytesIO(compacted)).pages
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(pages[0].images[0].image.size, (850, 1100))
+
+    @override_settings(PACKET_COMPACT_DPI=100)
+    def test_compact_packet_reports_savings(self):
+        ids = [self.api.add_appointment(self.patient['id'], _days_ago(i + 1))['id'] for i in range(3)]
+        for appt_id in ids:
+            self.api.add_line_item(appt_id)
+            self.api.notes[appt_id] = scanned_note_pdf(dpi=200, seed=appt_id)
+
+        plain = compile_packet_sync(self.patient['id'], ids, 'token')
+        packet = compile_packet_sync(self.patient['id'], ids, 'token', compact=True)
+
+        self.assertIsNone(plain.compaction)
+        self.assertEqual(packet.compaction.original, len(plain.pdf))
+        self.assertEqual(packet.compaction.compacted, len(packet.pdf))
+        self.assertLess(len(packet.pdf), len(plain.pdf) / 2)
+        self.assertEqual(len(PdfReader(BytesIO(packet.pdf)).pages), plain.pages)
+
+
+class ZipExportTests(StandInTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.appts = [self.api.add_appointment(self.patient['id'], _days_ago(days)) for days in (2, 9)]
+        for appt in self.appts:
+            self.api.add_line_item(appt['id'])
+        self.api.notes[self.appts[1]['id']] = b'%PDF-1.4 as downloaded'
+        self.url = reverse('pdf_app:generate_selected', kwargs={'patient_id': self.patient['id']})
+        self.data = {'selected_appts': [str(appt['id']) for appt in self.appts], 'patient_name': 'Jane Doe', 'export': 'zip'}
+
+    def assertPacketArchive(self, body: bytes):
+        archive = zipfile.ZipFile(BytesIO(body))
+        names = archive.namelist()
+        # Oldest appointment first, like the merged packet
+        self.assertEqual(len(names), 5)
+        self.assertEqual(names[0], '00_Balance_Report.pdf')
+        self.assertTrue(names[1].startswith('01_') and names[1].endswith(f"{self.appts[1]['id']}_Clinical_Note.pdf"))
+        self.assertEqual(archive.read(names[1]), b'%PDF-1.4 as downloaded')
+        self.assertTrue(names[4].endswith(f"{self.appts[0]['id']}_HCFA.pdf"))
+
+    async def test_zip_export_streams_under_asgi(self):
+        user = await sync_to_async(self.login)()
+        await self.async_client.aforce_login(user)
+
+        resp = await self.async_client.post(self.url, self.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        self.assertEqual(resp['Content-Type'], 'application/zip')
+        self.assertPacketArchive(b''.join([chunk async for chunk in resp.streaming_content]))
+
+    @override_settings(COMPILE_HEAVY_SECONDS=0, COMPILE_HEAVY_CONCURRENCY=1)
+    async def test_streamed_zip_gives_its_heavy_slot_back(self):
+        user = await sync_to_async(self.login)()
+        await self.async_client.aforce_login(user)
+
+        resp = await self.async_client.post(self.url, self.data)
+        self.assertIsNone(await sync_to_async(admission.acquire)(60))
+        self.assertPacketArchive(b''.join([chunk async for chunk in resp.streaming_content]))
+
+        self.assertIsNotNone(await sync_to_async(admission.acquire)(60))
+
+    def test_zip_export_is_buffered_under_wsgi(self):
+        self.login()
+
+        resp = self.client.post(self.url, self.data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.streaming)
+        self.assertPacketArchive(resp.content)
+
+
+class BatchCompileTests(StandInTestCase):
+
+    def test_compiles_patients_by_chart_id_and_resumes(self):
+        self.login()
+        other = self.api.add_patient(first_name='John')
+        for patient in (self.patient, other):
+            for days in (5, 40):
+                self.api.add_line_item(self.api.add_appointment(patient['id'], _days_ago(days))['id'])
+        empty = self.api.add_patient()
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        since = (timezone.localdate() - timedelta(days=30)).isoformat()
+
+        out = StringIO()
+        call_command(
+            'compile_packets', self.patient['chart_id'], other['chart_id'], empty['chart_id'],
+            f'--since={since}', chart_ids=True, user='biller', output=output, concurrency=2, stdout=out,
+        )
+
+        with open(os.path.join(output, 'manifest.json')) as f:
+            manifest = json.load(f)
+        entries = manifest['patients']
+        self.assertEqual(entries[str(empty['id'])]['status'], 'empty')
+        for patient in (self.patient, other):
+            entry = entries[str(patient['id'])]
+            # One appointment in the window: balance report, note, claim
+            self.assertEqual((entry['status'], entry['appointments'], entry['pages']), ('ok', 1, 3))
+            self.assertTrue(os.path.exists(os.path.join(output, entry['file'])))
+        self.assertIn('2 compiled, 0 failed, 1 without appointments', out.getvalue())
+
+        calls = len(self.api.calls_to('/api/appointments/'))
+        out = StringIO()
+        call_command(
+            'compile_packets', str(self.patient['id']), str(other['id']), f'--since={since}',
+            user='biller', output=output, stdout=out,
+        )
+        self.assertIn('0 compiled, 0 failed, 0 without appointments, 2 already done', out.getvalue())
+        self.assertEqual(len(self.api.calls_to('/api/appointments/')), calls)
+
+
+class StandInRunnerTests(StandInTestCase):
+
+    def test_oauth_flow_against_stand_in(self):
+        callback = 'http://testserver' + reverse('verify_app:oauth_callback')
+        oauth = override_settings(
+            DRCHRONO_AUTH_URL=f'{self.api.url}/o/authorize/',
+            DRCHRONO_TOKEN_URL=f'{self.api.url}/o/token/',
+            DRCHRONO_CLIENT_ID='standin', DRCHRONO_CLIENT_SECRET='standin', DRCHRONO_REDIRECT_URI=callback,
+            DRCHRONO_SCOPES='patients:read clinical:read billing:read user:read',
+        )
+        with oauth, mock.patch.dict(os.environ, {'OAUTHLIB_INSECURE_TRANSPORT': '1'}):
+            authorize = self.client.get(reverse('verify_app:connect_drchrono'))
+            # The stand-in approves right away and sends the browser back with a code
+            approved = requests.get(authorize['Location'], allow_redirects=False, timeout=5)
+            self.assertEqual(approved.status_code, 302)
+            self.assertTrue(approved.headers['Location'].startswith(callback))
+            resp = self.client.get(approved.headers['Location'])
+
+        self.assertRedirects(resp, reverse('search_app:search'), fetch_redirect_response=False)
+        cred = DrChronoCredential.objects.get(user__username='standin_user')
+        self.assertEqual(cred.access_token, 'access-1')
+        self.assertEqual(self.api.auth_codes, set())
+
+    def test_benchmark_pipeline_saves_and_compares(self):
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        first = os.path.join(output, 'first.json')
+        call_command('benchmark_pipeline', '--sizes', '2', '--repeat', '1', '--latency', '0', '--output', first, stdout=StringIO())
+
+        with open(first) as f:
+            results = json.load(f)['results']
+        self.assertEqual(set(results), {'historical_list', 'balance_report', 'hcfa_bills', 'search', 'compile'})
+        self.assertGreater(results['compile']['2']['median_ms'], 0)
+
+        out = StringIO()
+        call_command(
+            'benchmark_pipeline', '--sizes', '2', '--repeat', '1', '--latency', '0', '--compare', first,
+            '--tolerance', '100', '--output', os.path.join(output, 'second.json'), stdout=out,
+        )
+        self.assertIn('No regressions', out.getvalue())
+
+
+class LoadTestReportTests(TestCase):
+
+    def test_percentiles_and_error_rates(self):
+        self.assertEqual(percentile(list(range(1, 101)), 50), 50)
+        self.assertEqual(percentile(list(range(1, 101)), 99), 99)
+        self.assertEqual(percentile([7.0], 95), 7.0)
+
+        out, err = StringIO(), StringIO()
+        samples = [('search', 0.1, None)] * 9 + [('search', 2.0, 'HTTP 502'), ('compile:5', 1.5, None)]
+        summary = LoadTestCommand(stdout=out, stderr=err).report(samples, wall=2.0)
+
+        self.assertEqual(summary['search']['error_rate'], 0.1)
+        self.assertEqual(summary['search']['p95_ms'], 2000.0)
+        self.assertEqual(summary['all']['requests'], 11)
+        self.assertIn('search: 10.0% failed (HTTP 502 x1)', err.getvalue())
+
+
+class TimingTests(StandInTestCase):
+
+    def test_compile_reports_stages_in_header_and_log(self):
+        self.login()
+        ids = [str(self.api.add_appointment(self.patient['id'], _days_ago(i + 1))['id']) for i in range(2)]
+        for appt_id in ids:
+            self.api.add_line_item(int(appt_id))
+
+        with self.assertLogs('core.timing', 'INFO') as logs:
+            resp = self.client.post(
+                reverse('pdf_app:generate_selected', kwargs={'patient_id': self.patient['id']}),
+                {'selected_appts': ids, 'patient_name': 'Doe'},
+            )
+
+        self.assertEqual(resp.status_code, 200)
+        metrics = {metric.split(';')[0] for metric in resp['Server-Timing'].split(', ')}
+        self.assertTrue({'appointment_fetch', 'note_download', 'hcfa_render', 'merge', 'drchrono', 'total'} <= metrics)
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line['view'], 'pdf_app:generate_selected')
+        # Patient names stay out of the log, only the route is written
+        self.assertNotIn('Doe', logs.output[-1])
+        self.assertEqual(line['stages']['hcfa_render']['count'], 2)
+        self.assertEqual(line['api_calls'], len(self.api.calls))
+        self.assertGreater(line['api_bytes'], 0)
+        self.assertEqual(line['response_bytes'], len(resp.content))
+
+    def test_spans_record_only_inside_a_trace(self):
+        with timing.span('idle'):
+            pass
+        with timing.collect() as trace:
+            with timing.span('stage'):
+                pass
+            timing.bind(lambda: timing.record_call(0.5, 10))()
+        self.assertEqual(trace.stages['stage'][1], 1)
+        self.assertEqual((trace.api_calls, trace.api_bytes), (1, 10))
+        self.assertNotIn('idle', trace.stages)
+
+
+class MetricsTests(StandInTestCase):
+
+    def sample(self, name: str, **labels) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_compile_is_counted_and_scraped(self):
+        self.login()
+        ids = [str(self.api.add_appointment(self.patient['id'], _days_ago(i + 1))['id']) for i in range(2)]
+        for appt_id in ids:
+            self.api.add_line_item(int(appt_id))
+        before = {
+            'pages': self.sample('hcfa_pages_rendered_total'),
+            'notes': self.sample('clinical_notes_downloaded_total'),
+            'details': self.sample('drchrono_request_seconds_count', endpoint='appointments/:id', status='200'),
+            'compiles': self.sample('packet_compile_seconds_count', appointments='2-5'),
+            'misses': self.sample('compile_cache_lookups_total', kind='note-pdf', result='miss'),
+        }
+
+        url = reverse('pdf_app:generate_selected', kwargs={'patient_id': self.patient['id']})
+        self.assertEqual(self.client.post(url, {'selected_appts': ids, 'patient_name': 'Doe'}).status_code, 200)
+
+        self.assertEqual(self.sample('hcfa_pages_rendered_total') - before['pages'], 2)
+        self.assertEqual(self.sample('clinical_notes_downloaded_total') - before['notes'], 2)
+        self.assertEqual(self.sample('drchrono_request_seconds_count', endpoint='appointments/:id', status='200') - before['details'], 2)
+        self.assertEqual(self.sample('packet_compile_seconds_count', appointments='2-5') - before['compiles'], 1)
+        self.assertEqual(self.sample('compile_cache_lookups_total', kind='note-pdf', result='miss') - before['misses'], 2)
+        self.assertEqual(self.sample('packet_compiles_in_flight'), 0)
+
+        # A second compile finds the notes cached
+        self.client.post(url, {'selected_appts': ids, 'patient_name': 'Doe'})
+        self.assertEqual(self.sample('compile_cache_lookups_total', kind='note-pdf', result='miss') - before['misses'], 2)
+        self.assertEqual(self.sample('clinical_notes_downloaded_total') - before['notes'], 2)
+
+    def test_endpoint_is_opt_in_and_token_protected(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(METRICS_ENABLED=True, METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            resp = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'# TYPE packet_compile_seconds histogram', resp.content)
+
+
+class ProfilingTests(StandInTestCase):
+
+    def compile(self, ids, **extra):
+        url = reverse('pdf_app:generate_selected', kwargs={'patient_id': self.patient['id']})
+        return self.client.post(url, {'selected_appts': ids, 'patient_name': 'Doe'}, **extra)
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.login()
+        self.ids = [str(self.api.add_appointment(self.patient['id'], _days_ago(i + 1))['id']) for i in range(2)]
+        for appt_id in self.ids:
+            self.api.add_line_item(int(appt_id))
+
+    def test_staff_compile_is_profiled_and_downloadable(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True, is_superuser=True)
+
+        resp = self.compile(self.ids, headers={'X-Profile': '1'})
+
+        self.assertEqual(resp.status_code, 200)
+        profile = RequestProfile.objects.get(pk=resp['X-Profile-Id'])
+        self.assertEqual(profile.view, 'pdf_app:generate_selected')
+        self.assertGreater(profile.peak_memory, 0)
+        # Claims render in the render thread pool, their profile is merged in
+        self.assertIn('generate_hcfa_bill', profile.report)
+        self.assertIn('peak_bytes', profile.stages['hcfa_render'])
+        stats = pstats.Stats(self.download(profile, 'prof'))
+        self.assertTrue(any(func[2] == 'generate_hcfa_bill' for func in stats.stats))
+
+        report = self.client.get(reverse('admin:core_requestprofile_download', args=[profile.pk, 'txt']))
+        self.assertIn(b'CPU: top', report.content)
+        self.assertEqual(self.client.get(reverse('admin:core_requestprofile_changelist')).status_code, 200)
+
+    def download(self, profile, kind) -> str:
+        resp = self.client.get(reverse('admin:core_requestprofile_download', args=[profile.pk, kind]))
+        self.assertEqual(resp.status_code, 200)
+        path = os.path.join(tempfile.mkdtemp(), f'profile.{kind}')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(resp.content)
+        return path
+
+    def test_list_view_profiled_with_query_parameter(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        url = reverse('appts_app:historical_list', kwargs={'patient_id': self.patient['id'], 'patient_name': 'Doe'})
+
+        resp = self.client.get(url, {'profile': '1'})
+
+        self.assertIn('X-Profile-Id', resp)
+        self.assertIn('appointment_sync', RequestProfile.objects.get().stages)
+        # The compile form keeps the switch on
+        self.assertContains(resp, '&profile=1')
+
+    def test_render_threads_are_profiled_with_the_request(self):
+        def claim_step():
+            return sum(i * i for i in range(10_000))
+
+        session = profiling.Session()
+        self.addCleanup(profiling._current.reset, profiling._current.set(session))
+        step = timing.bind(profiling.threaded(claim_step))
+        errors = []
+
+        def run():
+            try:
+                step()
+            except Exception as e:
+                errors.append(e)
+
+        session.profile.enable()
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        session.profile.disable()
+
+        # From Python 3.12 a second profiler in the thread would refuse to start
+        self.assertEqual(errors, [])
+        self.assertTrue(any(func[2] == 'claim_step' for func in session.stats().stats))
+
+    def test_non_staff_cannot_profile(self):
+        resp = self.compile(self.ids, headers={'X-Profile': '1'}, QUERY_STRING='profile=1')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('X-Profile-Id', resp)
+        self.assertFalse(RequestProfile.objects.exists())
+
+
+class CompileRunTests(StandInTestCase):
+
+    def test_compiles_are_recorded_and_trended(self):
+        user = self.login()
+        ids = [str(self.api.add_appointment(self.patient['id'], _days_ago(i + 1))['id']) for i in range(3)]
+        for appt_id in ids:
+            self.api.add_line_item(int(appt_id))
+        url = reverse('pdf_app:generate_selected', kwargs={'patient_id': self.patient['id']})
+
+        first = self.client.post(url, {'selected_appts': ids, 'patient_name': 'Doe'})
+        self.client.post(url, {'selected_appts': ids, 'patient_name': 'Doe'})
+        self.client.post(url, {'selected_appts': ids, 'patient_name': 'Doe', 'export': 'zip'})
+
+        second, run = CompileRun.objects.all()
+        self.assertEqual(run.outcome, CompileRun.OK)
+        self.assertEqual((run.patient_id, run.appointments, run.line_items), (self.patient['id'], 3, 3))
+        self.assertEqual(run.output_bytes, len(first.content))
+        self.assertEqual(run.pages, len(PdfReader(BytesIO(first.content)).pages))
+        self.assertEqual(run.stages['hcfa_render']['count'], 3)
+        self.assertGreater(run.api_calls, 0)
+        self.assertEqual(run.cache_hits, 0)
+        # The second compile finds details, notes and patient cached
+        self.assertEqual((second.cache_hits, second.cache_misses), (run.cache_misses, 0))
+
+        User.objects.filter(pk=user.pk).update(is_staff=True, is_superuser=True)
+        trends = self.client.get(reverse('admin:pdf_compilerun_trends'), {'days': '7', 'size': '2-5'})
+        self.assertEqual(trends.status_code, 200)
+        [row] = trends.context['rows']
+        self.assertEqual((row['runs'], row['failures']), (2, 0))
+        self.assertEqual(row['p95'], max(run.duration_ms, second.duration_ms))
+        self.assertEqual(trends.context['slowest'][0].duration_ms, row['p95'])
+        self.assertFalse(self.client.get(reverse('admin:pdf_compilerun_trends'), {'size': '1'}).context['rows'])
+        self.assertContains(self.client.get(reverse('admin:pdf_compilerun_changelist')), 'Trends')
+
+
+class AdmissionTests(StandInTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_estimate_follows_history_and_known_note_sizes(self):
+        for n in (2, 4, 6, 8, 10):
+            CompileRun.objects.create(
+                patient_id=1, appointments=n, pages=1 + 2 * n, output_bytes=n * 100_000, duration_ms=1000 + 500 * n,
+                outcome=CompileRun.OK,
+            )
+
+        estimate = admission.estimate(self.patient['id'], list(range(1, 11)))
+
+        self.assertEqual((estimate.pages, estimate.bytes, estimate.seconds), (21, 1_000_000, 6.0))
+        appt = self.api.add_appointment(self.patient['id'], _days_ago(3))
+        Appointment.objects.create(
+            id=appt['id'], patient=self.patient['id'], scheduled_time=timezone.now(), clinical_note_bytes=5_000_000,
+        )
+        self.assertEqual(admission.estimate(self.patient['id'], [appt['id']]).bytes, 5_000_000 + admission.DEFAULT_MODEL['claim_bytes'])
+
+    @override_settings(COMPILE_HEAVY_CONCURRENCY=1)
+    def test_heavy_slots_are_leased_once(self):
+        lease = admission.acquire(60)
+        self.assertIsNotNone(lease)
+        self.assertIsNone(admission.acquire(60))
+        lease.release()
+        expired = admission.acquire(-1)
+        # An expired lease (its worker died) frees the slot
+        self.assertIsNotNone(admission.acquire(60))
+        expired.release()
+
+    @override_settings(COMPILE_HEAVY_SECONDS=0, COMPILE_HEAVY_CONCURRENCY=1)
+    def test_heavy_compile_without_a_slot_is_turned_away(self):
+        self.login()
+        appt = self.api.add_appointment(self.patient['id'], _days_ago(3))
+        self.api.add_line_item(appt['id'])
+        lease = admission.acquire(60)
+
+        url = reverse('pdf_app:generate_selected', kwargs={'patient_id': self.patient['id']})
+        resp = self.client.post(url, {'selected_appts': [str(appt['id'])], 'patient_name': 'Doe'})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIn('Too many large packets', str(list(get_messages(resp.wsgi_request))[0]))
+        lease.release()
+        resp = self.client.post(url, {'selected_appts': [str(appt['id'])], 'patient_name': 'Doe'})
+        self.assertEqual(resp['Content-Type'], 'application/pdf')
+        # The compile gave its slot back
+        self.assertIsNotNone(admission.acquire(60))
+
+    def test_oversized_selection_compiles_in_parts_in_the_background(self):
+        self.login()
+        appts = [self.api.add_appointment(self.patient['id'], _days_ago(days)) for days in (2, 9, 20)]
+        for appt in appts:
+            self.api.add_line_item(appt['id'])
+        job_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, job_dir)
+        # The job runs in the request's thread, the test database is not shared with the job pool
+        inline = SimpleNamespace(submit=lambda fn, *args: fn(*args))
+
+        with override_settings(COMPILE_BACKGROUND_SECONDS=0, COMPILE_PART_APPOINTMENTS=2, COMPILE_JOB_DIR=job_dir), \
+                mock.patch.object(jobs, '_executor', return_value=inline):
+            resp = self.client.post(
+                reverse('pdf_app:generate_selected', kwargs={'patient_id': self.patient['id']}),
+                {'selected_appts': [str(appt['id']) for appt in appts], 'patient_name': 'Doe'},
+            )
+            page = self.client.get(resp['Location'])
+            download = self.client.get(resp['Location'], {'download': '1'})
+
+            self.assertContains(page, 'Download Patient_Jane_Doe_PARTS.zip')
+            self.assertEqual(download['Content-Type'], 'application/zip')
+            archive = zipfile.ZipFile(BytesIO(b''.join(download.streaming_content)))
+            first, second = sorted(archive.namelist())
+            self.assertTrue(first.endswith('PART_1_of_2.pdf') and second.endswith('PART_2_of_2.pdf'))
+            # The balance report opens the first part only
+            pages = [len(PdfReader(BytesIO(archive.read(name))).pages) for name in (first, second)]
+            self.assertEqual(pages[0], 1 + 2 * pages[1])
+            run = CompileRun.objects.get()
+            self.assertTrue(run.background)
+            self.assertEqual((run.appointments, run.pages, run.outcome), (3, sum(pages), CompileRun.OK))
+            self.assertFalse(CompileSlot.objects.exclude(holder=''))
+
+            other = User.objects.create(username='other')
+            DrChronoCredential.objects.create(
+                user=other, access_token='other', refresh_token='other', expires_at=timezone.now() + timedelta(hours=1),
+            )
+            self.client.force_login(other)
+            self.assertEqual(self.client.get(resp['Location']).status_code, 404)
+
+
+class ProviderProfileTests(StandInTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ids = []
+        for days in (5, 12):
+            appt = self.api.add_appointment(self.patient['id'], _days_ago(days))
+            self.api.add_line_item(appt['id'])
+            self.ids.append(appt['id'])
+
+    def text(self, packet) -> str:
+        return ''.join(page.extract_text() for page in PdfReader(BytesIO(packet.pdf)).pages)
+
+    def test_claims_take_the_profile_fetched_once(self):
+        packet = compile_packet_sync(self.patient['id'], self.ids, 'token')
+
+        text = self.text(packet)
+        self.assertIn('Provider: Emily Kurokawa', text)
+        self.assertIn('1326453796', text)
+        self.assertIn('4500 Satellite Blvd', text)
+        self.assertEqual(packet.warnings, [])
+        other = self.api.add_patient()
+        appt = self.api.add_appointment(other['id'], _days_ago(3))
+        self.api.add_line_item(appt['id'])
+        compile_packet_sync(other['id'], [appt['id']], 'token')
+        # Both appointments and the next packet share one profile
+        self.assertEqual(len(self.api.calls_to('/api/doctors/')), 1)
+        self.assertEqual(len(self.api.calls_to('/api/offices/')), 1)
+
+    def test_old_profile_is_used_and_refreshed_in_the_background(self):
+        compile_packet_sync(self.patient['id'], self.ids, 'token')
+        key = provider.profile_key(1, 1)
+        profiles = compile_cache.compile_cache()
+        profiles.set(key, {**profiles.get(key), 'fetched': 0}, settings.PROVIDER_PROFILE_TTL)
+        self.api.offices[1]['name'] = 'North Office'
+
+        packet = compile_packet_sync(self.patient['id'], self.ids, 'token')
+
+        self.assertIn('Primary Office', self.text(packet))
+        for _ in range(100):
+            if profiles.get(key)['office'] == 'North Office':
+                break
+            time.sleep(0.05)
+        self.assertIn('North Office', self.text(compile_packet_sync(self.patient['id'], self.ids, 'token')))
+
+    def test_missing_profile_leaves_the_provider_boxes_blank(self):
+        del self.api.doctors[1]
+
+        packet = compile_packet_sync(self.patient['id'], self.ids, 'token')
+
+        self.assertEqual(len(packet.warnings), 2)
+        self.assertIn('Could not fetch the provider profile', packet.warnings[0])
+        self.assertIn('the balance report names no provider', packet.warnings[0])
+        self.assertNotIn('balance report', packet.warnings[1])
+        self.assertNotIn('Primary Office', self.text(packet))
+        self.assertNotIn('Provider: Emily Kurokawa', self.text(packet))
+
+    @override_settings(PRACTICE_FEDERAL_ID='')
+    def test_unset_federal_id_is_warned_about(self):
+        packet = compile_packet_sync(self.patient['id'], self.ids, 'token')
+
+        self.assertEqual(packet.warnings, ['PRACTICE_FEDERAL_ID is not set, the claims leave the federal tax ID (box 25) blank.'])
+
+
+class BalanceSummaryTests(StandInTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+        self.first, self.second = [self.api.add_appointment(self.patient['id'], _days_ago(days)) for days in (5, 30)]
+        self.api.add_line_item(self.first['id'])
+        self.api.add_line_item(self.first['id'], balance_total='40.00')
+        self.api.add_line_item(self.second['id'])
+        # Neither is on the balance report: no note, not yet seen
+        self.api.add_line_item(self.api.add_appointment(self.patient['id'], _days_ago(10), note=False)['id'])
+        self.api.add_line_item(self.api.add_appointment(self.patient['id'], _days_ago(-5))['id'])
+        self.url = reverse('appts_app:historical_list', kwargs={'patient_id': self.patient['id'], 'patient_name': 'Jane Doe'})
+
+    def test_sync_materializes_subtotals_and_balance(self):
+        page = self.client.get(self.url)
+
+        self.assertEqual(Appointment.objects.get(id=self.first['id']).balance_total, Decimal('190.00'))
+        balance = PatientBalance.objects.get(patient=self.patient['id'])
+        self.assertEqual((balance.balance_total, balance.appointments), (Decimal('340.00'), 2))
+        self.assertContains(page, '$340.00')
+        self.assertContains(page, '$190.00')
+
+        packet = compile_packet_sync(self.patient['id'], [self.first['id']], 'token')
+        report = PdfReader(BytesIO(packet.pdf)).pages[0].extract_text()
+        self.assertIn('$340.00', report)
+
+    def test_changed_line_items_update_the_balance(self):
+        first = self.client.get(self.url)
+        item = self.api.add_line_item(self.second['id'], balance_total='25.00')
+        sync_patient(self.patient['id'], 'token', force=True)
+
+        # The appointments themselves did not change, the page still does
+        again = self.client.get(self.url, headers={'If-None-Match': first['ETag']})
+
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.context['balance'].balance_total, Decimal('365.00'))
+        self.assertEqual(Appointment.objects.get(id=self.second['id']).balance_total, Decimal('175.00'))
+
+        body = json.dumps({'object': {'id': item['id'], 'appointment': self.second['id']}}).encode()
+        self.client.post(
+            reverse('appts_app:webhook'), body, content_type='application/json',
+            headers={'X-drchrono-event': 'LINE_ITEM_DELETE', 'X-drchrono-signature': hmac.new(b's3cret', body, hashlib.sha256).hexdigest()},
+        )
+        self.assertEqual(PatientBalance.objects.get(patient=self.patient['id']).balance_total, Decimal('340.00'))
+
+    def test_search_results_show_mirrored_balances(self):
+        other = self.api.add_patient(first_name='John')
+        self.client.get(self.url)
+
+        self.client.post(reverse('search_app:search'), {'last_name': 'Doe'})
+        calls = len(self.api.calls)
+        results = self.client.get(reverse('search_app:results'))
+
+        balances = {patient['id']: patient['balance'] for patient in results.context['patients']}
+        self.assertEqual(balances, {self.patient['id']: Decimal('340.00'), other['id']: None})
+        self.assertContains(results, '$340.00')
+        self.assertEqual(len(self.api.calls), calls)
+
+
+class StartupTests(TestCase):
+
+    def test_views_load_without_pdf_libraries(self):
+        code = (
+            "import sys, django; django.setup()\n"
+            "from django.urls import get_resolver; get_resolver().url_patterns\n"
+            "print(sorted({name.split('.')[0] for name in sys.modules} & {'reportlab', 'pypdf', 'PIL', 'requests_oauthlib'}))"
+        )
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'drchrono_compiler.settings'}
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        self.assertEqual(result.stdout.strip(), '[]', result.stderr)
+
+    def test_gunicorn_outlasts_the_request_deadline(self):
+        config = settings.BASE_DIR / 'gunicorn.conf.py'
+        for deadline_seconds, timeout in (('55', 85), ('0', 330)):
+            with mock.patch.dict(os.environ, {'REQUEST_DEADLINE': deadline_seconds}):
+                self.assertEqual(runpy.run_path(str(config))['timeout'], timeout)
+
+    def test_warm_up_renders_without_counting(self):
+        pages = REGISTRY.get_sample_value('hcfa_pages_rendered_total')
+        startup.warm_up()
+        self.assertIsNotNone(pdf_services._hcfa_template)
+        self.assertEqual(REGISTRY.get_sample_value('hcfa_pages_rendered_total'), pages)
+        memory = process_memory(os.getpid())
+        self.assertGreater(memory['rss'], memory['uss'])
+
+
+class TokenRefreshTests(TransactionTestCase):
+
+    def setUp(self):
+        self.api = StandInDrChrono(latency=0.2).start()
+        self.addCleanup(self.api.stop)
+        self.api.refresh_tokens.add('refresh-0')
+        settings_override = override_settings(DRCHRONO_TOKEN_URL=f'{self.api.url}/o/token/')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create(username='biller')
+        DrChronoCredential.objects.create(
+            user=self.user, access_token='expired', refresh_token='refresh-0',
+            expires_at=timezone.now() - timedelta(minutes=1),
+        )
+
+    def test_parallel_requests_refresh_once(self):
+        tokens, errors = [], []
+
+        def request_token():
+            try:
+                request = SimpleNamespace(user=User.objects.get(pk=self.user.pk))
+                tokens.append(get_valid_access_token(request))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=request_token) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.api.token_refreshes, 1)
+        self.assertEqual(set(tokens), {'access-1'})
+
+    def test_token_memoized_on_request(self):
+        request = SimpleNamespace(user=User.objects.get(pk=self.user.pk))
+
+        first = get_valid_access_token(request)
+        DrChronoCredential.objects.update(access_token='changed')
+
+        self.assertEqual(get_valid_access_token(request), first)
+
+    def test_refresh_command_refreshes_ahead_and_records_metrics(self):
+        DrChronoCredential.objects.update(expires_at=timezone.now() + timedelta(minutes=5))
+        other = User.objects.create(username='revoked')
+        DrChronoCredential.objects.create(
+            user=other, access_token='old', refresh_token='revoked',
+            expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        fresh = User.objects.create(username='fresh')
+        DrChronoCredential.objects.create(
+            user=fresh, access_token='fresh', refresh_token='unused',
+            expires_at=timezone.now() + timedelta(hours=2),
+        )
+
+        # One worker: the SQLite test database does not take concurrent writers
+        call_command('refresh_tokens', window=900, concurrency=1, stdout=StringIO(), stderr=StringIO())
+
+        cred = DrChronoCredential.objects.get(user=self.user)
+        self.assertEqual(cred.access_token, 'access-1')
+        self.assertIsNotNone(cred.last_refresh_ms)
+        self.assertEqual(cred.refresh_failures, 0)
+        failed = DrChronoCredential.objects.get(user=other)
+        self.assertEqual(failed.refresh_failures, 1)
+        self.assertNotEqual(failed.last_refresh_error, '')
+        self.assertEqual(DrChronoCredential.objects.get(user=fresh).access_token, 'fresh')
+        self.assertEqual(self.api.token_refreshes, 2)
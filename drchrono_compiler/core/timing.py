@@ -0,0 +1,221 @@
+import contextvars
+import json
+import logging
+import math
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+
+# Per request stage timings. TimingMiddleware opens a Trace for every request, code wraps its stages in
+# span('name') (context manager or decorator, sync or async) and core.api counts every DrChrono call
+# with the bytes it returned. The response gets a Server-Timing header (browser dev tools show it) and
+# one JSON line per request goes to the core.timing logger.
+# A stage's time is summed over its runs, spans of concurrent tasks overlap so the sum can exceed the total.
+# Outside a request (commands, background warm-up) there is no trace and spans cost a ContextVar lookup.
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar['Trace | None'] = ContextVar('trace', default=None)
+
+# Server-Timing metric names are HTTP tokens
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+class Trace:
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.stages: dict[str, list] = {}
+        self.api_calls = 0
+        self.api_seconds = 0.0
+        self.api_bytes = 0
+        # Event counts, ex: compile cache lookups by result (pdf.cache)
+        self.counts: dict[str, int] = {}
+        # Peak traced bytes per stage, only while a profiled request (core.profiling) runs tracemalloc
+        self.memory: dict[str, int] | None = None
+        # Spans end in render threads and sync_to_async threads too
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stage = self.stages.setdefault(name, [0.0, 0])
+            stage[0] += seconds
+            stage[1] += 1
+
+    def add_memory(self, name: str, peak: int) -> None:
+        with self._lock:
+            self.memory[name] = max(self.memory.get(name, 0), peak)
+
+    def add_count(self, name: str, n: int) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def add_call(self, seconds: float, nbytes: int) -> None:
+        with self._lock:
+            self.api_calls += 1
+            self.api_seconds += seconds
+            self.api_bytes += nbytes
+
+    def elapsed(self) -> float:
+        return self.clock() - self.started
+
+    def server_timing(self) -> str:
+        metrics = [f'{_UNSAFE.sub("_", name)};dur={seconds * 1000:.1f}' for name, (seconds, _) in self.stages.items()]
+        if self.api_calls:
+            metrics.append(f'drchrono;dur={self.api_seconds * 1000:.1f};desc="{self.api_calls} calls"')
+        metrics.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def summary(self) -> dict:
+        return {
+            'ms': round(self.elapsed() * 1000, 1),
+            'stages': {name: {'ms': round(seconds * 1000, 1), 'count': count} for name, (seconds, count) in self.stages.items()},
+            'api_calls': self.api_calls,
+            'api_ms': round(self.api_seconds * 1000, 1),
+            'api_bytes': self.api_bytes,
+        }
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+@contextmanager
+def collect():
+    """
+    Record the spans and DrChrono calls of the block into a new Trace, ex: a command timing one compile.
+    """
+    token = _current.set(Trace())
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+class span:
+    """
+    Time a stage of the current request: `with span('note_download'):` or `@span('hcfa_render')` on a
+    sync or async function.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None and self.trace.memory is not None:
+            # Peak growth over the memory held at the start; stages overlapping it reset the peak too
+            tracemalloc.reset_peak()
+            self.memory_at_start = tracemalloc.get_traced_memory()[0]
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter() - self.started)
+            if self.trace.memory is not None and hasattr(self, 'memory_at_start'):
+                self.trace.add_memory(self.name, max(0, tracemalloc.get_traced_memory()[1] - self.memory_at_start))
+
+    def __call__(self, fn):
+        # A fresh span per call, one instance is not safe to enter twice at once
+        if iscoroutinefunction(fn):
+            @wraps(fn)
+            async def run_async(*args, **kwargs):
+                with span(self.name):
+                    return await fn(*args, **kwargs)
+            return run_async
+
+        @wraps(fn)
+        def run(*args, **kwargs):
+            with span(self.name):
+                return fn(*args, **kwargs)
+        return run
+
+
+def record_call(seconds: float, nbytes: int) -> None:
+    """
+    Count one DrChrono round trip (retries count again) on the current request.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.add_call(seconds, nbytes)
+
+
+def count(name: str, n: int = 1) -> None:
+    """
+    Add `n` to a named count of the current request.
+    """
+    trace = _current.get()
+    if trace is not None and n:
+        trace.add_count(name, n)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile of sorted `values`.
+    """
+    return values[max(0, min(len(values), math.ceil(q / 100 * len(values))) - 1)]
+
+
+def bind(fn):
+    """
+    Wrap `fn` so each call runs in a copy of the caller's context (trace, deadline), for work handed
+    to a thread pool (threads do not inherit context variables).
+    """
+    captured = contextvars.copy_context()
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time, every call gets its own copy
+        return captured.copy().run(fn, *args, **kwargs)
+    return run
+
+
+class TimingMiddleware:
+    """
+    Trace every request: Server-Timing header (SERVER_TIMING) and one JSON log line. Works under WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with collect() as trace:
+            response = self.get_response(request)
+        return self.finish(request, response, trace)
+
+    async def __acall__(self, request):
+        with collect() as trace:
+            response = await self.get_response(request)
+        return self.finish(request, response, trace)
+
+    def finish(self, request, response, trace: Trace):
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = trace.server_timing()
+        match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'method': request.method,
+            # The route, not the path: paths carry patient names
+            'route': match.route if match else None,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            **trace.summary(),
+            # Streamed bodies (ZIP export) are still being produced
+            'response_bytes': None if response.streaming else len(response.content),
+        }))
+        return response
@@ -1,3 +1,36 @@
-from django.shortcuts import render
+import hmac
 
-# Create your views here.
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound, JsonResponse
+from django.views.decorators.http import require_GET
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from . import breaker, coalesce, metrics
+
+
+@require_GET
+def status(request):
+    """
+    Circuit breaker state per upstream host and GET coalescing counters, for monitoring.
+    503 while any breaker is not closed.
+    """
+    breakers = breaker.snapshot()
+    healthy = all(b['state'] == breaker.CLOSED for b in breakers)
+    return JsonResponse(
+        {'healthy': healthy, 'breakers': breakers, 'coalescing': coalesce.gets.stats()},
+        status=200 if healthy else 503,
+    )
+
+
+@require_GET
+def prometheus_metrics(request):
+    """
+    Prometheus scrape endpoint, 404 unless METRICS_ENABLED. With METRICS_TOKEN set the scraper sends it as a bearer token.
+    """
+    if not settings.METRICS_ENABLED:
+        return HttpResponseNotFound()
+    if settings.METRICS_TOKEN:
+        given = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(given, settings.METRICS_TOKEN):
+            return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE_LATEST)
@@ -14,6 +14,7 @@ from pathlib import Path
 import dj_database_url
 
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -52,7 +53,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.timing.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.deadline.DeadlineMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -145,7 +148,142 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 DRCHRONO_CLIENT_ID = os.getenv('DRCHRONO_CLIENT_ID')
 DRCHRONO_CLIENT_SECRET = os.getenv('DRCHRONO_CLIENT_SECRET')
 DRCHRONO_REDIRECT_URI = os.getenv('DRCHRONO_REDIRECT_URI')
-DRCHRONO_AUTH_URL = 'https://app.drchrono.com/o/authorize/'
-DRCHRONO_TOKEN_URL = 'https://app.drchrono.com/o/token/'
-DRCHRONO_REVOKE_URL = "https://app.drchrono.com/o/revoke_token/"
-DRCHRONO_SCOPES = os.getenv('DRCHRONO_SCOPES')
\ No newline at end of file
+# DrChrono host for OAuth and API calls, ex: http://127.0.0.1:8800 for the local stand-in (manage.py run_standin)
+DRCHRONO_BASE_URL = os.getenv('DRCHRONO_BASE_URL', 'https://app.drchrono.com').rstrip('/')
+DRCHRONO_AUTH_URL = f'{DRCHRONO_BASE_URL}/o/authorize/'
+DRCHRONO_TOKEN_URL = f'{DRCHRONO_BASE_URL}/o/token/'
+DRCHRONO_REVOKE_URL = f"{DRCHRONO_BASE_URL}/o/revoke_token/"
+DRCHRONO_SCOPES = os.getenv('DRCHRONO_SCOPES')
+DRCHRONO_API_URL = os.getenv('DRCHRONO_API_URL', f'{DRCHRONO_BASE_URL}/api')
+DRCHRONO_WEBHOOK_SECRET = os.getenv('DRCHRONO_WEBHOOK_SECRET', '')
+
+# Local appointment mirror (appts app)
+APPOINTMENT_LOOKBACK_DAYS = int(os.getenv('APPOINTMENT_LOOKBACK_DAYS', 365 * 3))
+APPOINTMENT_SYNC_INTERVAL = int(os.getenv('APPOINTMENT_SYNC_INTERVAL', 300))
+APPOINTMENT_PAGE_SIZE = int(os.getenv('APPOINTMENT_PAGE_SIZE', 25))
+
+# Max parallel DrChrono requests when fetching details for the selected appointments
+DRCHRONO_FETCH_CONCURRENCY = int(os.getenv('DRCHRONO_FETCH_CONCURRENCY', 8))
+
+# Compile caches (pdf app): verbose appointments, patients and note PDFs.
+# File based so warm-ups started by one worker are seen by the worker that handles the compile.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'compile': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('COMPILE_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'drchrono_compile_cache')),
+        'TIMEOUT': int(os.getenv('COMPILE_CACHE_TIMEOUT', 900)),
+    },
+}
+COMPILE_CACHE = 'compile'
+
+# Background warm-up of the compile caches when the appointment list is viewed
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', '1') == '1'
+PREFETCH_CONCURRENCY = int(os.getenv('PREFETCH_CONCURRENCY', 4))
+PREFETCH_MAX_APPOINTMENTS = int(os.getenv('PREFETCH_MAX_APPOINTMENTS', 60))
+# How long a compile waits on a warm-up fetch already in flight before fetching itself
+PREFETCH_JOIN_TIMEOUT = float(os.getenv('PREFETCH_JOIN_TIMEOUT', 20))
+
+# Proactive token refresh (manage.py refresh_tokens): tokens expiring within the window are refreshed
+# ahead of time so requests never wait on the OAuth server. Credentials failing this many times in a
+# row are left alone until the user reconnects.
+TOKEN_REFRESH_WINDOW = int(os.getenv('TOKEN_REFRESH_WINDOW', 900))
+TOKEN_REFRESH_INTERVAL = int(os.getenv('TOKEN_REFRESH_INTERVAL', 60))
+TOKEN_REFRESH_CONCURRENCY = int(os.getenv('TOKEN_REFRESH_CONCURRENCY', 4))
+TOKEN_REFRESH_MAX_FAILURES = int(os.getenv('TOKEN_REFRESH_MAX_FAILURES', 3))
+
+# DrChrono API pacing (core.ratelimit): requests per second and burst, for the whole process and per user token.
+# 429 / 5xx answers are retried up to DRCHRONO_MAX_RETRIES times, waiting Retry-After or a jittered
+# exponential backoff (base * 2^attempt seconds, at most DRCHRONO_BACKOFF_MAX).
+DRCHRONO_RATE_LIMIT = float(os.getenv('DRCHRONO_RATE_LIMIT', 20))
+DRCHRONO_RATE_BURST = float(os.getenv('DRCHRONO_RATE_BURST', 40))
+DRCHRONO_USER_RATE_LIMIT = float(os.getenv('DRCHRONO_USER_RATE_LIMIT', 8))
+DRCHRONO_USER_RATE_BURST = float(os.getenv('DRCHRONO_USER_RATE_BURST', 16))
+DRCHRONO_MAX_RETRIES = int(os.getenv('DRCHRONO_MAX_RETRIES', 4))
+DRCHRONO_BACKOFF_BASE = float(os.getenv('DRCHRONO_BACKOFF_BASE', 0.5))
+DRCHRONO_BACKOFF_MAX = float(os.getenv('DRCHRONO_BACKOFF_MAX', 30))
+
+# Total seconds a request may spend (DrChrono calls, note downloads, rendering) before it gives up
+# with a partial result report, 0 disables. gunicorn.conf.py sets the worker timeout 30 seconds above it.
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', 55))
+
+# Circuit breakers per host (core.breaker): open when, over the last BREAKER_WINDOW calls (at least
+# BREAKER_MIN_CALLS), the share of failed or slow (>= BREAKER_SLOW_CALL seconds) calls reaches its rate.
+# Open breakers fail fast for BREAKER_OPEN_SECONDS, then let BREAKER_HALF_OPEN_PROBES calls test the host.
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', 20))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', 10))
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', 0.5))
+BREAKER_SLOW_CALL = float(os.getenv('BREAKER_SLOW_CALL', 8))
+BREAKER_SLOW_RATE = float(os.getenv('BREAKER_SLOW_RATE', 0.8))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', 30))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv('BREAKER_HALF_OPEN_PROBES', 1))
+
+# Identical concurrent DrChrono GETs made with the same token share one request (core.coalesce)
+DRCHRONO_COALESCE_GETS = os.getenv('DRCHRONO_COALESCE_GETS', '1') == '1'
+
+# Threads for CPU bound PDF work (ReportLab / pypdf) in the async compile pipeline (pdf.compile)
+RENDER_CONCURRENCY = int(os.getenv('RENDER_CONCURRENCY', 2))
+
+# Worker processes per server worker for HCFA claims and the balance report (pdf.render), 0 renders in
+# RENDER_CONCURRENCY threads instead. Processes use every core for big packets at the cost of memory.
+RENDER_PROCESSES = int(os.getenv('RENDER_PROCESSES', 0))
+
+# Patients compiled at once by manage.py compile_packets (all share the DrChrono rate limiter and caches)
+BATCH_COMPILE_CONCURRENCY = int(os.getenv('BATCH_COMPILE_CONCURRENCY', 4))
+
+# Opt-in packet compaction (pdf.compact, "Compact" on the compile form / compile_packets --compact):
+# images above this DPI are downsampled and re-encoded as JPEG at this quality
+PACKET_COMPACT_DPI = int(os.getenv('PACKET_COMPACT_DPI', 150))
+PACKET_COMPACT_QUALITY = int(os.getenv('PACKET_COMPACT_QUALITY', 75))
+
+# Additional hosts to serve, space separated, ex: 127.0.0.1 for a local server under manage.py loadtest
+ALLOWED_HOSTS += os.getenv('EXTRA_ALLOWED_HOSTS', '').split()
+
+# Per request stage timings (core.timing): Server-Timing response header, and one JSON line per request
+# (stages, DrChrono calls and bytes) from the core.timing logger on stderr, at REQUEST_LOG_LEVEL
+SERVER_TIMING = os.getenv('SERVER_TIMING', '1') == '1'
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.timing': {'handlers': ['console'], 'level': os.getenv('REQUEST_LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
+# Prometheus metrics at /metrics (core.metrics), off by default. With several worker processes set
+# PROMETHEUS_MULTIPROC_DIR to an empty, writable directory before the server starts (gunicorn.conf.py
+# clears it). When METRICS_TOKEN is set, scrapers must send it as a bearer token.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Staff can profile one request of the compile or list view with ?profile=1 (core.profiling),
+# the profile is stored for download in the admin. 0 ignores the switch.
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', '1') == '1'
+
+# Admission of compiles (pdf.admission): the compile view estimates a selection's seconds and bytes
+# first. Heavy selections (above either COMPILE_HEAVY_ threshold) take one of COMPILE_HEAVY_CONCURRENCY
+# slots shared by all workers through the database and are turned away when none is free. Selections
+# above a COMPILE_BACKGROUND_ threshold compile in the background (pdf.jobs) as a ZIP of PDF parts of at
+# most COMPILE_PART_APPOINTMENTS appointments, kept in COMPILE_JOB_DIR for COMPILE_JOB_TTL seconds.
+COMPILE_HEAVY_SECONDS = float(os.getenv('COMPILE_HEAVY_SECONDS', 15))
+COMPILE_HEAVY_BYTES = int(os.getenv('COMPILE_HEAVY_BYTES', 50_000_000))
+COMPILE_HEAVY_CONCURRENCY = int(os.getenv('COMPILE_HEAVY_CONCURRENCY', 2))
+COMPILE_BACKGROUND_SECONDS = float(os.getenv('COMPILE_BACKGROUND_SECONDS', 40))
+COMPILE_BACKGROUND_BYTES = int(os.getenv('COMPILE_BACKGROUND_BYTES', 150_000_000))
+COMPILE_PART_APPOINTMENTS = int(os.getenv('COMPILE_PART_APPOINTMENTS', 30))
+# Seconds a background compile may take, 0 for no limit
+COMPILE_BACKGROUND_DEADLINE = float(os.getenv('COMPILE_BACKGROUND_DEADLINE', 900))
+COMPILE_JOB_DIR = os.getenv('COMPILE_JOB_DIR', os.path.join(tempfile.gettempdir(), 'drchrono_compile_jobs'))
+COMPILE_JOB_TTL = int(os.getenv('COMPILE_JOB_TTL', 3600))
+
+# Provider profiles of the claims (pdf.provider): DrChrono doctor and office data is cached this long and
+# refetched in the background once older than the refresh age. The federal tax id (HCFA box 25) is not in
+# the API.
+PROVIDER_PROFILE_TTL = int(os.getenv('PROVIDER_PROFILE_TTL', 7 * 24 * 3600))
+PROVIDER_PROFILE_REFRESH = int(os.getenv('PROVIDER_PROFILE_REFRESH', 6 * 3600))
+PRACTICE_FEDERAL_ID = os.getenv('PRACTICE_FEDERAL_ID', '')
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from core.views import prometheus_metrics
+
 app_name = "main_app"
 
 urlpatterns = [
@@ -9,4 +11,6 @@ urlpatterns = [
     path('search/', include('search.urls')),
     path('appts/', include('appts.urls')),
     path('pdf/', include('pdf.urls')),
+    path('core/', include('core.urls')),
+    path('metrics', prometheus_metrics, name='metrics'),
 ]
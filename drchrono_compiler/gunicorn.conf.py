@@ -0,0 +1,45 @@
+# gunicorn reads this file from the working directory: gunicorn drchrono_compiler.wsgi
+import os
+import shutil
+
+# Sync workers are killed after `timeout` seconds on one request (gunicorn's default is 30). Give the
+# request deadline (REQUEST_DEADLINE, core.deadline) time to fire and its error page time to render first;
+# like a heavy compile slot lease (pdf.admission), a disabled deadline counts as 300 seconds.
+timeout = int(float(os.environ.get('REQUEST_DEADLINE', 55)) or 300) + 30
+
+
+def on_starting(server):
+    # Prometheus multiprocess mode (core.metrics): values left by an earlier run would be summed in
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def when_ready(server):
+    # Load the project and the PDF assets in the master, workers fork with them (core.startup).
+    # Preloaded code is not re-read on HUP: restart gunicorn to deploy. WORKER_PRELOAD=0 turns it off.
+    if os.environ.get('WORKER_PRELOAD', '1') == '1':
+        from core import startup
+        startup.preload()
+        server.log.info("Preloaded the project and PDF assets")
+
+
+def post_worker_init(worker):
+    # One render process pool per worker, started and warmed before the worker takes requests
+    from pdf import render
+    pids = render.start()
+    if pids:
+        worker.log.info("Render pool ready: %s", ', '.join(map(str, pids)))
+
+
+def worker_exit(server, worker):
+    from pdf import render
+    render.shutdown()
+
+
+def child_exit(server, worker):
+    # Drop the live gauges (compiles in flight) of a dead worker
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,96 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+
+from core.metrics import PACKET_SIZES, packet_size
+from core.timing import percentile
+from .models import CompileRun
+
+TREND_DAYS = (7, 30, 90)
+SLOWEST_RUNS = 25
+
+
+@admin.register(CompileRun)
+class CompileRunAdmin(admin.ModelAdmin):
+    list_display = (
+        'created_at', 'patient_id', 'appointments', 'line_items', 'pages', 'output_mb', 'duration_ms', 'estimated_ms',
+        'api_calls', 'cache_hits', 'cache_misses', 'outcome',
+    )
+    list_filter = ('outcome', 'compact', 'background', 'created_at')
+    search_fields = ('patient_id',)
+    change_list_template = 'admin/pdf/compilerun/change_list.html'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='MB', ordering='output_bytes')
+    def output_mb(self, obj):
+        return f"{obj.output_bytes / 1e6:.1f}" if obj.output_bytes is not None else '-'
+
+    def get_urls(self):
+        return [
+            path('trends/', self.admin_site.admin_view(self.trends), name='pdf_compilerun_trends'),
+        ] + super().get_urls()
+
+    def trends(self, request):
+        """
+        p50 / p95 compile time per day over the last ?days= (7, 30, 90), optionally for one packet size
+        (?size=, the bucket labels of core.metrics), and the slowest runs of the period.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        days = int(request.GET['days']) if request.GET.get('days') in map(str, TREND_DAYS) else TREND_DAYS[1]
+        sizes = [label for _, label in PACKET_SIZES] + [packet_size(PACKET_SIZES[-1][0] + 1)]
+        size = request.GET.get('size') if request.GET.get('size') in sizes else None
+
+        runs = CompileRun.objects.filter(created_at__gte=timezone.now() - timedelta(days=days))
+        by_day = defaultdict(list)
+        failures = defaultdict(int)
+        period = []
+        for run in runs.only('id', 'created_at', 'appointments', 'duration_ms', 'outcome', 'patient_id').order_by():
+            if size and packet_size(run.appointments) != size:
+                continue
+            period.append(run)
+            day = timezone.localdate(run.created_at)
+            if run.outcome in (CompileRun.DEADLINE, CompileRun.DRCHRONO_ERROR, CompileRun.FAILED):
+                failures[day] += 1
+            else:
+                # Failed runs stop early, their time would pull the percentiles down
+                by_day[day].append(run.duration_ms)
+
+        rows = []
+        for day in sorted(set(by_day) | set(failures)):
+            durations = sorted(by_day[day])
+            rows.append({
+                'day': day,
+                'runs': len(durations) + failures[day],
+                'failures': failures[day],
+                'p50': percentile(durations, 50) if durations else None,
+                'p95': percentile(durations, 95) if durations else None,
+            })
+        # Bar widths in percent of the slowest day's p95
+        top = max((row['p95'] or 0 for row in rows), default=0)
+        for row in rows:
+            row['p50_width'] = round(100 * (row['p50'] or 0) / top) if top else 0
+            row['p95_width'] = round(100 * (row['p95'] or 0) / top) if top else 0
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Compile trends',
+            'opts': self.model._meta,
+            'days': days,
+            'day_choices': TREND_DAYS,
+            'size': size,
+            'sizes': sizes,
+            'rows': rows,
+            'slowest': sorted(period, key=lambda run: -run.duration_ms)[:SLOWEST_RUNS],
+        }
+        return TemplateResponse(request, 'admin/pdf/compilerun/trends.html', context)
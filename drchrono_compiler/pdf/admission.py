@@ -0,0 +1,144 @@
+import statistics
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from appts.models import Appointment
+from .models import CompileRun, CompileSlot
+
+# Pre-flight admission of compiles. estimate() predicts a selection's pages, bytes and seconds from the
+# recent CompileRun history and the note sizes seen on download (a few queries, no DrChrono call), so
+# the compile view can send oversized selections to the background (pdf.jobs) and cap heavy compiles
+# across all workers with the CompileSlot leases below. Thresholds are in settings (COMPILE_HEAVY_*,
+# COMPILE_BACKGROUND_*).
+
+# Per appointment costs until there is history: a claim carries the whole HCFA form (~340 KB)
+DEFAULT_MODEL = {
+    'base_seconds': 2.0,
+    'seconds_per_appointment': 0.6,
+    'pages_per_appointment': 3.0,
+    'bytes_per_appointment': 500_000,
+    'claim_bytes': 340_000,
+}
+# Finished runs the model is fitted on, and the least it needs
+HISTORY_RUNS = 200
+MIN_RUNS = 5
+MODEL_CACHE_KEY = 'compile-estimate-model'
+MODEL_TTL = 300
+
+
+@dataclass
+class Estimate:
+    appointments: int
+    pages: int
+    bytes: int
+    seconds: float
+
+    @property
+    def background(self) -> bool:
+        return self.seconds >= settings.COMPILE_BACKGROUND_SECONDS or self.bytes >= settings.COMPILE_BACKGROUND_BYTES
+
+    @property
+    def heavy(self) -> bool:
+        return (
+            self.background or self.seconds >= settings.COMPILE_HEAVY_SECONDS
+            or self.bytes >= settings.COMPILE_HEAVY_BYTES
+        )
+
+    def __str__(self) -> str:
+        return f"about {self.pages} pages, {self.bytes / 1e6:.0f} MB and {self.seconds:.0f}s"
+
+
+def model() -> dict:
+    """
+    Costs fitted on the latest finished, uncompacted compiles of the compile view: seconds as a line over the
+    number of appointments, pages and bytes per appointment as medians. Cached for MODEL_TTL per process.
+    """
+    fitted = cache.get(MODEL_CACHE_KEY)
+    if fitted is not None:
+        return fitted
+    runs = list(
+        CompileRun.objects.filter(
+            outcome__in=(CompileRun.OK, CompileRun.WARNINGS), background=False, compact=False, pages__isnull=False,
+        ).values_list('appointments', 'duration_ms', 'pages', 'output_bytes')[:HISTORY_RUNS]
+    )
+    fitted = dict(DEFAULT_MODEL)
+    if len(runs) >= MIN_RUNS:
+        sizes = [appointments for appointments, *_ in runs]
+        seconds = [duration_ms / 1000 for _, duration_ms, *_ in runs]
+        if len(set(sizes)) > 1:
+            slope, intercept = statistics.linear_regression(sizes, seconds)
+        else:
+            slope, intercept = statistics.median(s / n for s, n in zip(seconds, sizes)), 0.0
+        if slope > 0:
+            fitted['base_seconds'] = max(intercept, 0.0)
+            fitted['seconds_per_appointment'] = slope
+        # The balance report is about a page
+        fitted['pages_per_appointment'] = statistics.median(max(pages - 1, 0) / n for n, _, pages, _ in runs)
+        fitted['bytes_per_appointment'] = statistics.median(size / n for n, _, _, size in runs)
+    cache.set(MODEL_CACHE_KEY, fitted, MODEL_TTL)
+    return fitted
+
+
+def estimate(patient_id: int, appointment_ids) -> Estimate:
+    """
+    Predicted size and duration of compiling `appointment_ids`. Notes downloaded before count with their
+    real size plus a claim, the others with the history's bytes per appointment.
+    """
+    costs = model()
+    count = len(appointment_ids)
+    note_sizes = [
+        size for size in Appointment.objects.filter(id__in=appointment_ids, patient=patient_id)
+        .values_list('clinical_note_bytes', flat=True) if size is not None
+    ]
+    nbytes = sum(note_sizes) + len(note_sizes) * costs['claim_bytes'] + (count - len(note_sizes)) * costs['bytes_per_appointment']
+    return Estimate(
+        appointments=count,
+        pages=1 + round(count * costs['pages_per_appointment']),
+        bytes=round(nbytes),
+        seconds=round(costs['base_seconds'] + count * costs['seconds_per_appointment'], 1),
+    )
+
+
+# ── Heavy compile slots ─────────────────────────────────────────────────────────
+class Lease:
+    """
+    A held CompileSlot. Expires on its own after `seconds` unless renewed.
+    """
+
+    def __init__(self, slot: int, holder: str, seconds: float):
+        self.slot, self.holder, self.seconds = slot, holder, seconds
+
+    def renew(self) -> None:
+        CompileSlot.objects.filter(slot=self.slot, holder=self.holder).update(
+            expires_at=timezone.now() + timedelta(seconds=self.seconds),
+        )
+
+    def release(self) -> None:
+        CompileSlot.objects.filter(slot=self.slot, holder=self.holder).update(holder='', expires_at=None)
+
+
+def request_lease_seconds() -> float:
+    # A compile in the request ends with the request deadline
+    return (settings.REQUEST_DEADLINE or 300) + 30
+
+
+def acquire(seconds: float) -> Lease | None:
+    """
+    Take a free heavy compile slot for `seconds`, None when all COMPILE_HEAVY_CONCURRENCY are held.
+    Each claim is one conditional UPDATE, so two workers never get the same slot.
+    """
+    slots = settings.COMPILE_HEAVY_CONCURRENCY
+    CompileSlot.objects.bulk_create([CompileSlot(slot=slot) for slot in range(slots)], ignore_conflicts=True)
+    now = timezone.now()
+    free = Q(expires_at__isnull=True) | Q(expires_at__lte=now)
+    holder = uuid.uuid4().hex
+    for slot in CompileSlot.objects.filter(free, slot__lt=slots).values_list('slot', flat=True):
+        if CompileSlot.objects.filter(free, slot=slot).update(holder=holder, expires_at=now + timedelta(seconds=seconds)):
+            return Lease(slot, holder, seconds)
+    return None
@@ -0,0 +1,274 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError, Future
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import DatabaseError
+
+from appts.models import Appointment
+from appts.services import afetch_appointment_details, fetch_appointment_details
+from core import deadline, metrics, timing
+from core.api import aapi_get, api_get, asend, response_json, send
+from core.ratelimit import user_key
+
+# Compile caches: verbose appointment JSON, patient JSON and clinical note PDF bytes.
+# Keys carry the DrChrono updated_at of the record so edits never serve an old copy, and the user
+# (core.ratelimit.user_key of the token): DrChrono decides what each user may read, a hit must not skip that.
+# Fetches started by the list page warm-up are tracked in flight, a compile asking for the
+# same key waits on that fetch instead of starting its own.
+# The a-prefixed functions are the async counterparts used by the async compile pipeline.
+
+_in_flight: dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def compile_cache():
+    return caches[settings.COMPILE_CACHE]
+
+
+def details_key(appt_id, updated_at, token: str) -> str:
+    stamp = updated_at.isoformat() if hasattr(updated_at, 'isoformat') else updated_at
+    return f"appt-details:{user_key(token)}:{appt_id}:{stamp}"
+
+
+def note_key(appt_id, note_updated_at, token: str) -> str:
+    return f"note-pdf:{user_key(token)}:{appt_id}:{note_updated_at}"
+
+
+def patient_key(patient_id, token: str) -> str:
+    return f"patient:{user_key(token)}:{patient_id}"
+
+
+def track(key: str, future: Future) -> Future:
+    """
+    Register an in-flight fetch for `key`. Returns the already running future when there is one.
+    """
+    with _in_flight_lock:
+        running = _in_flight.get(key)
+        if running is not None and not running.done():
+            return running
+        _in_flight[key] = future
+
+    def _forget(done):
+        with _in_flight_lock:
+            if _in_flight.get(key) is done:
+                del _in_flight[key]
+
+    future.add_done_callback(_forget)
+    return future
+
+
+def in_flight(key: str) -> Future | None:
+    with _in_flight_lock:
+        return _in_flight.get(key)
+
+
+def _join(key: str):
+    """
+    Wait on an in-flight fetch of `key` (no longer than the request deadline allows),
+    return its value or None if there is none / it failed.
+    """
+    future = in_flight(key)
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=deadline.timeout(settings.PREFETCH_JOIN_TIMEOUT))
+    except (CancelledError, Exception):
+        return None
+
+
+def get_or_fetch(key: str, fetch, timeout=DEFAULT_TIMEOUT):
+    """
+    Return the cached value for `key`, else the result of an in-flight fetch, else call `fetch()` and cache a non None
+    result (for `timeout` seconds, default the cache's).
+    """
+    cache = compile_cache()
+    value = cache.get(key)
+    result = 'hit'
+    if value is None:
+        value, result = _join(key), 'joined'
+    if value is None:
+        value, result = fetch(), 'miss'
+        if value is not None:
+            cache.set(key, value, timeout)
+    _count_lookup(key, result)
+    return value
+
+
+def _count_lookup(key: str, result: str, lookups: int = 1) -> None:
+    # The key prefix is the kind: appt-details, note-pdf, patient, provider
+    if lookups:
+        metrics.cache_lookups.labels(key.split(':', 1)[0], result).inc(lookups)
+        timing.count(f'cache_{result}', lookups)
+
+
+def _count_details(hits: int, joined: int, misses: int) -> None:
+    for result, lookups in (('hit', hits), ('joined', joined), ('miss', misses)):
+        _count_lookup('appt-details', result, lookups)
+
+
+def _count_note(data: bytes | None) -> bytes | None:
+    if data is not None:
+        metrics.notes_downloaded.inc()
+        metrics.note_bytes.inc(len(data))
+    return data
+
+
+def _note_size(appt_id, data: bytes | None) -> bytes | None:
+    # Sizes of downloaded notes feed the compile estimate (pdf.admission), a failed write only costs accuracy
+    if appt_id is not None and data is not None:
+        try:
+            Appointment.objects.filter(id=appt_id).update(clinical_note_bytes=len(data))
+        except DatabaseError:
+            pass
+    return data
+
+
+def download_note(pdf_url: str, appt_id: int | None = None) -> bytes | None:
+    # Note storage is not the API, no bearer token / user budget; 5xx is still retried
+    note_resp = send('GET', pdf_url, timeout=15)
+    if note_resp.status_code == 200:
+        return _note_size(appt_id, _count_note(note_resp.content))
+    return None
+
+
+@timing.span('note_download')
+def note_pdf(appt: dict, token: str) -> bytes | None:
+    """
+    Clinical note PDF bytes of a verbose appointment dict, from the cache when possible. None when missing / failed.
+    """
+    clinical_note = appt.get('clinical_note') or {}
+    pdf_url = clinical_note.get('pdf')
+    if not pdf_url:
+        return None
+    return get_or_fetch(note_key(appt['id'], clinical_note.get('updated_at'), token), lambda: download_note(pdf_url, appt['id']))
+
+
+def fetch_patient(patient_id: int, token: str) -> dict | None:
+    resp = api_get(f"patients/{patient_id}", token, timeout=10)
+    return response_json(resp) if resp.status_code == 200 else None
+
+
+@timing.span('patient_fetch')
+def patient_json(patient_id: int, token: str) -> dict | None:
+    return get_or_fetch(patient_key(patient_id, token), lambda: fetch_patient(patient_id, token))
+
+
+@timing.span('appointment_fetch')
+def appointment_details(appointment_ids, token: str) -> tuple[dict, dict]:
+    """
+    Cache aware fetch_appointment_details: cached / warming appointments are reused, the rest fetched concurrently.
+    Returns (details, failures) in input order.
+    """
+    appointment_ids = [int(appt_id) for appt_id in appointment_ids]
+    versions = dict(Appointment.objects.filter(id__in=appointment_ids).values_list('id', 'updated_at'))
+    keys = {appt_id: details_key(appt_id, versions.get(appt_id), token) for appt_id in appointment_ids}
+
+    cache = compile_cache()
+    found = cache.get_many(keys.values())
+    hits = len(found)
+    for appt_id, key in keys.items():
+        if key not in found:
+            joined = _join(key)
+            if joined is not None:
+                found[key] = joined
+
+    missing = [appt_id for appt_id, key in keys.items() if key not in found]
+    _count_details(hits, len(found) - hits, len(missing))
+    fetched, failures = fetch_appointment_details(missing, token)
+    cache.set_many({keys[appt_id]: payload for appt_id, payload in fetched.items()})
+    found.update({keys[appt_id]: payload for appt_id, payload in fetched.items()})
+
+    details = {appt_id: found[key] for appt_id, key in keys.items() if key in found}
+    return details, failures
+
+
+# ── Async counterparts ──────────────────────────────────────────────────────────
+async def _ajoin(key: str):
+    """
+    _join() without blocking the event loop.
+    """
+    future = in_flight(key)
+    if future is None:
+        return None
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), deadline.timeout(settings.PREFETCH_JOIN_TIMEOUT))
+    except (CancelledError, Exception):
+        return None
+
+
+async def aget_or_fetch(key: str, fetch, timeout=DEFAULT_TIMEOUT):
+    """
+    get_or_fetch() where `fetch()` returns an awaitable.
+    """
+    cache = compile_cache()
+    value = await cache.aget(key)
+    result = 'hit'
+    if value is None:
+        value, result = await _ajoin(key), 'joined'
+    if value is None:
+        value, result = await fetch(), 'miss'
+        if value is not None:
+            await cache.aset(key, value, timeout)
+    _count_lookup(key, result)
+    return value
+
+
+async def adownload_note(client: httpx.AsyncClient, pdf_url: str, appt_id: int | None = None) -> bytes | None:
+    note_resp = await asend(client, 'GET', pdf_url, timeout=15)
+    if note_resp.status_code == 200:
+        return await sync_to_async(_note_size)(appt_id, _count_note(note_resp.content))
+    return None
+
+
+@timing.span('note_download')
+async def anote_pdf(client: httpx.AsyncClient, appt: dict, token: str) -> bytes | None:
+    clinical_note = appt.get('clinical_note') or {}
+    pdf_url = clinical_note.get('pdf')
+    if not pdf_url:
+        return None
+    return await aget_or_fetch(note_key(appt['id'], clinical_note.get('updated_at'), token), lambda: adownload_note(client, pdf_url, appt['id']))
+
+
+async def afetch_patient(client: httpx.AsyncClient, patient_id: int, token: str) -> dict | None:
+    resp = await aapi_get(client, f"patients/{patient_id}", token, timeout=10)
+    return response_json(resp) if resp.status_code == 200 else None
+
+
+@timing.span('patient_fetch')
+async def apatient_json(client: httpx.AsyncClient, patient_id: int, token: str) -> dict | None:
+    return await aget_or_fetch(patient_key(patient_id, token), lambda: afetch_patient(client, patient_id, token))
+
+
+@timing.span('appointment_fetch')
+async def aappointment_details(client: httpx.AsyncClient, appointment_ids, token: str) -> tuple[dict, dict]:
+    """
+    appointment_details() for async code, missing appointments are fetched concurrently on `client`.
+    """
+    appointment_ids = [int(appt_id) for appt_id in appointment_ids]
+    versions = await sync_to_async(
+        lambda: dict(Appointment.objects.filter(id__in=appointment_ids).values_list('id', 'updated_at'))
+    )()
+    keys = {appt_id: details_key(appt_id, versions.get(appt_id), token) for appt_id in appointment_ids}
+
+    cache = compile_cache()
+    found = await cache.aget_many(keys.values())
+    hits = len(found)
+    for appt_id, key in keys.items():
+        if key not in found:
+            joined = await _ajoin(key)
+            if joined is not None:
+                found[key] = joined
+
+    missing = [appt_id for appt_id, key in keys.items() if key not in found]
+    _count_details(hits, len(found) - hits, len(missing))
+    fetched, failures = await afetch_appointment_details(client, missing, token)
+    await cache.aset_many({keys[appt_id]: payload for appt_id, payload in fetched.items()})
+    found.update({keys[appt_id]: payload for appt_id, payload in fetched.items()})
+
+    details = {appt_id: found[key] for appt_id, key in keys.items() if key in found}
+    return details, failures
@@ -0,0 +1,83 @@
+import time
+from dataclasses import dataclass
+from io import BytesIO
+
+from core import timing
+
+# Opt-in compaction of finished packets: scanned clinical notes carry full resolution images and make
+# up most of a packet's size. Images above the target DPI are downsampled and re-encoded as JPEG,
+# content streams are Flate compressed and objects repeated across notes (fonts, logos, the HCFA
+# form) are stored once. No I/O and only picklable arguments, so it can run in the render process pool.
+
+# Pillow and pypdf are imported on use: pdf.compile imports this module in every worker
+
+# Modes re-encoded as JPEG; bilevel / palette scans are already small with their own codecs
+JPEG_MODES = ('RGB', 'L', 'CMYK')
+
+
+@dataclass
+class Compaction:
+    original: int
+    compacted: int
+    images: int
+    seconds: float
+
+    @property
+    def saved(self) -> int:
+        return self.original - self.compacted
+
+    def __str__(self) -> str:
+        percent = self.saved / self.original * 100 if self.original else 0
+        return (
+            f"{self.original / 1e6:.1f} MB -> {self.compacted / 1e6:.1f} MB ({percent:.0f}% smaller, "
+            f"{self.images} images downsampled, {self.seconds:.1f}s)"
+        )
+
+
+def _page_dpi(page, image) -> float:
+    """
+    Resolution of `image` if it spanned the whole page. Images drawn smaller than the page have a higher
+    real DPI, so downsampling to this estimate never goes below the target.
+    """
+    width_in = float(page.mediabox.width) / 72
+    height_in = float(page.mediabox.height) / 72
+    return max(image.width / width_in, image.height / height_in)
+
+
+@timing.span('compact')
+def compact_pdf(data: bytes, max_dpi: int, quality: int) -> tuple[bytes, Compaction]:
+    """
+    Return the compacted PDF and what it saved. Output larger than the input returns the input unchanged.
+    """
+    from PIL import Image
+    from pypdf import PdfReader, PdfWriter
+
+    started = time.perf_counter()
+    writer = PdfWriter(clone_from=PdfReader(BytesIO(data)))
+    seen, downsampled = set(), 0
+    for page in writer.pages:
+        for image_file in page.images:
+            ref = image_file.indirect_reference
+            # Shared images (ex: a letterhead on every page) are handled once
+            if ref is None or ref.idnum in seen:
+                continue
+            seen.add(ref.idnum)
+            image = image_file.image
+            if image is None or image.mode not in JPEG_MODES:
+                continue
+            dpi = _page_dpi(page, image)
+            if dpi <= max_dpi:
+                continue
+            scale = max_dpi / dpi
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image_file.replace(image.resize(size, Image.Resampling.LANCZOS), quality=quality)
+            downsampled += 1
+        page.compress_content_streams()
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+
+    output = BytesIO()
+    writer.write(output)
+    compacted = output.getvalue()
+    if len(compacted) >= len(data):
+        compacted = data
+    return compacted, Compaction(len(data), len(compacted), downsampled, time.perf_counter() - started)
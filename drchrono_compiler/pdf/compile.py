@@ -0,0 +1,343 @@
+import asyncio
+import logging
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from io import BytesIO
+
+import httpx
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
+
+from appts.services import historical_appointments, line_items_by_appointment, patient_balance, sync_patient
+from core import deadline, metrics, profiling, timing
+from . import provider, render as process_render
+from .cache import aappointment_details, anote_pdf, apatient_json
+from .compact import Compaction, compact_pdf
+from .models import CompileRun
+from .services import fetch_hcfa_data
+
+# The compile pipeline, shared by the compile view and batch commands.
+# All DrChrono and note fetches run concurrently on one httpx.AsyncClient; ReportLab / pypdf work
+# (CPU bound) goes to a small bounded thread pool so the event loop keeps serving other compiles,
+# or to the render process pool (pdf.render) when RENDER_PROCESSES is set.
+
+logger = logging.getLogger(__name__)
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def render_pool() -> ThreadPoolExecutor:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ThreadPoolExecutor(max_workers=settings.RENDER_CONCURRENCY, thread_name_prefix='render')
+        return _render_pool
+
+
+async def render(stage: str, fn, *args, local: bool = False):
+    """
+    Run a render step in the render process pool when enabled (`fn` and args must pickle), else in the
+    render thread pool, after checking the deadline. `local` keeps the step in this process.
+    """
+    deadline.check(stage)
+    pool = None if local else process_render.process_pool()
+    if pool is None:
+        # Spans inside `fn` (pdf.services) land on this request's trace, a profiled request profiles `fn` too
+        return await asyncio.get_running_loop().run_in_executor(render_pool(), timing.bind(profiling.threaded(fn)), *args)
+    try:
+        with timing.span('process_render'):
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        process_render.shutdown(wait=False)
+        raise
+
+
+@dataclass
+class Packet:
+    pdf: bytes
+    filename: str
+    pages: int = 0
+    # Line items of the compiled appointments (HCFA claim rows)
+    line_items: int = 0
+    warnings: list[str] = field(default_factory=list)
+    compaction: Compaction | None = None
+
+
+@timing.span('merge')
+def _merge(parts: list[bytes]) -> tuple[bytes, int]:
+    # pypdf is imported on first use, pages that never compile do not load it
+    from pypdf import PdfWriter
+
+    merger = PdfWriter()
+    for part in parts:
+        if part:
+            merger.append(BytesIO(part))
+    pages = len(merger.pages)
+    output = BytesIO()
+    merger.write(output)
+    merger.close()
+    return output.getvalue(), pages
+
+
+async def _inputs(client: httpx.AsyncClient, patient_id: int, appointment_ids, token: str, warnings: list):
+    """
+    Fetch what a packet is built from -> (patient, {APPT_ID: APPT_JSON}, mirrored history, line items by appointment,
+    provider profiles by (doctor, office), pdf.provider, materialized balance). Appointments, patient or profiles that
+    could not be fetched, and an unset PRACTICE_FEDERAL_ID, are reported in `warnings`.
+    """
+    # Mirror sync (incremental, usually skipped) runs alongside the patient fetch; appointment
+    # details wait for it since their cache keys come from the synced updated_at
+    deadline.check('appointment sync')
+    _, patient = await asyncio.gather(
+        sync_to_async(sync_patient)(patient_id, token),
+        apatient_json(client, patient_id, token),
+    )
+    details, failures = await aappointment_details(client, appointment_ids, token)
+    for appt_id, error in failures.items():
+        warnings.append(f'Could not fetch appointment for {appt_id}. {error}. - skipped.')
+    if patient is None:
+        patient = {}
+        warnings.append(f'Could not fetch patient information for {patient_id}. - skipped. ')
+
+    # Provider profiles are usually cached, a first one is fetched while the mirror is read
+    profiles, valid_appts, balance = await asyncio.gather(
+        provider.aprofiles(client, details.values(), token),
+        sync_to_async(lambda: list(historical_appointments(patient_id)))(),
+        sync_to_async(patient_balance)(patient_id),
+    )
+    missing = [appt['id'] for appt in details.values() if profiles.get(provider.appointment_pair(appt)) is None]
+    # The balance report names the provider of the first appointment with a profile, if there is one
+    report_blank = len(missing) == len(details)
+    for n, appt_id in enumerate(missing):
+        report = ' and the balance report names no provider' if report_blank and n == 0 else ''
+        warnings.append(f"Could not fetch the provider profile of appointment {appt_id}, its claim leaves the provider boxes blank{report}.")
+    if details and not settings.PRACTICE_FEDERAL_ID:
+        warnings.append('PRACTICE_FEDERAL_ID is not set, the claims leave the federal tax ID (box 25) blank.')
+
+    items_by_appt = await sync_to_async(line_items_by_appointment)([appt.id for appt in valid_appts] + list(details))
+    return patient, details, valid_appts, items_by_appt, profiles, balance.balance_total
+
+
+def _provider_name(details: dict, profiles: dict) -> str:
+    # The balance report names the provider of the packet's first appointment
+    for appt in details.values():
+        profile = profiles.get(provider.appointment_pair(appt))
+        if profile is not None:
+            return profile['provider_name']
+    return ''
+
+
+async def _appointment_parts(client: httpx.AsyncClient, patient: dict, appt: dict, items: list, profile: dict | None,
+                             warnings: list, token: str):
+    """
+    (clinical note PDF as downloaded or None, rendered HCFA claim) of one appointment.
+    """
+    appt_id = appt['id']
+    if not (appt.get('clinical_note') or {}).get('pdf'):
+        warnings.append(f"No clinical note PDF found for appointment {appt_id} – skipped.")
+        note = None
+    else:
+        note = await anote_pdf(client, appt, token)
+        if note is None:
+            warnings.append(f"Failed to download clinical note for {appt_id}")
+    hcfa_data = fetch_hcfa_data(patient, appt, items, profile)
+    hcfa = await render(f'HCFA claim of appointment {appt_id}', process_render.claim_pdf, hcfa_data)
+    return note, hcfa
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=settings.DRCHRONO_FETCH_CONCURRENCY * 2))
+
+
+def _packet_name(patient: dict, suffix: str) -> str:
+    return f"Patient_{patient.get('first_name')}_{patient.get('last_name')}_{suffix}"
+
+
+async def compile_packet(patient_id: int, appointment_ids, token: str, compiled: list | None = None,
+                         compact: bool = False, balance: bool = True) -> Packet:
+    """
+    Build the packet PDF: balance report, then per appointment (in the given order) its clinical note and HCFA claim.
+    Appointment ids that finished rendering are appended to `compiled` as they complete (partial result reports).
+    `compact` runs the merged packet through pdf.compact, Packet.compaction then tells what it saved.
+    `balance=False` leaves the balance report out (later parts of a packet compiled in parts, pdf.jobs).
+    Raises DrChronoAPIError / DeadlineExceeded like the sync services; missing notes and failed fetches become warnings.
+    """
+    with metrics.compiles_in_flight.track_inprogress():
+        started = time.perf_counter()
+        packet = await _compile_packet(patient_id, appointment_ids, token, compiled, compact, balance)
+    size = metrics.packet_size(len(appointment_ids))
+    metrics.compile_seconds.labels(size).observe(time.perf_counter() - started)
+    metrics.compile_bytes.labels(size).observe(len(packet.pdf))
+    return packet
+
+
+async def _compile_packet(patient_id: int, appointment_ids, token: str, compiled: list | None, compact: bool,
+                          balance: bool) -> Packet:
+    compiled = compiled if compiled is not None else []
+    warnings = []
+
+    async with _client() as client:
+        patient, details, valid_appts, items_by_appt, profiles, total_balance = await _inputs(
+            client, patient_id, appointment_ids, token, warnings,
+        )
+
+        async def appointment_pages(appt_id):
+            appt = details[appt_id]
+            parts = await _appointment_parts(
+                client, patient, appt, items_by_appt.get(appt_id, []), profiles.get(provider.appointment_pair(appt)), warnings,
+                token,
+            )
+            compiled.append(appt_id)
+            return parts
+
+        tasks = [asyncio.ensure_future(appointment_pages(appt_id)) for appt_id in details]
+        if balance:
+            tasks.insert(0, asyncio.ensure_future(
+                render(
+                    'balance report', process_render.balance_pdf, patient, valid_appts, items_by_appt,
+                    _provider_name(details, profiles), total_balance,
+                ),
+            ))
+        try:
+            pages = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    report = [pages.pop(0)] if balance else []
+    parts = report + [part for note_and_hcfa in pages for part in note_and_hcfa]
+    pdf, pages = await render('merging the packet', _merge, parts, local=True)
+    compaction = None
+    if compact:
+        pdf, compaction = await render(
+            'compacting the packet', compact_pdf, pdf, settings.PACKET_COMPACT_DPI, settings.PACKET_COMPACT_QUALITY,
+        )
+    return Packet(
+        pdf=pdf, filename=_packet_name(patient, 'REPORT.pdf'), pages=pages,
+        line_items=sum(len(items_by_appt.get(appt_id, [])) for appt_id in details), warnings=warnings,
+        compaction=compaction,
+    )
+
+
+class _ZipSink:
+    """
+    Write-only target for zipfile. Without tell() / seek() zipfile treats it as a stream and writes
+    sizes in data descriptors after each member, so finished members can be sent right away.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+async def packet_zip(patient_id: int, appointment_ids, token: str, name: list | None = None):
+    """
+    Async generator of the packet as a ZIP archive: balance report, then per appointment (in the given order)
+    the clinical note exactly as downloaded and the HCFA claim, one file each, plus warnings.txt when needed.
+    Members are yielded as soon as they are ready, in order, while later notes are still downloading.
+    The first chunk (balance report) comes after all fetch errors that abort a compile; `name` receives the archive name.
+    Members are stored uncompressed, PDFs barely compress and the notes stay byte for byte as downloaded.
+    """
+    warnings = []
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED)
+
+    with metrics.compiles_in_flight.track_inprogress():
+        async with _client() as client:
+            patient, details, valid_appts, items_by_appt, profiles, total_balance = await _inputs(
+                client, patient_id, appointment_ids, token, warnings,
+            )
+            if name is not None:
+                name.append(_packet_name(patient, 'FILES.zip'))
+
+            tasks = [
+                asyncio.ensure_future(_appointment_parts(
+                    client, patient, appt, items_by_appt.get(appt_id, []), profiles.get(provider.appointment_pair(appt)), warnings,
+                    token,
+                ))
+                for appt_id, appt in details.items()
+            ]
+            try:
+                balance = await render(
+                    'balance report', process_render.balance_pdf, patient, valid_appts, items_by_appt,
+                    _provider_name(details, profiles), total_balance,
+                )
+                archive.writestr('00_Balance_Report.pdf', balance)
+                yield sink.drain()
+
+                for number, (task, appt) in enumerate(zip(tasks, details.values()), start=1):
+                    note, hcfa = await task
+                    prefix = f"{number:02d}_{(appt.get('scheduled_time') or '')[:10]}_{appt['id']}"
+                    if note is not None:
+                        archive.writestr(f'{prefix}_Clinical_Note.pdf', note)
+                    archive.writestr(f'{prefix}_HCFA.pdf', hcfa)
+                    yield sink.drain()
+            finally:
+                # Client gone or a step failed: stop the downloads and renders still running
+                for task in tasks:
+                    task.cancel()
+
+    if warnings:
+        archive.writestr('warnings.txt', '\n'.join(warnings) + '\n')
+    archive.close()
+    yield sink.drain()
+
+
+def compile_packet_sync(patient_id: int, appointment_ids, token: str, compiled: list | None = None,
+                        compact: bool = False, balance: bool = True) -> Packet:
+    """
+    compile_packet() for sync callers (management commands, background jobs).
+    """
+    return async_to_sync(compile_packet)(patient_id, appointment_ids, token, compiled, compact, balance)
+
+
+def record_run(patient_id: int, appointments: int, outcome: str, seconds: float, packet: Packet | None = None,
+               compact: bool = False, estimated_seconds: float | None = None, background: bool = False,
+               output_bytes: int | None = None) -> None:
+    """
+    Store a CompileRun of the compile view (or a background job) with the stages, DrChrono calls and cache lookups
+    of the current trace. A failed write is logged, never raised: the packet is ready by then.
+    `output_bytes` overrides the size of `packet.pdf` (a job's ZIP of parts).
+    """
+    trace = timing.current()
+    summary = trace.summary() if trace is not None else {}
+    counts = trace.counts if trace is not None else {}
+    try:
+        CompileRun.objects.create(
+            patient_id=patient_id,
+            appointments=appointments,
+            line_items=packet.line_items if packet else None,
+            pages=packet.pages if packet else None,
+            output_bytes=output_bytes if output_bytes is not None else len(packet.pdf) if packet else None,
+            compact=compact,
+            duration_ms=round(seconds * 1000),
+            stages=summary.get('stages', {}),
+            api_calls=summary.get('api_calls', 0),
+            api_ms=round(summary.get('api_ms', 0)),
+            cache_hits=counts.get('cache_hit', 0) + counts.get('cache_joined', 0),
+            cache_misses=counts.get('cache_miss', 0),
+            outcome=outcome,
+            warnings=len(packet.warnings) if packet else 0,
+            background=background,
+            estimated_ms=round(estimated_seconds * 1000) if estimated_seconds is not None else None,
+        )
+    except DatabaseError as e:
+        logger.warning("Could not record the compile run: %s", e)
@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from core import deadline, timing
+from core.api import DrChronoAPIError
+from .admission import Estimate, Lease
+from .compile import Packet, compile_packet_sync, record_run
+from .models import CompileRun
+
+# Background compiles of selections too big for one request (pdf.admission). A job runs in a small thread
+# pool of the worker that accepted it and compiles the selection in parts of at most
+# COMPILE_PART_APPOINTMENTS appointments, one after the other so only one part is in memory, into a ZIP
+# of PDFs in COMPILE_JOB_DIR. Its state is a JSON file next to the ZIP, so any worker can show progress
+# and serve the download. A job keeps its heavy compile slot until it ends; a worker restart loses the
+# jobs it was running (their page then reports them stopped).
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.COMPILE_HEAVY_CONCURRENCY, thread_name_prefix='compile-job')
+        return _pool
+
+
+def _path(job_id: str, extension: str) -> str:
+    return os.path.join(settings.COMPILE_JOB_DIR, f'{job_id}.{extension}')
+
+
+def result_path(job_id: str) -> str:
+    return _path(job_id, 'zip')
+
+
+def state(job_id: str) -> dict | None:
+    """
+    The job's state, None for an unknown or expired job.
+    """
+    if not _JOB_ID.match(job_id):
+        return None
+    try:
+        with open(_path(job_id, 'json')) as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if job['status'] in (QUEUED, RUNNING) and stopped(job):
+        job.update(status=FAILED, error='The compile stopped (the server restarted), please start it again.')
+    return job
+
+
+def stopped(job: dict) -> bool:
+    # Past its deadline without finishing: the worker running it is gone
+    limit = settings.COMPILE_BACKGROUND_DEADLINE or settings.COMPILE_JOB_TTL
+    return time.time() - job['created'] > limit + 60
+
+
+def _save(job_id: str, job: dict) -> None:
+    job['updated'] = time.time()
+    partial = _path(job_id, 'json.tmp')
+    with open(partial, 'w') as f:
+        json.dump(job, f)
+    os.replace(partial, _path(job_id, 'json'))
+
+
+def _clean_up() -> None:
+    """
+    Delete jobs (state and ZIP) older than COMPILE_JOB_TTL.
+    """
+    cutoff = time.time() - settings.COMPILE_JOB_TTL
+    for entry in os.scandir(settings.COMPILE_JOB_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def lease_seconds() -> float:
+    # Renewed before every part
+    return (settings.COMPILE_BACKGROUND_DEADLINE or settings.COMPILE_JOB_TTL) + 60
+
+
+def submit(user_id: int, patient_id: int, patient_name: str, appointment_ids: list, token: str, compact: bool,
+           estimate: Estimate, lease: Lease) -> str:
+    """
+    Queue the compile of `appointment_ids` (packet order) and return the job id. The job takes over `lease`.
+    """
+    os.makedirs(settings.COMPILE_JOB_DIR, exist_ok=True)
+    _clean_up()
+    job_id = uuid.uuid4().hex
+    size = max(settings.COMPILE_PART_APPOINTMENTS, 1)
+    parts = [appointment_ids[start:start + size] for start in range(0, len(appointment_ids), size)]
+    job = {
+        'user': user_id,
+        'patient_id': patient_id,
+        'patient_name': patient_name,
+        'appointments': len(appointment_ids),
+        'estimate': str(estimate),
+        'parts': len(parts),
+        'parts_done': 0,
+        'status': QUEUED,
+        'filename': '',
+        'warnings': [],
+        'error': '',
+        'created': time.time(),
+    }
+    _save(job_id, job)
+    _executor().submit(_run, job_id, job, parts, token, compact, estimate, lease)
+    return job_id
+
+
+def _run(job_id: str, job: dict, parts: list, token: str, compact: bool, estimate: Estimate, lease: Lease) -> None:
+    close_old_connections()
+    started = time.perf_counter()
+    budget = deadline.budget(settings.COMPILE_BACKGROUND_DEADLINE) if settings.COMPILE_BACKGROUND_DEADLINE else nullcontext()
+    try:
+        with timing.collect(), budget:
+            packet, outcome = None, CompileRun.FAILED
+            try:
+                job['status'] = RUNNING
+                _save(job_id, job)
+                packet = _compile_parts(job_id, job, parts, token, compact, lease)
+                outcome = CompileRun.WARNINGS if packet.warnings else CompileRun.OK
+                job.update(status=DONE, filename=packet.filename, warnings=packet.warnings)
+            except deadline.DeadlineExceeded as e:
+                outcome = CompileRun.DEADLINE
+                job.update(status=FAILED, error=f"The {e}, try a smaller selection.")
+            except DrChronoAPIError as e:
+                outcome = CompileRun.DRCHRONO_ERROR
+                job.update(status=FAILED, error=f"DrChrono is rate limiting or unavailable, please try again later. ({e})")
+            except Exception as e:
+                logger.exception("Background compile %s failed", job_id)
+                job.update(status=FAILED, error=f"PDF generation failed: {e}.")
+            record_run(
+                job['patient_id'], job['appointments'], outcome, time.perf_counter() - started, packet, compact,
+                estimate.seconds, background=True,
+                output_bytes=os.path.getsize(result_path(job_id)) if outcome in (CompileRun.OK, CompileRun.WARNINGS) else None,
+            )
+    finally:
+        _save(job_id, job)
+        lease.release()
+        close_old_connections()
+
+
+def _compile_parts(job_id: str, job: dict, parts: list, token: str, compact: bool, lease: Lease) -> Packet:
+    """
+    Compile the parts into the job's ZIP. Returns the totals as a Packet without PDF bytes.
+    """
+    total = Packet(pdf=b'', filename='')
+    partial = _path(job_id, 'zip.tmp')
+    try:
+        with zipfile.ZipFile(partial, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for number, appointment_ids in enumerate(parts, start=1):
+                lease.renew()
+                # The balance report opens the first part only
+                packet = compile_packet_sync(job['patient_id'], appointment_ids, token, compact=compact, balance=number == 1)
+                stem = packet.filename.removesuffix('REPORT.pdf')
+                archive.writestr(f'{stem}PART_{number}_of_{len(parts)}.pdf', packet.pdf)
+                total.filename = f'{stem}PARTS.zip'
+                total.pages += packet.pages
+                total.line_items += packet.line_items
+                total.warnings += packet.warnings
+                job['parts_done'] = number
+                _save(job_id, job)
+            if total.warnings:
+                archive.writestr('warnings.txt', '\n'.join(total.warnings) + '\n')
+        os.replace(partial, result_path(job_id))
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return total
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.standin import DOCTOR, OFFICE, StandInDrChrono, scanned_note_pdf
+from pdf import provider
+from pdf.compact import compact_pdf
+from pdf.compile import _merge
+from pdf.render import claim_pdf
+from pdf.services import fetch_hcfa_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark packet compaction: time spent against bytes saved, for each target DPI. "
+        "Uses the given PDFs, or a synthetic packet of scanned notes and HCFA claims."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='PDFs to compact (default: a synthetic packet)')
+        parser.add_argument('--appointments', type=int, default=10, help='Synthetic packet: notes and claims')
+        parser.add_argument('--pages', type=int, default=2, help='Synthetic packet: scanned pages per note')
+        parser.add_argument('--scan-dpi', type=int, default=300, help='Synthetic packet: resolution of the scans')
+        parser.add_argument('--dpi', type=int, nargs='+', default=[100, 150, 200], help='Target DPIs to compare')
+        parser.add_argument('--quality', type=int, default=settings.PACKET_COMPACT_QUALITY, help='JPEG quality')
+
+    def handle(self, *args, **options):
+        if options['files']:
+            inputs = []
+            for path in options['files']:
+                try:
+                    with open(path, 'rb') as f:
+                        inputs.append((path, f.read()))
+                except OSError as e:
+                    raise CommandError(str(e))
+        else:
+            inputs = [('synthetic packet', self.packet(options))]
+
+        self.stdout.write(f"{'input':>20}{'dpi':>6}{'before MB':>11}{'after MB':>10}{'saved':>8}{'images':>8}{'time s':>8}{'MB/s saved':>12}")
+        for name, data in inputs:
+            for dpi in options['dpi']:
+                _, result = compact_pdf(data, dpi, options['quality'])
+                rate = result.saved / 1e6 / result.seconds if result.seconds else 0
+                self.stdout.write(
+                    f"{name[-20:]:>20}{dpi:>6}{result.original / 1e6:>11.2f}{result.compacted / 1e6:>10.2f}"
+                    f"{result.saved / result.original:>8.0%}{result.images:>8}{result.seconds:>8.2f}{rate:>12.2f}"
+                )
+
+    def packet(self, options) -> bytes:
+        """
+        Scanned note + HCFA claim per appointment, merged like compile_packet does.
+        """
+        api = StandInDrChrono()
+        patient = api.add_patient()
+        parts = []
+        profile = provider.build(DOCTOR, OFFICE)
+        for number in range(options['appointments']):
+            appt = api.add_appointment(patient['id'], f'2025-01-{number % 28 + 1:02d}T09:00:00')
+            parts.append(scanned_note_pdf(options['pages'], options['scan_dpi'], seed=number))
+            parts.append(claim_pdf(fetch_hcfa_data(patient, appt, [api.add_line_item(appt['id'])], profile)))
+        return _merge(parts)[0]
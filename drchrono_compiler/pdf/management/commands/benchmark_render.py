@@ -0,0 +1,79 @@
+import asyncio
+import copy
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from appts.models import Appointment
+from core.standin import DOCTOR, OFFICE, StandInDrChrono
+from pdf import provider, render as process_render
+from pdf.compile import _merge, render
+from pdf.services import fetch_hcfa_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the render stage of a multi-claim packet (HCFA claims, balance report, merge) "
+        "in the render thread pool and in render process pools of each given size. No network."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--claims', type=int, default=60, help='Appointments (claims) in the packet')
+        parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4], help='Process pool sizes to compare')
+        parser.add_argument('--repeat', type=int, default=3, help='Renders per configuration, the median is reported')
+
+    def handle(self, *args, **options):
+        if options['claims'] < 1 or options['repeat'] < 1 or min(options['processes']) < 1:
+            raise CommandError('--claims, --repeat and --processes must be at least 1')
+
+        packet = self.packet(options['claims'])
+        self.stdout.write(f"{options['claims']} claims, median of {options['repeat']} renders, {os.cpu_count()} cores")
+        self.stdout.write(f"{'pool':>12}{'start s':>9}{'render s':>10}{'claims/s':>10}{'speedup':>9}")
+
+        baseline = None
+        for processes in [0] + options['processes']:
+            with override_settings(RENDER_PROCESSES=processes):
+                started = time.perf_counter()
+                process_render.start()
+                startup = time.perf_counter() - started
+                try:
+                    timings = [asyncio.run(self.render_packet(*packet)) for _ in range(options['repeat'])]
+                finally:
+                    process_render.shutdown()
+
+            median = statistics.median(timings)
+            baseline = baseline or median
+            label = f'{processes} processes' if processes else 'threads'
+            self.stdout.write(
+                f"{label:>12}{startup:>9.2f}{median:>10.2f}{options['claims'] / median:>10.1f}{baseline / median:>8.2f}x"
+            )
+
+    def packet(self, claims: int):
+        """
+        Patient, mirrored appointments, line items and HCFA data built from stand-in payloads.
+        """
+        api = StandInDrChrono()
+        patient = api.add_patient()
+        appts, items_by_appt, hcfa = [], {}, []
+        profile = provider.build(DOCTOR, OFFICE)
+        for days in range(1, claims + 1):
+            appt = api.add_appointment(patient['id'], (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%dT09:00:00'))
+            items = [api.add_line_item(appt['id'])]
+            appts.append(Appointment(id=appt['id'], patient=patient['id'], reason=appt['reason']))
+            items_by_appt[appt['id']] = items
+            hcfa.append(fetch_hcfa_data(patient, appt, items, profile))
+        return patient, appts, items_by_appt, hcfa
+
+    async def render_packet(self, patient, appts, items_by_appt, hcfa) -> float:
+        started = time.perf_counter()
+        parts = await asyncio.gather(
+            render('balance report', process_render.balance_pdf, patient, appts, items_by_appt),
+            # generate_hcfa_bill rewrites its input, every render gets a fresh copy
+            *(render('HCFA claim', process_render.claim_pdf, copy.deepcopy(data)) for data in hcfa),
+        )
+        await render('merging the packet', _merge, parts, local=True)
+        return time.perf_counter() - started
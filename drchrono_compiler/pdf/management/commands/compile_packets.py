@@ -0,0 +1,199 @@
+import asyncio
+import json
+import os
+import statistics
+import time
+from contextlib import nullcontext
+from datetime import date, timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from appts.services import historical_appointments, sync_patient
+from core import deadline
+from core.api import DrChronoAPIError, api_get, response_json
+from pdf.compile import compile_packet
+from verify.exceptions import DrChronoAuthError
+from verify.models import DrChronoCredential
+from verify.services import refresh_credential
+
+MANIFEST = 'manifest.json'
+# Tokens are refreshed before a patient starts when they expire within this window
+TOKEN_MARGIN = timedelta(minutes=5)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compile packets for many patients (month-end billing): every appointment with a clinical note in "
+        "the date window, same pipeline as the compile view, several patients at once. Writes one PDF per "
+        "patient plus manifest.json to --output; running it again resumes, skipping packets already written."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('patients', nargs='+', help='DrChrono patient ids (chart ids with --chart-ids)')
+        parser.add_argument('--chart-ids', action='store_true', help='Patients are given by chart id')
+        parser.add_argument('--user', required=True, help='Username whose DrChrono connection is used')
+        parser.add_argument('--since', type=date.fromisoformat, help='First appointment date (YYYY-MM-DD)')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last appointment date (YYYY-MM-DD)')
+        parser.add_argument('--output', default='packets', help='Directory for the PDFs and the manifest')
+        parser.add_argument('--concurrency', type=int, default=settings.BATCH_COMPILE_CONCURRENCY, help='Patients compiled at once')
+        parser.add_argument('--budget', type=float, default=0, help='Seconds allowed per patient, 0 for no limit')
+        parser.add_argument('--force', action='store_true', help='Recompile packets the manifest lists as done')
+        parser.add_argument('--compact', action='store_true', help='Downsample scanned notes and deduplicate objects (pdf.compact)')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1')
+        try:
+            self.cred = DrChronoCredential.objects.get(user__username=options['user'])
+        except DrChronoCredential.DoesNotExist:
+            raise CommandError(f"{options['user']} has not connected DrChrono")
+
+        self.output = options['output']
+        os.makedirs(self.output, exist_ok=True)
+        window = {
+            'since': options['since'].isoformat() if options['since'] else None,
+            'until': options['until'].isoformat() if options['until'] else None,
+        }
+        self.manifest = self.load_manifest(window, options['force'])
+
+        try:
+            patient_ids = self.resolve(options['patients'], options['chart_ids'])
+            started = time.perf_counter()
+            # async_to_sync: ORM calls (sync_to_async) run on this thread, like in the compile view
+            results = async_to_sync(self.run)(patient_ids, options)
+        except DrChronoAuthError as e:
+            raise CommandError(f"DrChrono connection of {options['user']} is not usable: {e}")
+        self.report(results, time.perf_counter() - started)
+
+    # ── Inputs ──────────────────────────────────────────────────────────────────
+    def token(self) -> str:
+        if self.cred.expires_within(TOKEN_MARGIN):
+            self.cred = refresh_credential(self.cred, TOKEN_MARGIN)
+        return self.cred.access_token
+
+    def resolve(self, values: list[str], chart_ids: bool) -> list[int]:
+        """
+        Patient ids in the given order, duplicates dropped. Chart ids are looked up through /patients_summary.
+        """
+        patient_ids = []
+        for value in values:
+            if not chart_ids:
+                try:
+                    patient_ids.append(int(value))
+                except ValueError:
+                    raise CommandError(f"{value} is not a patient id, use --chart-ids for chart ids")
+                continue
+            matches = response_json(api_get('patients_summary', self.token(), params={'chart_id': value}, timeout=10))['results']
+            if len(matches) != 1:
+                raise CommandError(f"Chart id {value} matches {len(matches)} patients")
+            patient_ids.append(matches[0]['id'])
+        return list(dict.fromkeys(patient_ids))
+
+    # ── Manifest ────────────────────────────────────────────────────────────────
+    def load_manifest(self, window: dict, force: bool) -> dict:
+        path = os.path.join(self.output, MANIFEST)
+        if not os.path.exists(path):
+            return {**window, 'patients': {}}
+        with open(path) as f:
+            manifest = json.load(f)
+        if force:
+            return {**window, 'patients': {}}
+        if {key: manifest.get(key) for key in window} != window:
+            raise CommandError(
+                f"{path} was written for the window {manifest.get('since')} - {manifest.get('until')}, "
+                "use another --output or --force"
+            )
+        return manifest
+
+    def save_manifest(self) -> None:
+        # Written after every patient through a temp file, an interrupted run leaves a valid manifest
+        path = os.path.join(self.output, MANIFEST)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+    def done(self, patient_id: int) -> bool:
+        entry = self.manifest['patients'].get(str(patient_id))
+        return bool(entry and entry['status'] == 'ok' and os.path.exists(os.path.join(self.output, entry['file'])))
+
+    # ── Compile ─────────────────────────────────────────────────────────────────
+    async def run(self, patient_ids: list[int], options) -> list[dict]:
+        limit = asyncio.Semaphore(options['concurrency'])
+
+        async def compile_one(patient_id):
+            if self.done(patient_id):
+                return {**self.manifest['patients'][str(patient_id)], 'resumed': True}
+            async with limit:
+                entry = await self.compile_patient(patient_id, options)
+            self.manifest['patients'][str(patient_id)] = entry
+            self.save_manifest()
+            self.stdout.write(
+                f"{entry['status']:>7} {patient_id}: {entry['appointments']} appointments, "
+                f"{entry['pages']} pages, {entry['seconds']:.1f}s {entry.get('error', '')}".rstrip()
+            )
+            return entry
+
+        return await asyncio.gather(*(compile_one(patient_id) for patient_id in patient_ids))
+
+    async def compile_patient(self, patient_id: int, options) -> dict:
+        entry = {'patient_id': patient_id, 'file': None, 'appointments': 0, 'pages': 0, 'bytes': 0, 'warnings': []}
+        started = time.perf_counter()
+        try:
+            token = await sync_to_async(self.token)()
+            with deadline.budget(options['budget']) if options['budget'] else nullcontext():
+                # Selection reads the mirror, so bring it up to date first (compile_packet then skips the sync)
+                await sync_to_async(sync_patient)(patient_id, token)
+                appointment_ids = await sync_to_async(lambda: list(
+                    historical_appointments(patient_id, options['since'], options['until']).values_list('id', flat=True)
+                ))()
+                entry['appointments'] = len(appointment_ids)
+                if not appointment_ids:
+                    entry['status'] = 'empty'
+                else:
+                    # Oldest first, like the compile view
+                    packet = await compile_packet(patient_id, list(reversed(appointment_ids)), token, compact=options['compact'])
+                    entry['file'] = f'{patient_id}_{packet.filename}'
+                    with open(os.path.join(self.output, entry['file']), 'wb') as f:
+                        f.write(packet.pdf)
+                    entry.update(status='ok', pages=packet.pages, bytes=len(packet.pdf), warnings=packet.warnings)
+                    if packet.compaction:
+                        entry['original_bytes'] = packet.compaction.original
+        except DrChronoAuthError:
+            raise
+        except (DrChronoAPIError, deadline.DeadlineExceeded) as e:
+            entry.update(status='failed', error=str(e))
+        except Exception as e:
+            entry.update(status='failed', error=f'{type(e).__name__}: {e}')
+        entry['seconds'] = round(time.perf_counter() - started, 3)
+        entry['compiled_at'] = timezone.now().isoformat()
+        return entry
+
+    # ── Report ──────────────────────────────────────────────────────────────────
+    def report(self, results: list[dict], wall: float) -> None:
+        fresh = [entry for entry in results if not entry.get('resumed')]
+        ok = [entry for entry in fresh if entry['status'] == 'ok']
+        failed = [entry for entry in fresh if entry['status'] == 'failed']
+        pages = sum(entry['pages'] for entry in ok)
+        summary = (
+            f"{len(ok)} compiled, {len(failed)} failed, {len(fresh) - len(ok) - len(failed)} without appointments, "
+            f"{len(results) - len(fresh)} already done, in {wall:.1f}s"
+        )
+        if ok:
+            seconds = [entry['seconds'] for entry in ok]
+            summary += (
+                f": {len(ok) / wall * 60:.1f} patients/min, {pages / wall * 60:.0f} pages/min, "
+                f"p50 {statistics.median(seconds):.1f}s, max {max(seconds):.1f}s per patient"
+            )
+            written = sum(entry['bytes'] for entry in ok)
+            summary += f", {written / 1e6:.1f} MB written"
+            original = sum(entry.get('original_bytes', entry['bytes']) for entry in ok)
+            if original != written:
+                summary += f" ({(original - written) / 1e6:.1f} MB saved by compaction)"
+        self.stdout.write(summary)
+        self.stdout.write(f"Manifest: {os.path.join(self.output, MANIFEST)}")
+        if failed:
+            self.stderr.write(f"Failed: {', '.join(str(entry['patient_id']) for entry in failed)} (run again to retry)")
+
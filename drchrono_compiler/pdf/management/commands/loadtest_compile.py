@@ -0,0 +1,83 @@
+import asyncio
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from core.loadtest import UNTHROTTLED, InProcessServer, login, seed
+from core.standin import StandInDrChrono
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the async compile view: serve the ASGI app with one in-process uvicorn worker, "
+        "point it at the local DrChrono stand-in and fire concurrent compiles (one patient each)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compiles', type=int, default=20, help='Compiles to run in total')
+        parser.add_argument('--concurrency', type=int, default=10, help='Compiles in flight at once')
+        parser.add_argument('--appointments', type=int, default=10, help='Selected appointments per compile')
+        parser.add_argument('--latency', type=float, default=0.1, help='Simulated stand-in seconds per request')
+
+    def handle(self, *args, **options):
+        if options['compiles'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--compiles and --concurrency must be at least 1')
+
+        api = StandInDrChrono(latency=options['latency']).start()
+        overrides = override_settings(
+            DRCHRONO_API_URL=api.api_url,
+            ALLOWED_HOSTS=['127.0.0.1'],
+            PREFETCH_ENABLED=False,
+            **UNTHROTTLED,
+        )
+        # Stand-in started first, the overrides need its bound port
+        with api, overrides:
+            token = f'loadtest-{get_random_string(8)}'
+            # One patient per compile
+            jobs = seed(api, token, options['compiles'], options['appointments'])
+            cookies, headers = login(token)
+
+            with InProcessServer() as base_url:
+                self.stdout.write(
+                    f"{options['compiles']} compiles x {options['appointments']} appointments, "
+                    f"concurrency {options['concurrency']}, stand-in latency {options['latency'] * 1000:.0f} ms"
+                )
+                started = time.perf_counter()
+                results = asyncio.run(self.run(base_url, jobs, cookies, headers, options['concurrency']))
+                wall = time.perf_counter() - started
+
+        self.report(results, wall)
+
+    async def run(self, base_url: str, jobs, cookies: dict, headers: dict, concurrency: int) -> list[tuple[float, bool]]:
+        limit = asyncio.Semaphore(concurrency)
+
+        async def compile_one(client, patient_id, appt_ids):
+            async with limit:
+                started = time.perf_counter()
+                try:
+                    resp = await client.post(
+                        reverse('pdf_app:generate_selected', kwargs={'patient_id': patient_id}),
+                        data={'selected_appts': [str(appt_id) for appt_id in appt_ids], 'patient_name': 'Load Test'},
+                    )
+                    ok = resp.status_code == 200 and resp.headers.get('Content-Type') == 'application/pdf'
+                except httpx.HTTPError:
+                    ok = False
+                return time.perf_counter() - started, ok
+
+        async with httpx.AsyncClient(base_url=base_url, cookies=cookies, headers=headers, timeout=120) as client:
+            return await asyncio.gather(*(compile_one(client, patient['id'], appt_ids) for patient, appt_ids in jobs))
+
+    def report(self, results, wall: float) -> None:
+        latencies = sorted(latency for latency, _ in results)
+        ok = sum(1 for _, success in results if success)
+        self.stdout.write(f"{'ok':>6}{'failed':>8}{'wall s':>9}{'per min':>9}{'p50 s':>8}{'max s':>8}{'overlap':>9}")
+        self.stdout.write(
+            f"{ok:>6}{len(results) - ok:>8}{wall:>9.2f}{len(results) / wall * 60:>9.1f}"
+            f"{statistics.median(latencies):>8.2f}{latencies[-1]:>8.2f}{sum(latencies) / wall:>8.1f}x"
+        )
+
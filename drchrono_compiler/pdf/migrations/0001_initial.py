@@ -0,0 +1,38 @@
+# Generated by Django 5.2.10 on 2026-10-19 03:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompileRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('patient_id', models.BigIntegerField()),
+                ('appointments', models.PositiveIntegerField()),
+                ('line_items', models.PositiveIntegerField(blank=True, null=True)),
+                ('pages', models.PositiveIntegerField(blank=True, null=True)),
+                ('output_bytes', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('compact', models.BooleanField(default=False)),
+                ('duration_ms', models.PositiveIntegerField()),
+                ('stages', models.JSONField(default=dict)),
+                ('api_calls', models.PositiveIntegerField(default=0)),
+                ('api_ms', models.PositiveIntegerField(default=0)),
+                ('cache_hits', models.PositiveIntegerField(default=0)),
+                ('cache_misses', models.PositiveIntegerField(default=0)),
+                ('outcome', models.CharField(choices=[('ok', 'OK'), ('warnings', 'OK with warnings'), ('deadline', 'Deadline exceeded'), ('drchrono_error', 'DrChrono error'), ('failed', 'Failed')], max_length=16)),
+                ('warnings', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
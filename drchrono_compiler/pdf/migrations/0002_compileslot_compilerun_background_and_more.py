@@ -0,0 +1,31 @@
+# Generated by Django 5.2.10 on 2026-10-19 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompileSlot',
+            fields=[
+                ('slot', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('holder', models.CharField(blank=True, max_length=32)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='compilerun',
+            name='background',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='compilerun',
+            name='estimated_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,62 @@
+from django.db import models
+
+# One row per packet compile of the compile view (or background job), the history behind the admin trends page
+# (pdf.admin): latency percentiles per day and the slowest runs, to tell whether a deploy or a
+# change on DrChrono's side made compiles slower.
+
+
+class CompileRun(models.Model):
+    OK = 'ok'
+    WARNINGS = 'warnings'
+    DEADLINE = 'deadline'
+    DRCHRONO_ERROR = 'drchrono_error'
+    FAILED = 'failed'
+    OUTCOMES = [
+        (OK, 'OK'),
+        (WARNINGS, 'OK with warnings'),
+        (DEADLINE, 'Deadline exceeded'),
+        (DRCHRONO_ERROR, 'DrChrono error'),
+        (FAILED, 'Failed'),
+    ]
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    patient_id = models.BigIntegerField()
+    appointments = models.PositiveIntegerField()
+    # Unknown (null) when the compile did not finish
+    line_items = models.PositiveIntegerField(null=True, blank=True)
+    pages = models.PositiveIntegerField(null=True, blank=True)
+    output_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    compact = models.BooleanField(default=False)
+    duration_ms = models.PositiveIntegerField()
+    # core.timing stages of the request: {name: {'ms', 'count'}}
+    stages = models.JSONField(default=dict)
+    api_calls = models.PositiveIntegerField(default=0)
+    api_ms = models.PositiveIntegerField(default=0)
+    # Compile cache lookups (pdf.cache); joining an in-flight warm-up fetch counts as a hit
+    cache_hits = models.PositiveIntegerField(default=0)
+    cache_misses = models.PositiveIntegerField(default=0)
+    outcome = models.CharField(max_length=16, choices=OUTCOMES)
+    warnings = models.PositiveIntegerField(default=0)
+    # Compiled in parts by a background job (pdf.jobs) instead of in the request
+    background = models.BooleanField(default=False)
+    # What pdf.admission predicted, to keep an eye on the estimator
+    estimated_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Compile of {self.appointments} appointments for patient {self.patient_id} ({self.duration_ms} ms, {self.outcome})"
+
+
+class CompileSlot(models.Model):
+    """
+    One of COMPILE_HEAVY_CONCURRENCY slots for heavy compiles, shared by every worker through the database
+    (pdf.admission). Held while `expires_at` is in the future, so a slot of a crashed worker frees itself.
+    """
+    slot = models.PositiveSmallIntegerField(primary_key=True)
+    holder = models.CharField(max_length=32, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Heavy compile slot {self.slot}"
@@ -0,0 +1,151 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from appts.services import fetch_appointment_details
+from . import cache, provider
+
+logger = logging.getLogger(__name__)
+
+# Background warm-up of the compile caches, kicked off when the appointment list is viewed.
+# One shared, bounded pool per process; one active warm-up per user (a newer one cancels the older).
+# The pool also runs refresh() of cached values that are still served while refetched (pdf.provider).
+
+_executor = None
+_executor_lock = threading.Lock()
+_active: dict = {}
+_active_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PREFETCH_CONCURRENCY, thread_name_prefix='prefetch')
+        return _executor
+
+
+class WarmUp:
+    """
+    Handle on a running warm-up. cancel() drops its queued fetches, fetches already on the wire finish and are cached.
+    """
+
+    def __init__(self, patient_id: int):
+        self.patient_id = patient_id
+        self.cancelled = threading.Event()
+        self.futures: list[Future] = []
+        self._owned: list[Future] = []
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        for future in self._owned:
+            future.cancel()
+
+    def done(self) -> bool:
+        return all(future.done() for future in self.futures)
+
+    def wait(self, timeout: float | None = None) -> None:
+        for future in self.futures:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+    def submit(self, key: str, fn, *args, timeout=DEFAULT_TIMEOUT) -> Future:
+        """
+        Run fn(*args) for `key` in the pool unless it is cached or already being fetched (then share that fetch).
+        The result is cached for `timeout` seconds, default the cache's.
+        """
+        if cache.compile_cache().get(key) is not None:
+            done = Future()
+            done.set_result(None)
+            return done
+
+        future = Future()
+        shared = cache.track(key, future)
+        self.futures.append(shared)
+        if shared is future:
+            self._owned.append(future)
+            _pool().submit(self._run, future, key, fn, args, timeout)
+        return shared
+
+    def _run(self, future: Future, key: str, fn, args, timeout) -> None:
+        if self.cancelled.is_set():
+            future.cancel()
+        if not future.set_running_or_notify_cancel():
+            return
+        _store(future, key, fn, args, timeout)
+
+
+def _store(future: Future, key: str, fn, args, timeout) -> None:
+    try:
+        value = fn(*args)
+    except Exception as e:
+        logger.info("Background fetch of %s failed: %s", key, e)
+        value = None
+    if value is not None:
+        cache.compile_cache().set(key, value, timeout)
+    future.set_result(value)
+
+
+def refresh(key: str, fn, *args, timeout=DEFAULT_TIMEOUT) -> Future:
+    """
+    Run fn(*args) in the pool and cache the result for `key`, while the cached value keeps serving.
+    A refresh already running for `key` is shared.
+    """
+    future = Future()
+    shared = cache.track(key, future)
+    if shared is future:
+        future.set_running_or_notify_cancel()
+        _pool().submit(_store, future, key, fn, args, timeout)
+    return shared
+
+
+def _fetch_details(warm_up: 'WarmUp', appt_id: int, token: str):
+    details, _ = fetch_appointment_details([appt_id], token)
+    payload = details.get(appt_id)
+    # Queued before this fetch resolves, so wait() never misses the note download
+    _warm_note(warm_up, appt_id, payload, token)
+    return payload
+
+
+def _warm_note(warm_up: WarmUp, appt_id: int, details: dict | None, token: str) -> None:
+    """
+    Queue the note PDF download once the verbose appointment JSON (which carries a fresh note link) is known.
+    """
+    if not details or warm_up.cancelled.is_set():
+        return
+    clinical_note = details.get('clinical_note') or {}
+    if clinical_note.get('pdf'):
+        warm_up.submit(cache.note_key(appt_id, clinical_note.get('updated_at'), token), cache.download_note, clinical_note['pdf'], appt_id)
+
+
+def start_warm_up(owner, patient_id: int, appointments, token: str) -> WarmUp:
+    """
+    Warm the compile caches for the listed appointments (mirror rows) in the background.
+    Line items need no warm-up, they are already in the appointment mirror.
+    Reuses a still running warm-up of the same patient for `owner` (ex: user id), cancels one for another patient.
+    """
+    with _active_lock:
+        previous = _active.get(owner)
+        if previous is not None and not previous.done():
+            if previous.patient_id == patient_id:
+                return previous
+            previous.cancel()
+        warm_up = _active[owner] = WarmUp(patient_id)
+
+    warm_up.submit(cache.patient_key(patient_id, token), cache.fetch_patient, patient_id, token)
+    provider.warm(warm_up, appointments[:settings.PREFETCH_MAX_APPOINTMENTS], token)
+
+    for appt in appointments[:settings.PREFETCH_MAX_APPOINTMENTS]:
+        key = cache.details_key(appt.id, appt.updated_at, token)
+        details = cache.compile_cache().get(key)
+        if details is not None:
+            _warm_note(warm_up, appt.id, details, token)
+            continue
+
+        warm_up.submit(key, _fetch_details, warm_up, appt.id, token)
+    return warm_up
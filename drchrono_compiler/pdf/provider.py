@@ -0,0 +1,100 @@
+import asyncio
+import re
+import time
+
+import httpx
+from django.conf import settings
+
+from core import timing
+from core.api import aapi_get, api_get, response_json
+from . import cache, prefetch
+
+# Provider profile of a claim (HCFA boxes 24J and 31 to 33) and of the balance report: the doctor
+# (/doctors/{id}) and office (/offices/{id}) of an appointment. Practice data rarely changes, so
+# profiles live in the compile cache for PROVIDER_PROFILE_TTL. A profile older than
+# PROVIDER_PROFILE_REFRESH is still used and refetched in the background (pdf.prefetch pool).
+# The list page warm-up fetches the profiles of the listed appointments, so a compile only waits on
+# DrChrono for a doctor / office it has never seen, and then alongside its note downloads.
+# The federal tax id (box 25) is not in the API, it comes from PRACTICE_FEDERAL_ID.
+
+
+def profile_key(doctor_id, office_id) -> str:
+    return f"provider:{doctor_id}:{office_id}"
+
+
+def _phone(number: str | None) -> str:
+    # Box 33 prints the area code on its own: '678 404-7643'
+    digits = re.sub(r'\D', '', number or '')[-10:]
+    return f"{digits[:3]} {digits[3:6]}-{digits[6:]}" if len(digits) == 10 else ''
+
+
+def build(doctor: dict, office: dict | None) -> dict:
+    """
+    Profile from DrChrono doctor and office JSON, in fetch_hcfa_data() field names.
+    """
+    office = office or {}
+    first, last = doctor.get('first_name') or '', doctor.get('last_name') or ''
+    name = f"{first} {last}".strip()
+    return {
+        'provider_name': name,
+        'provider_npi': doctor.get('npi_number') or '',
+        'physician_signature': f"{first[:1]}. {last}" if first else last,
+        'provider_info': doctor.get('practice_group_name') or name,
+        'office': office.get('name') or '',
+        'provider_address': office.get('address') or '',
+        'provider_city_state': f"{office.get('city') or ''}, {office.get('state') or ''} {office.get('zip_code') or ''}".strip(', '),
+        'provider_number': _phone(office.get('phone_number') or doctor.get('office_phone')),
+        'fetched': time.time(),
+    }
+
+
+def fetch_profile(doctor_id: int, office_id: int | None, token: str) -> dict | None:
+    doctor = api_get(f"doctors/{doctor_id}", token, timeout=10)
+    office = api_get(f"offices/{office_id}", token, timeout=10) if office_id else None
+    if doctor.status_code != 200 or (office is not None and office.status_code != 200):
+        return None
+    return build(response_json(doctor), response_json(office) if office is not None else None)
+
+
+async def afetch_profile(client: httpx.AsyncClient, doctor_id: int, office_id: int | None, token: str) -> dict | None:
+    requests = [aapi_get(client, f"doctors/{doctor_id}", token, timeout=10)]
+    if office_id:
+        requests.append(aapi_get(client, f"offices/{office_id}", token, timeout=10))
+    doctor, *office = await asyncio.gather(*requests)
+    if doctor.status_code != 200 or any(resp.status_code != 200 for resp in office):
+        return None
+    return build(response_json(doctor), response_json(office[0]) if office else None)
+
+
+def appointment_pair(appt: dict) -> tuple | None:
+    """
+    (doctor id, office id) of an appointment's JSON, None without a doctor.
+    """
+    return (appt['doctor'], appt.get('office')) if appt.get('doctor') else None
+
+
+def warm(warm_up: 'prefetch.WarmUp', appointments, token: str) -> None:
+    """
+    Queue the profiles of mirrored appointments on a list page warm-up.
+    """
+    for pair in dict.fromkeys(filter(None, (appointment_pair(appt.data) for appt in appointments))):
+        warm_up.submit(profile_key(*pair), fetch_profile, *pair, token, timeout=settings.PROVIDER_PROFILE_TTL)
+
+
+@timing.span('provider_fetch')
+async def aprofiles(client: httpx.AsyncClient, appointments, token: str) -> dict:
+    """
+    {(doctor id, office id): profile or None} of verbose appointment dicts.
+    """
+    pairs = list(dict.fromkeys(filter(None, map(appointment_pair, appointments))))
+
+    async def lookup(doctor_id, office_id):
+        key = profile_key(doctor_id, office_id)
+        profile = await cache.aget_or_fetch(
+            key, lambda: afetch_profile(client, doctor_id, office_id, token), settings.PROVIDER_PROFILE_TTL,
+        )
+        if profile is not None and time.time() - profile['fetched'] > settings.PROVIDER_PROFILE_REFRESH:
+            prefetch.refresh(key, fetch_profile, doctor_id, office_id, token, timeout=settings.PROVIDER_PROFILE_TTL)
+        return profile
+
+    return dict(zip(pairs, await asyncio.gather(*(lookup(*pair) for pair in pairs))))
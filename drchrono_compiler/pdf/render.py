@@ -0,0 +1,95 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+
+# Optional process pool for the CPU bound render steps (HCFA overlays, balance table layout).
+# ReportLab and pypdf hold the GIL, so the thread pool of pdf.compile renders a big packet on one core;
+# with RENDER_PROCESSES > 0 claims and the balance report render in worker processes, which send back
+# finished PDF bytes for the parent to merge in order.
+# One pool per server worker process: gunicorn starts it from post_worker_init (gunicorn.conf.py),
+# anything else creates it on first use.
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker() -> None:
+    """
+    Worker process start up: set up Django (render code imports models) and parse the HCFA template once.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drchrono_compiler.settings')
+    import django
+    django.setup()
+    from .services import hcfa_template
+    hcfa_template()
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+# Render functions import pdf.services lazily: workers import this module before _init_worker set up Django
+
+def claim_pdf(data: dict) -> bytes:
+    """
+    One filled HCFA claim, from fetch_hcfa_data() output.
+    """
+    from core import metrics
+    from .services import generate_hcfa_bill
+    pdf = generate_hcfa_bill(None, data).getvalue()
+    metrics.hcfa_pages.inc()
+    return pdf
+
+
+def balance_pdf(patient: dict, valid_appts, items_by_appt: dict, provider_name: str = '', total_balance=None) -> bytes:
+    from .services import render_balance_report
+    return render_balance_report(patient, valid_appts, items_by_appt, provider_name, total_balance).getvalue()
+
+
+def process_pool() -> ProcessPoolExecutor | None:
+    """
+    This process's render pool, None when RENDER_PROCESSES is 0. A pool inherited over fork is not reused.
+    """
+    global _pool, _pool_pid
+    if not settings.RENDER_PROCESSES:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn, not fork: server workers run threads, forking them is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.RENDER_PROCESSES,
+                mp_context=get_context('spawn'),
+                initializer=_init_worker,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def start() -> list[int]:
+    """
+    Create the pool and spawn every worker now (each sets up Django and parses the template on start)
+    so the first compile does not pay for it. Returns the pids of workers that answered the warm-up
+    call, [] when process rendering is off.
+    """
+    pool = process_pool()
+    if pool is None:
+        return []
+    # Each submit without an idle worker spawns one, up to RENDER_PROCESSES
+    futures = [pool.submit(_ready) for _ in range(settings.RENDER_PROCESSES)]
+    return sorted({future.result() for future in futures})
+
+
+def shutdown(wait: bool = True) -> None:
+    """
+    Stop this process's pool. Also used to drop a pool whose worker died (BrokenProcessPool),
+    the next render then starts a fresh one.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        pool, _pool, _pool_pid = _pool, None, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
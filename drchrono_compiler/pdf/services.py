@@ -1,89 +1,56 @@
 from decimal import Decimal, InvalidOperation
-from datetime import datetime, timedelta
+from datetime import datetime
 from io import BytesIO
 
 import requests
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import (
-    SimpleDocTemplate,
-    Paragraph,
-    Spacer,
-    Table,
-    TableStyle,
-)
-
-def generate_balance_report(patient_id: int, token: str, provider_name: str = "Emily Kurokawa") -> BytesIO:
+
+from appts.services import historical_appointments, line_items_by_appointment, patient_balance, sync_patient
+from core import timing
+from .cache import patient_json
+
+# ReportLab and pypdf are imported where they are used: they are the bulk of a worker's import time and
+# memory, and only compiles need them. Under gunicorn core.startup loads them in the master instead.
+
+@timing.span('balance_report')
+def generate_balance_report(patient_id: int, token: str, provider_name: str = "") -> BytesIO:
     """
     Generate a clean, well-aligned balance report PDF matching the desired layout.
+    Appointments, line items and the balance are read from the local mirror (appts app), synced first.
     """
-    headers = {"Authorization": f"Bearer {token}"}
-    buffer = BytesIO()
-
     # ── Fetch patient
-    patient_url = f"https://app.drchrono.com/api/patients/{patient_id}"
-    patient_resp = requests.get(patient_url, headers=headers, timeout=10)
-    patient = patient_resp.json() if patient_resp.status_code == 200 else {}
+    patient = patient_json(patient_id, token) or {}
 
-    patient_name = f"{patient.get('last_name', '')}, {patient.get('first_name', '')}".strip() or "Unknown Patient"
+    # ── Appointments and line items come from the local mirror
+    sync_patient(patient_id, token)
+    valid_appts = list(historical_appointments(patient_id))
+    items_by_appt = line_items_by_appointment([appt.id for appt in valid_appts])
+    total_balance = patient_balance(patient_id).balance_total
 
-    # ── Fetch appointments
-    lookback_days = 365 * 3
-    since = (datetime.now() - timedelta(days=lookback_days)).strftime("%Y-%m-%dT00:00:00")
-    appts_url = (
-        f"https://app.drchrono.com/api/appointments"
-        f"?patient={patient_id}"
-        f"&since={since}"
-        f"&page_size=50"
-        f"&ordering='-scheduled_time'"
-        f"&verbose=true"
-    )
-    appts_resp = requests.get(appts_url, headers=headers, timeout=12)
+    return render_balance_report(patient, valid_appts, items_by_appt, provider_name, total_balance)
 
-    if appts_resp.status_code != 200:
-        appointments = []
-    else:
-        appointments = appts_resp.json().get("results", [])
-
-    today_iso = datetime.now().date().isoformat()
-    valid_appts = []
-    for appt in appointments:
-        # Check date
-        appt_date_str = appt.get("scheduled_time", "")[:10] or appt.get("date", "")
-        if appt_date_str > today_iso:
-            continue
-
-        # Check for clinical note PDF
-        clinical_note = appt.get('clinical_note')
-        if not clinical_note:
-            continue
-
-        pdf = clinical_note.get('pdf')
-
-        if pdf == 'None' or pdf is None:
-            continue
+@timing.span('balance_render')
+def render_balance_report(patient: dict, valid_appts, items_by_appt: dict, provider_name: str = "",
+                          total_balance: Decimal | None = None) -> BytesIO:
+    """
+    Lay out the balance report from already fetched data, no I/O (safe to run in the render executor).
+    `total_balance` is the materialized balance (appts PatientBalance), summed from the line items when not given.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
 
-        valid_appts.append(appt)
+    buffer = BytesIO()
+    patient_name = f"{patient.get('last_name', '')}, {patient.get('first_name', '')}".strip() or "Unknown Patient"
 
-    #Sort valid appointments
-    valid_appts = sorted(valid_appts, key=lambda x: x['scheduled_time'], reverse=True)
-    # ── Fetch line items ──────────────────────────────────────────────────────────
     transactions = []
     for appt in valid_appts:
-        appt_id = appt.get("id")
-
-        line_url = f"https://app.drchrono.com/api/line_items?appointment={appt_id}"
-        line_resp = requests.get(line_url, headers=headers)
-
-        if line_resp.status_code == 200:
-            items = line_resp.json().get("results", [])
-            for item in items:
-                item['reason'] = appt.get('reason', '---')
-                transactions.append(item)
+        for item in items_by_appt[appt.id]:
+            transactions.append({**item, 'reason': appt.reason or '---'})
     # ── Calculate total balance ──────────────────────────────────────────────────
-    total_balance = Decimal("0.00")
-    for transaction in transactions:
-        total_balance += Decimal(str(transaction.get("balance_total", "0")))
+    if total_balance is None:
+        total_balance = Decimal("0.00")
+        for transaction in transactions:
+            total_balance += Decimal(str(transaction.get("balance_total", "0")))
     transactions = sorted(transactions, key=lambda x: x['service_date'], reverse=True)
 
     # ── Build history rows ───────────────────────────────────────────────────────
@@ -187,34 +154,38 @@ def generate_balance_report(patient_id: int, token: str, provider_name: str = "E
 
 from io import BytesIO
 import requests
+from django.conf import settings
 from django.contrib import messages
+from .cache import note_pdf
 
 def generate_clinical_notes(request, appt: dict) -> BytesIO:
     """
     Input appointment dict, return clinical notes in Bytes, if exception return nothing and print message warning.
+    Downloads go through the compile cache, usually already warmed by the appointment list page.
     """
     appt_id = appt['id']
 
     # Fetch clinical note PDF URL
-    pdf_url = appt.get('clinical_note', {}).get('pdf')
+    pdf_url = (appt.get('clinical_note') or {}).get('pdf')
     if not pdf_url:
         messages.warning(request, f"No clinical note PDF found for appointment {appt_id} – skipped.")
         return BytesIO()
 
-    # Download and append clinical note PDF
-    note_resp = requests.get(pdf_url, timeout=15)
-    if note_resp.status_code == 200:
-        note_buffer = BytesIO(note_resp.content)
-        return note_buffer
+    # Download (or reuse) and append clinical note PDF
+    note_bytes = note_pdf(appt, request.drchrono_token)
+    if note_bytes is not None:
+        return BytesIO(note_bytes)
     else:
         messages.warning(request, f"Failed to download clinical note for {appt_id}")
         return BytesIO()
 
-def fetch_hcfa_data(patient_json, appt_json, line_item_json) -> dict:
+def fetch_hcfa_data(patient_json, appt_json, line_item_json, provider: dict | None = None) -> dict:
     """
-    Input patient, appointment and line item JSON, return formated data
+    Input patient, appointment and line item JSON and the provider profile (pdf.provider), return formated data.
+    Without a profile the provider boxes stay blank.
     """
-    
+    provider = provider or {}
+
     data = {
         #Top Section
         'patient_name': f"{patient_json.get('last_name', '')}, {patient_json.get('first_name', '')}",
@@ -242,20 +213,20 @@ def fetch_hcfa_data(patient_json, appt_json, line_item_json) -> dict:
 
         'service_place': '11', # HARD CODED
         'days_units': '1', # HARD CODED
-        'provider_npi': '1326453796', # HARD CODED
+        'provider_npi': provider.get('provider_npi', ''),
 
         #Very bottom section (MOSTLY HARD CODED)
-        'federal_id': '83-3726403',
+        'federal_id': settings.PRACTICE_FEDERAL_ID,
         'SSN': 'false',
         'EIN': 'true',
         'patient_account_number': '511594374305555',
         'accept_assignment': 'true',
-        'physician_signature': 'E. Kurokawa',
-        'office': 'Primary Office',
-        'provider_address': '4500 Satellite Blvd, Suite 1140',
-        'provider_city_state': 'Duluth, GA 30096',
-        'provider_number': '678 404-7643',
-        'provider_info': 'Back Pain MD'
+        'physician_signature': provider.get('physician_signature', ''),
+        'office': provider.get('office', ''),
+        'provider_address': provider.get('provider_address', ''),
+        'provider_city_state': provider.get('provider_city_state', ''),
+        'provider_number': provider.get('provider_number', ''),
+        'provider_info': provider.get('provider_info', ''),
     }
 
     for item in line_item_json:
@@ -266,15 +237,34 @@ def fetch_hcfa_data(patient_json, appt_json, line_item_json) -> dict:
 
     return data
 
+import threading
 from io import BytesIO
-from pypdf import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
+from pathlib import Path
 
+HCFA_TEMPLATE = Path(__file__).resolve().parent / 'static' / 'HCFA.pdf'
+_hcfa_template = None
+_hcfa_template_lock = threading.Lock()
+
+def hcfa_template():
+    """
+    The blank HCFA form (pypdf PdfReader), parsed once per process. Pages are cloned out under the lock, never modified in place.
+    """
+    from pypdf import PdfReader
+
+    global _hcfa_template
+    with _hcfa_template_lock:
+        if _hcfa_template is None:
+            _hcfa_template = PdfReader(BytesIO(HCFA_TEMPLATE.read_bytes()))
+        return _hcfa_template
+
+@timing.span('hcfa_render')
 def generate_hcfa_bill(request, data: dict) -> BytesIO:
     """
     Input patient, appointment and line item dict, return filled hcfa bill in bytes, if exception return nothing and print message warning.
     """
-    blank_pdf = 'pdf/static/HCFA.pdf'
+    from pypdf import PdfReader, PdfWriter
+    from reportlab.pdfgen import canvas
+
     buffer = BytesIO()
     HCFA_SIZE = (620, 800)
     c = canvas.Canvas(buffer, pagesize= HCFA_SIZE)
@@ -460,9 +450,9 @@ def generate_hcfa_bill(request, data: dict) -> BytesIO:
     c.drawString(190, height - 745, data['provider_city_state'])
 
     # Box 33 Provider info
-    data['provider_number'] = data['provider_number'].split(' ')
-    c.drawString(500, height - 712, data['provider_number'][0])
-    c.drawString(525, height - 712, data['provider_number'][1])
+    area_code, _, number = data['provider_number'].partition(' ')
+    c.drawString(500, height - 712, area_code)
+    c.drawString(525, height - 712, number)
     c.drawString(388 , height - 720, data['provider_info'])
     c.drawString(388, height - 735, data['provider_address'])
     c.drawString(388, height - 745, data['provider_city_state'])
@@ -474,13 +464,13 @@ def generate_hcfa_bill(request, data: dict) -> BytesIO:
     buffer.seek(0)
 
     # Merge overlay with blank template
-    template_pdf = PdfReader(blank_pdf)
+    template_pdf = hcfa_template()
     overlay_pdf = PdfReader(buffer)
 
     writer = PdfWriter()
-    page = template_pdf.pages[0]
+    with _hcfa_template_lock:
+        page = writer.add_page(template_pdf.pages[0])
     page.merge_page(overlay_pdf.pages[0])
-    writer.add_page(page)
 
     output = BytesIO()
     writer.write(output)
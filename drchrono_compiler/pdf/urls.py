@@ -7,4 +7,7 @@ urlpatterns = [
     path('patient/<int:patient_id>/generate-selected/',
          views.GenerateSelectedPDFView.as_view(),
          name='generate_selected'),
+    path('jobs/<str:job_id>/',
+         views.PacketJobView.as_view(),
+         name='packet_job'),
 ]
\ No newline at end of file
@@ -1,91 +1,181 @@
+import time
+
 from django.views import View
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.contrib import messages
-from django.shortcuts import redirect
-from verify.services import require_auth, get_valid_access_token
+from django.shortcuts import redirect, render
+from asgiref.sync import sync_to_async
+from verify.services import require_auth
 from django.utils.decorators import method_decorator
-from pypdf import PdfWriter
-from .services import (
-    generate_balance_report,
-    generate_clinical_notes,
-    fetch_hcfa_data,
-    generate_hcfa_bill,
-)
-from io import BytesIO
-import requests
-
-@method_decorator(require_auth, name='dispatch')
+from core import deadline, metrics, timing
+from core.profiling import profiled
+from core.api import DrChronoAPIError
+from appts.services import selected_appointment_ids
+from . import admission, jobs
+from .compile import compile_packet, packet_zip, record_run
+from .models import CompileRun
+
+@method_decorator(require_auth, name='post')
+@method_decorator(profiled, name='post')
 class GenerateSelectedPDFView(View):
+    """
+    Async compile view: fetches run concurrently (pdf.compile), so one ASGI worker serves many compiles at once.
+    `export=zip` streams the files separately in a ZIP archive instead of one merged PDF.
+    Selections are estimated first (pdf.admission): heavy ones need a free heavy compile slot, oversized
+    ones are handed to a background job (pdf.jobs) and the user to its page.
+    """
 
     # Verify DrChrono login access
     login_url = 'verify_app:connect_drchrono'
-    def dispatch(self, request, *args, **kwargs):
-        return super().dispatch(request, *args, **kwargs)
-    
-    def post(self, request, patient_id):
-        selected_ids = request.POST.getlist('selected_appts')
+    estimate = None
+
+    async def post(self, request, patient_id):
+        started = time.perf_counter()
+        with timing.span('selection'):
+            selected_ids = await sync_to_async(selected_appointment_ids)(patient_id, request.POST)
         if not selected_ids:
             messages.warning(request, "No appointments were selected for PDF generation.")
-            return redirect('appts:historical_list', patient_id=patient_id)
-
-        try:
-            selected_ids = list(reversed(selected_ids))
-            token = get_valid_access_token(request)
-            headers = {"Authorization": f"Bearer {token}"}
-
-            merger = PdfWriter()
-
-            balance_buffer = generate_balance_report(patient_id, token)
-            merger.append(balance_buffer)
-
-            # Pull appointment JSONs and key them into -> selected_appts{ APPT_ID : APPT_JSON }. Note - Later seperate pull into service file to include exception checks.
-            # If appointment JSON is pulled properly key line_item into -> line_items{ APPT_ID : LINE_ITEM_JSON}. Note - Later seperate pull into service file to include exception checks.
-            line_items = {}
-            selected_appts = {}
-            for appt_id in selected_ids:
-                url = f"https://app.drchrono.com/api/appointments/{appt_id}?verbose=true"
-                resp = requests.get(url, headers=headers)
-                if resp.status_code == 200:
-                    selected_appts[appt_id] = resp.json()
-                    url = f"https://app.drchrono.com/api/line_items?appointment={appt_id}"
-                    resp = requests.get(url, headers=headers)
-                    if resp.status_code == 200:
-                        line_items[appt_id] = resp.json().get('results')
-
-                    else:
-                        messages.warning(request, f'Could not fetch transaction details for {appt_id}. Response status {resp.text}. - skipped.')
-                else:
-                    messages.warning(request, f'Could not fetch appointment for {appt_id}. Response status {resp.text}. - skipped.')
-
-            # Pull patient JSON. Note - Later seperate pull into service file to include exception checks.
-            patient_json = {}
-            url = f"https://app.drchrono.com/api/patients/{patient_id}"
-            resp = requests.get(url, headers=headers)
-            if resp.status_code == 200:
-                patient_json = resp.json()
-            else:
-                messages.warning(request, f'Could not fetch patient information for {patient_id}. Response status {resp.text}. - skipped. ')
+            return redirect('appts_app:historical_list', patient_id=patient_id, patient_name=request.POST.get("patient_name"))
 
-            # Pull doctor JSON. Note - Later seperate pull into service file to include exception checks (Implement Later).
+        selected_ids = list(reversed(selected_ids))
+        compact = request.POST.get('compact') == '1'
+        with timing.span('admission'):
+            self.estimate = estimate = await sync_to_async(admission.estimate)(patient_id, selected_ids)
+            lease_seconds = jobs.lease_seconds() if estimate.background else admission.request_lease_seconds()
+            lease = await sync_to_async(admission.acquire)(lease_seconds) if estimate.heavy else None
+        if estimate.heavy and lease is None:
+            metrics.compile_admissions.labels('rejected').inc()
+            messages.error(
+                request,
+                f"Too many large packets are being compiled right now. Please try again in a few minutes or select "
+                f"fewer appointments (this selection: {estimate}).",
+            )
+            return redirect('appts_app:historical_list', patient_id=patient_id, patient_name=request.POST.get("patient_name"))
+        if estimate.background:
+            metrics.compile_admissions.labels('background').inc()
+            user = await request.auser()
+            try:
+                job_id = await sync_to_async(jobs.submit)(
+                    user.pk, patient_id, request.POST.get("patient_name") or '', selected_ids, request.drchrono_token,
+                    compact, estimate, lease,
+                )
+            except OSError as e:
+                await sync_to_async(lease.release)()
+                messages.error(request, f"Could not start the background compile: {e}.")
+                return redirect('appts_app:historical_list', patient_id=patient_id, patient_name=request.POST.get("patient_name"))
+            return redirect('pdf_app:packet_job', job_id=job_id)
+        metrics.compile_admissions.labels('heavy' if lease else 'light').inc()
 
-            for appt_id in selected_appts:
-                merger.append(generate_clinical_notes(request, selected_appts[appt_id]))
-                hcfa_data = fetch_hcfa_data(patient_json, selected_appts[appt_id], line_items[appt_id])
-                merger.append(generate_hcfa_bill(request, hcfa_data))
+        # Appointments fully rendered so far, for the partial result report when the deadline hits
+        compiled = []
+        try:
+            if request.POST.get('export') == 'zip':
+                response = await self.zip_response(request, patient_id, selected_ids, lease)
+                # A streamed archive releases the slot when it is done
+                lease = None
+                return response
+            with timing.span('compile'):
+                packet = await compile_packet(patient_id, selected_ids, request.drchrono_token, compiled, compact)
+            outcome = CompileRun.WARNINGS if packet.warnings else CompileRun.OK
+            await self.record(request, patient_id, selected_ids, outcome, started, packet, compact)
+            for warning in packet.warnings:
+                messages.warning(request, warning)
+            if packet.compaction:
+                messages.info(request, f"Packet compacted: {packet.compaction}")
 
-            output = BytesIO()
-            merger.write(output)
-            merger.close()
-            output.seek(0)
+            response = HttpResponse(packet.pdf, content_type='application/pdf')
+            response['Content-Disposition'] = f'attachment; filename="{packet.filename}"'
+            return response
 
-            response = HttpResponse(content_type='application/pdf')
-            filename = f"Patient_{patient_json.get('first_name')}_{patient_json.get('last_name')}_REPORT.pdf"
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            response.write(output.read())
+        except deadline.DeadlineExceeded as e:
+            await self.record(request, patient_id, selected_ids, CompileRun.DEADLINE, started)
+            pending = [str(appt_id) for appt_id in selected_ids if int(appt_id) not in compiled]
+            report = f"Compiled {len(compiled)} of {len(selected_ids)} appointments"
+            if compiled:
+                report += f" ({', '.join(map(str, compiled))})"
+            report += f", not compiled: {', '.join(pending)}."
+            messages.error(request, f"PDF generation stopped, the {e}. {report} No PDF was generated - try a smaller selection.")
+            return redirect('appts_app:historical_list', patient_id=patient_id, patient_name=request.POST.get("patient_name"))
 
-            return response
+        except DrChronoAPIError as e:
+            await self.record(request, patient_id, selected_ids, CompileRun.DRCHRONO_ERROR, started)
+            messages.error(request, f"DrChrono is rate limiting or unavailable, no PDF was generated. Please try again in a minute. ({e})")
+            return redirect('appts_app:historical_list', patient_id=patient_id, patient_name=request.POST.get("patient_name"))
 
         except Exception as e:
+            await self.record(request, patient_id, selected_ids, CompileRun.FAILED, started)
             patient_name = request.POST.get("patient_name")
             messages.error(request, f"PDF generation failed: {str(e)}.")
-            return redirect('appts_app:historical_list', patient_id=patient_id, patient_name=patient_name)
\ No newline at end of file
+            return redirect('appts_app:historical_list', patient_id=patient_id, patient_name=patient_name)
+
+        finally:
+            if lease is not None:
+                await sync_to_async(lease.release)()
+
+    async def record(self, request, patient_id, selected_ids, outcome, started, packet=None, compact=False):
+        # PDF compiles only: a streamed ZIP is still being produced when the view returns
+        if request.POST.get('export') == 'zip':
+            return
+        await sync_to_async(record_run)(
+            patient_id, len(selected_ids), outcome, time.perf_counter() - started, packet, compact,
+            self.estimate.seconds if self.estimate else None,
+        )
+
+    async def zip_response(self, request, patient_id, selected_ids, lease=None):
+        """
+        The ZIP export. Releases `lease` (a heavy compile slot) once the archive is finished or abandoned.
+        """
+        name = []
+        archive = packet_zip(patient_id, selected_ids, request.drchrono_token, name)
+        try:
+            # Fetch problems raise here, while a redirect with a message is still possible
+            with timing.span('zip_first_part'):
+                first = await anext(archive)
+
+            if isinstance(request, ASGIRequest):
+                # The stream owns the slot from here on
+                held, lease = lease, None
+
+                async def chunks():
+                    try:
+                        yield first
+                        async for chunk in archive:
+                            yield chunk
+                    finally:
+                        if held is not None:
+                            await sync_to_async(held.release)()
+                response = StreamingHttpResponse(chunks(), content_type='application/zip')
+            else:
+                # Under WSGI this view runs in a short lived event loop, the archive has to be finished in it
+                response = HttpResponse(first + b''.join([chunk async for chunk in archive]), content_type='application/zip')
+        finally:
+            if lease is not None:
+                await sync_to_async(lease.release)()
+        response['Content-Disposition'] = f'attachment; filename="{name[0]}"'
+        return response
+
+
+@method_decorator(require_auth, name='get')
+class PacketJobView(View):
+    """
+    Progress of a background compile (pdf.jobs), refreshing itself until the ZIP of parts can be downloaded.
+    """
+
+    login_url = 'verify_app:connect_drchrono'
+
+    def get(self, request, job_id):
+        job = jobs.state(job_id)
+        if job is None or job['user'] != request.user.pk:
+            raise Http404("No such compile")
+        if request.GET.get('download') == '1' and job['status'] == jobs.DONE:
+            try:
+                result = open(jobs.result_path(job_id), 'rb')
+            except FileNotFoundError:
+                raise Http404("The compiled packet has expired")
+            return FileResponse(result, as_attachment=True, filename=job['filename'], content_type='application/zip')
+        return render(request, 'pdf/packet_job.html', {
+            'job': job,
+            'job_id': job_id,
+            'running': job['status'] in (jobs.QUEUED, jobs.RUNNING),
+        })
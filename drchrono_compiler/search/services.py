@@ -1,11 +1,11 @@
 from verify.services import get_valid_access_token
 from verify.exceptions import DrChronoAuthError
 import requests
+from core import timing
+from core.api import DrChronoAPIError, api_get, response_json
 from django.contrib.auth.decorators import login_required
 from verify.services import require_auth
 
-DRCHRONO_BASE = "https://app.drchrono.com/api"
-
 @login_required(login_url='verify:connect_drchrono')
 @require_auth
 def search_patients(request, search_filters: dict) -> tuple[list[dict], str | None]:
@@ -19,7 +19,6 @@ def search_patients(request, search_filters: dict) -> tuple[list[dict], str | No
     except DrChronoAuthError as e:
         raise
     
-    headers = {"Authorization": f"Bearer {token}"}
     allowed = ["first_name", "last_name", "date_of_birth", "chart_id"]
     params = {
         "page_size": min(search_filters.get("page_size", 50), 200),
@@ -35,17 +34,18 @@ def search_patients(request, search_filters: dict) -> tuple[list[dict], str | No
             except:
                 pass
 
-    url = f"{DRCHRONO_BASE}/patients_summary"
-
     try:
-        resp = requests.get(url, headers=headers, params=params, timeout=10)
+        with timing.span('patient_search'):
+            resp = api_get("patients_summary", token, params=params, timeout=10)
         resp.raise_for_status()
-        data = resp.json()
+        data = response_json(resp)
 
         patients = data.get("results", [])
         next_cursor = data.get("next")
         return patients, next_cursor
     
+    except DrChronoAPIError:
+        raise
     except requests.HTTPError as e:
         status = e.response.status_code
         if status == 401:
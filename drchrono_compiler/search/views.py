@@ -5,6 +5,7 @@ from django.shortcuts import redirect
 from django.utils.decorators import method_decorator
 from django.contrib.auth.mixins import LoginRequiredMixin
 
+from core.api import DrChronoAPIError
 from verify.exceptions import DrChronoAuthError
 from .forms import PatientSearchForm
 from .services import search_patients  # from earlier sketch
@@ -54,6 +55,10 @@ class PatientSearchView(LoginRequiredMixin, FormView):
             messages.error(self.request, f"Authentication issue: {str(e)}. Please try again.")
             return self.form_invalid(form)
         
+        except DrChronoAPIError as e:
+            messages.error(self.request, f"DrChrono is rate limiting or unavailable right now, please try again shortly. ({e})")
+            return self.form_invalid(form)
+
         except ValueError as e:
             messages.error(self.request, "An error occurred while searching patients. Please try again or contact support.")
             return self.form_invalid(form)
@@ -67,6 +72,7 @@ class PatientSearchView(LoginRequiredMixin, FormView):
 
 from django.views import View
 from django.shortcuts import render
+from appts.models import PatientBalance
 
 @method_decorator(require_auth, name='dispatch')
 class PatientResultsView(View):
@@ -77,6 +83,12 @@ class PatientResultsView(View):
     
     def get(self, request):
         patients = request.session.get('patient_search_results', [])
+        # Balances of the patients already mirrored, one query, no DrChrono call
+        balances = dict(
+            PatientBalance.objects.filter(patient__in=[patient['id'] for patient in patients])
+            .values_list('patient', 'balance_total')
+        )
+        patients = [{**patient, 'balance': balances.get(patient['id'])} for patient in patients]
         filters = request.session.get('patient_search_filters', {})
         next_cursor = request.session.get('patient_next_cursor')
 
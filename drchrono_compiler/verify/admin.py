@@ -4,5 +4,5 @@ from .models import DrChronoCredential
 # Register your models here.
 @admin.register(DrChronoCredential)
 class DrChronoCredentialAdmin(admin.ModelAdmin):
-    list_display = ('user', 'created_at', 'expires_at', 'is_expired')
-    readonly_fields = ('created_at', 'updated_at')
\ No newline at end of file
+    list_display = ('user', 'created_at', 'expires_at', 'is_expired', 'last_refresh_at', 'last_refresh_ms', 'refresh_failures')
+    readonly_fields = ('created_at', 'updated_at', 'last_refresh_at', 'last_refresh_ms', 'refresh_failures', 'last_refresh_error')
\ No newline at end of file
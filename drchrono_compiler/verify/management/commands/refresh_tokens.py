@@ -0,0 +1,82 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from verify.exceptions import DrChronoAuthError
+from verify.models import DrChronoCredential
+from verify.services import refresh_credential
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh DrChrono access tokens that expire within the refresh window, ahead of time, "
+        "so the request path never has to wait on the token endpoint. "
+        "Runs once by default, --loop keeps it running as a daemon."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, default=settings.TOKEN_REFRESH_WINDOW, help='Refresh tokens expiring within this many seconds')
+        parser.add_argument('--concurrency', type=int, default=settings.TOKEN_REFRESH_CONCURRENCY, help='Max parallel refreshes')
+        parser.add_argument('--loop', action='store_true', help='Keep scanning every --interval seconds')
+        parser.add_argument('--interval', type=int, default=settings.TOKEN_REFRESH_INTERVAL, help='Seconds between scans with --loop')
+
+    def handle(self, *args, **options):
+        window = timedelta(seconds=options['window'])
+        while True:
+            self.scan(window, options['concurrency'])
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def due(self, window: timedelta):
+        """
+        Credentials expiring within `window` (index on expires_at) that still have a refresh token
+        and have not failed TOKEN_REFRESH_MAX_FAILURES times in a row.
+        """
+        return (
+            DrChronoCredential.objects
+            .filter(Q(expires_at__lte=timezone.now() + window) | Q(expires_at__isnull=True))
+            .filter(refresh_failures__lt=settings.TOKEN_REFRESH_MAX_FAILURES)
+            .exclude(refresh_token__isnull=True)
+            .exclude(refresh_token='')
+            .order_by('expires_at')
+        )
+
+    def scan(self, window: timedelta, concurrency: int) -> None:
+        creds = list(self.due(window))
+        if not creds:
+            self.stdout.write("No tokens due for refresh")
+            return
+
+        def refresh(cred):
+            started = time.monotonic()
+            try:
+                refresh_credential(cred, window)
+                return cred, time.monotonic() - started, None
+            except DrChronoAuthError as e:
+                return cred, time.monotonic() - started, str(e)
+            finally:
+                # Each worker thread holds its own DB connection
+                close_old_connections()
+
+        durations, failed = [], 0
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(creds)))) as pool:
+            for cred, elapsed, error in pool.map(refresh, creds):
+                if error:
+                    failed += 1
+                    self.stderr.write(f"Refresh failed for {cred.user}: {error}")
+                else:
+                    durations.append(elapsed * 1000)
+
+        summary = f"Refreshed {len(durations)}/{len(creds)} tokens, {failed} failed"
+        if durations:
+            summary += f", p50 {statistics.median(durations):.0f} ms, max {max(durations):.0f} ms"
+        self.stdout.write(summary)
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.10 on 2026-10-19 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verify', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drchronocredential',
+            name='last_refresh_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='drchronocredential',
+            name='last_refresh_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='drchronocredential',
+            name='last_refresh_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='drchronocredential',
+            name='refresh_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='drchronocredential',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -7,13 +7,24 @@ class DrChronoCredential(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='drchrono_cred')
     access_token = models.CharField(max_length=255)
     refresh_token = models.CharField(max_length=255, blank=True, null=True)
-    expires_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
     scope = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Refresh metrics (lazy and proactive refreshes)
+    last_refresh_at = models.DateTimeField(null=True, blank=True)
+    last_refresh_ms = models.PositiveIntegerField(null=True, blank=True)
+    refresh_failures = models.PositiveIntegerField(default=0)
+    last_refresh_error = models.TextField(blank=True)
+
     @property
     def is_expired(self):
         if not self.expires_at:
             return True
         return timezone.now() >= self.expires_at
+
+    def expires_within(self, window) -> bool:
+        if not self.expires_at:
+            return True
+        return timezone.now() + window >= self.expires_at
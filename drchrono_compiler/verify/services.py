@@ -1,7 +1,12 @@
+import threading
+import time
 import requests
 from datetime import timedelta
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
+from core import deadline, metrics, timing
 from .models import DrChronoCredential
 from .exceptions import DrChronoAuthError
 
@@ -21,7 +26,8 @@ def refresh_token(cred: DrChronoCredential) -> DrChronoCredential:
     }
 
     try:
-        resp = requests.post(settings.DRCHRONO_TOKEN_URL, data=payload, timeout=10)
+        started = time.monotonic()
+        resp = requests.post(settings.DRCHRONO_TOKEN_URL, data=payload, timeout=deadline.timeout(10, 'token refresh'))
         resp.raise_for_status()
         data = resp.json()
 
@@ -30,36 +36,95 @@ def refresh_token(cred: DrChronoCredential) -> DrChronoCredential:
         cred.refresh_token = data.get('refresh_token', cred.refresh_token)
         cred.expires_at = timezone.now() + timedelta(seconds=data['expires_in'])
         cred.scope = data.get('scope', cred.scope)
+        cred.last_refresh_at = timezone.now()
+        cred.last_refresh_ms = int((time.monotonic() - started) * 1000)
+        cred.refresh_failures = 0
+        cred.last_refresh_error = ''
         cred.save()
+        metrics.token_refreshes.labels('ok').inc()
 
         return cred
     except requests.HTTPError as e:
+        metrics.token_refreshes.labels('failed').inc()
         if e.response.status_code in (400, 401):
             # Refresh needed
             raise DrChronoAuthError('scope', cred.scope)
         raise DrChronoAuthError(f"Refresh failed: {e}")
     except requests.RequestException as e:
+        metrics.token_refreshes.labels('failed').inc()
         raise DrChronoAuthError(f"Network error during refresh: {e}")
 
+# One lock per credential id so concurrent requests of the same user in this process refresh once
+_refresh_locks = {}
+_refresh_locks_guard = threading.Lock()
+
+def _credential_lock(cred_id: int) -> threading.Lock:
+    with _refresh_locks_guard:
+        return _refresh_locks.setdefault(cred_id, threading.Lock())
+
+@timing.span('token_refresh')
+def refresh_credential(cred: DrChronoCredential, window: timedelta = timedelta(0)) -> DrChronoCredential:
+    """
+    Single-flight refresh: only one refresh runs per credential, other callers wait and reuse its result.
+    Guarded by a process lock and a row lock (select_for_update) for other workers.
+    Refreshes when the token expires within `window` (0 -> only once expired).
+    """
+    try:
+        with _credential_lock(cred.pk):
+            with transaction.atomic():
+                locked = DrChronoCredential.objects.select_for_update().get(pk=cred.pk)
+                # Refreshed by whoever held the lock before us
+                if not locked.expires_within(window):
+                    return locked
+                return refresh_token(locked)
+    except DrChronoAuthError as e:
+        # Recorded outside the rolled back transaction
+        DrChronoCredential.objects.filter(pk=cred.pk).update(
+            last_refresh_at=timezone.now(),
+            refresh_failures=F('refresh_failures') + 1,
+            last_refresh_error=str(e)[:500],
+        )
+        raise
+
 def get_valid_access_token(request) -> str:
     """
     Returns valid bearer token or raises auth error
-    Intended for other apps/views
+    Intended for other apps/views. Memoized on the request, so repeat calls cost nothing.
     """
-    
+    token = getattr(request, 'drchrono_token', None)
+    if token:
+        return token
+
     try:
         cred = request.user.drchrono_cred
-        if not cred.is_expired:
-            return cred.access_token
-        refreshed_cred = refresh_token(cred)
-        return refreshed_cred.access_token
+        if cred.is_expired:
+            cred = refresh_credential(cred)
+        request.drchrono_token = cred.access_token
+        return cred.access_token
     except DrChronoCredential.DoesNotExist:
         raise DrChronoAuthError("No DrChrono credentials found for this user")
 
-# Decorator for views that need API acess
+# Decorator for views that need API acess (sync or async views)
 from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from django.shortcuts import redirect
 def require_auth(view_func):
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            user = await request.auser()
+            if not user.is_authenticated:
+                return redirect('verify_app:connect_drchrono')
+
+            try:
+                request.drchrono_token = await sync_to_async(get_valid_access_token)(request)
+            except DrChronoAuthError as e:
+                # Restart Oauth flow
+                return redirect('verify_app:connect_drchrono')
+
+            return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
     @wraps(view_func)
     def wrapper(request, *args, **kwargs):
         if not request.user.is_authenticated:
@@ -4,15 +4,18 @@ from django.contrib.auth import login
 from django.contrib.auth.models import User
 from django.conf import settings
 import requests
-from requests_oauthlib import OAuth2Session
+from core.api import api_get
 from .models import DrChronoCredential
 from django.utils import timezone
 from datetime import timedelta
 
 # Contains authentication views (functions called via urls [check urls.py])
+# requests-oauthlib is imported inside the two OAuth views, the only code using it
 
 # Starting point for authorization connect_drchrono -> oauth_callback.
 def connect_drchrono(request):
+    from requests_oauthlib import OAuth2Session
+
     oauth = OAuth2Session(
         settings.DRCHRONO_CLIENT_ID,
         redirect_uri=settings.DRCHRONO_REDIRECT_URI,
@@ -23,6 +26,8 @@ def connect_drchrono(request):
     return redirect(authorization_url)
 
 def oauth_callback(request):
+    from requests_oauthlib import OAuth2Session
+
     oauth = OAuth2Session(
         settings.DRCHRONO_CLIENT_ID,
         redirect_uri=settings.DRCHRONO_REDIRECT_URI,
@@ -43,9 +48,11 @@ def oauth_callback(request):
     refresh_token = token.get('refresh_token')
     expires_in = token.get('expires_in', 3600)
 
-    headers = {'Authorization': f"Bearer {access_token}"}
-    user_resp = requests.get('https://app.drchrono.com/api/users/current', headers=headers)
-    if user_resp.status_code != 200:
+    try:
+        user_resp = api_get('users/current', access_token, timeout=10)
+    except requests.RequestException:
+        user_resp = None
+    if user_resp is None or user_resp.status_code != 200:
         messages.error(request, "Could not fetch user information from DrChrono")
         return redirect('verify_app:connect_drchrono')
     
@@ -67,6 +74,8 @@ def oauth_callback(request):
             'refresh_token': refresh_token,
             'expires_at': timezone.now() + timedelta(seconds=expires_in),
             'scope': ' '.join(settings.DRCHRONO_SCOPES.split()),
+            'refresh_failures': 0,
+            'last_refresh_error': '',
         }
     )
 